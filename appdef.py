@@ -166,6 +166,13 @@ class DEF_SYSTEMTYPES(Enum):
     RKM_S  =  3 #RKM Stationary/Cable 
      
     
+class DEF_CALIBRATION(Enum):
+    '''
+    CALIBRATION ROUTINES (SensorXKM calib) -> None means default calibration (sum of the input channels)
+    '''
+    TEST_1_FAKT = 1 #test routine: sum of the input channels with factor 10
+    TEST_2_SUM = 2 #test routine: sum of the input channels
+    
 class DEF_GATEWAYTYPES(Enum):
     '''
     @TODO: is this still needed -> move into comdevs?
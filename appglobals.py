@@ -44,6 +44,7 @@ class Globals():
         self.system = None #measurement system handle (the measurement system currently active)
         self.sensors = None #sensor list handle (part of the measurement system)
         self.channels = None #measurement channel handle (part of the measurement system)
+        self.mdata_cur = None #current measurement data object (MeasurementData), see mdata()
 
         # Global working variables for threading
         ########################################
@@ -112,12 +113,13 @@ class Globals():
         raise AssertionError("needs implementation")
     
     def mdata(self, mdata=None):
-        ''' update measurement data, thread safe style '''
-        if mdata != None:
-            self.lock_mdata.acquire()
-            self.mdata = mdata
-            self.lock_mdata.release()
-        return mdata
+        ''' 
+        set (if not None) and return the current measurement data object, thread safe style: swapping the object
+        reference is atomic, readers use MeasurementData.snapshot() for consistent data -> no lock needed
+        '''
+        if mdata is not None:
+            self.mdata_cur = mdata
+        return self.mdata_cur
     
     #@TODO: other data structure
     #def vehicle(self, vehicledata=None):
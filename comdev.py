@@ -3,6 +3,7 @@ PRODAT XKM comdev.py - application communication device abstractions with a stan
 Support for:
     * serialport (hardware) = SERIALPORT -> serialport data exchange
     * measurement data files = MDATATFILE -> file system data exchange
+    * replay of recorded sessions = REPLAY -> archived sessions or raw captures fed back at N x real time
 
 '''
 #python data types
@@ -14,9 +15,16 @@ import sys
 from enum import Enum
 
 #3rd party (needs installation)
+import numpy
 import serial
 import serial.tools.list_ports_windows
 
+#project specific
+try:
+    from libxkm import measdata
+except ModuleNotFoundError:
+    import measdata #timestamp resolution (DEF_NS_PER_S)
+
 
 DBG_OUT = False #enable/disable additional print debugging output
 
@@ -33,6 +41,7 @@ class COMTYPES(Enum):
     XKMSERV_REST = 3 #XKM server via REST API
     XBEE_GENERIC = 4 #general xbee module type
     BASESTATION_XBEE = 5 #XBEE basestation module
+    REPLAY = 6 #replay of recorded measurement data (archive or raw capture)
 
 class COMMODES(Enum):
     ''' operation modes '''
@@ -161,6 +170,155 @@ class ComDevFile(ComDev):
         ''' return device information '''
         return f"COM {self.devtype.name}: F-READ={self.cfg_fread} F-WRITE={self.cfg_fwrite}"
 
+class ComDevReplay(ComDevFile):
+    '''
+    replay of recorded sessions -> feeds recorded rows back through the same path live data takes:
+        * archived sessions (meas_archive.MeasurementArchive, read chunk by chunk)
+        * raw captures (text file, one row per line: timestamp in seconds followed by the channel values)
+    speed .. 1.0 real time, N -> N x real time, None/0 -> as fast as possible (deterministic benchmarking)
+    rows are paced by the monotonic clock against their recorded timestamps (the recorded timestamps are kept)
+    '''
+
+    devtype = COMTYPES.REPLAY
+
+    def __init__(self, ident="REPLAY", file_to_read="senval_capture.txt", archive=None, p_dir=None, speed=1.0,
+                 blocksize=256, chans=None, t0=None, t1=None, delimiter=None, **kwargs):
+        '''
+        file_to_read .. raw capture file (used if archive is None)
+        archive .. name of an archived session in p_dir (None -> raw capture)
+        chans .. channel columns to replay (None -> all), t0/t1 .. time range in seconds (None -> complete session)
+        blocksize .. maximum number of rows returned by read()
+        '''
+        super().__init__(ident=ident, file_to_read=file_to_read, file_to_write=None, **kwargs)
+        self.cfg_archive = archive
+        self.cfg_p_dir = p_dir
+        self.cfg_speed = speed
+        self.cfg_blocksize = int(blocksize)
+        self.cfg_chans = chans
+        self.cfg_t0 = t0
+        self.cfg_t1 = t1
+        self.cfg_delimiter = delimiter
+        self.rewind()
+
+    def rewind(self):
+        ''' restarts the replay with the first recorded row (the source is reopened with the next read) '''
+        self._segments = None #iterator over the recorded segments (ts, y)
+        self._ts = numpy.zeros(shape=(0,), dtype=numpy.int64) #pending rows of the current segment
+        self._y = None
+        self.ts_first = None #first recorded timestamp (ns) -> replay time 0
+        self.clk_first = None #monotonic clock (ns) at replay time 0
+        self.count = 0 #rows replayed
+        self.eof = False
+
+    def _segments_archive(self):
+        ''' segments of an archived session -> one segment per chunk, nothing is loaded in advance '''
+        try:
+            from libxkm import meas_archive
+        except ModuleNotFoundError:
+            import meas_archive
+        reader = meas_archive.ArchiveReader(self.cfg_archive, p_dir=self.cfg_p_dir)
+        ns0 = None if self.cfg_t0 is None else round(self.cfg_t0*measdata.DEF_NS_PER_S)
+        ns1 = None if self.cfg_t1 is None else round(self.cfg_t1*measdata.DEF_NS_PER_S)
+        for rec in reader.chunks(self.cfg_t0, self.cfg_t1):
+            t0 = int(rec["ts0"]) if ns0 is None else max(int(rec["ts0"]), ns0)
+            t1 = int(rec["ts1"]) if ns1 is None else min(int(rec["ts1"]), ns1)
+            yield reader.read(t0, t1, chans=self.cfg_chans, ns=True)
+
+    def _segments_capture(self):
+        ''' raw capture -> a single segment '''
+        data = numpy.loadtxt(self.cfg_fread, delimiter=self.cfg_delimiter, ndmin=2, comments="#")
+        ts = numpy.round(data[:, 0]*measdata.DEF_NS_PER_S).astype(numpy.int64)
+        y = data[:, 1:] if self.cfg_chans is None else data[:, 1:][:, list(self.cfg_chans)]
+        sel = numpy.ones(shape=ts.shape, dtype=bool)
+        if self.cfg_t0 is not None: sel &= ts >= round(self.cfg_t0*measdata.DEF_NS_PER_S)
+        if self.cfg_t1 is not None: sel &= ts <= round(self.cfg_t1*measdata.DEF_NS_PER_S)
+        yield (ts[sel], y[sel])
+
+    def open(self):
+        ''' opening the recorded session for reading '''
+        if self._segments is None:
+            self._segments = self._segments_archive() if self.cfg_archive is not None else self._segments_capture()
+            self.mode = COMMODES.CONNECTED
+
+    def close(self):
+        ''' close the recorded session '''
+        if self._segments is not None: self._segments.close()
+        self.rewind()
+        self.mode = COMMODES.DISCONNECTED
+
+    def write(self, *args):
+        ''' replay is read only '''
+        pass
+
+    def flush(self):
+        ''' nothing to flush '''
+        pass
+
+    def _pending(self):
+        ''' makes sure rows of the current segment are pending -> False at the end of the session '''
+        while len(self._ts) == 0:
+            try:
+                self._ts, self._y = next(self._segments)
+            except StopIteration:
+                self.eof = True
+                return False
+        return True
+
+    def read(self, block=True):
+        '''
+        returns the next rows due (ts int64 ns (n,), y (n, chans)), at most blocksize rows
+            block .. True -> waits until the next row is due, False -> returns (possibly empty) rows due now
+        returns None at the end of the session
+        '''
+        self.open()
+        if not self._pending(): return None
+        if self.ts_first is None:
+            self.ts_first = int(self._ts[0])
+            self.clk_first = time.monotonic_ns()
+        num = min(self.cfg_blocksize, len(self._ts))
+        if self.cfg_speed:
+            t_due = self.ts_first + (time.monotonic_ns() - self.clk_first) * self.cfg_speed #replay time (recorded ns)
+            if block and self._ts[0] > t_due:
+                time.sleep((self._ts[0] - t_due) / self.cfg_speed * 1e-9)
+                t_due = self._ts[0]
+            num = int(numpy.searchsorted(self._ts[:num], t_due, side="right"))
+        ts, y = self._ts[:num], self._y[:num]
+        self._ts, self._y = self._ts[num:], self._y[num:]
+        self.count += num
+        return (ts, y)
+
+    def replay(self, target, rows_max=None):
+        '''
+        replays the session into target until its end (or rows_max rows) -> returns the number of rows replayed
+            target .. MeasurementData (update_block()) or MeasurementSystemXKM (input channels of its sensors)
+        '''
+        count = 0
+        while rows_max is None or count < rows_max:
+            ret = self.read()
+            if ret is None: break
+            ts, y = ret
+            if rows_max is not None: ts, y = ts[:rows_max-count], y[:rows_max-count]
+            if len(ts) == 0: continue
+            if hasattr(target, "sensors"): self._feed_system(target, y)
+            else: target.update_block(y, t_ns=ts)
+            count += len(ts)
+        return count
+
+    @staticmethod
+    def _feed_system(meassys, y):
+        ''' distributes the rows onto the sensors (columns in the order of meassys.chans_in) '''
+        col = 0
+        with meassys.sensors_lock:
+            for sen in meassys.sensors:
+                cols = len(sen.chans_in)
+                sen.md_update_block(y[:, col:col+cols])
+                col += cols
+
+    def __str__(self):
+        ''' return device information '''
+        src = f"ARCHIVE={self.cfg_archive}" if self.cfg_archive is not None else f"F-READ={self.cfg_fread}"
+        return f"COM {self.devtype.name}: {src} SPEED={self.cfg_speed or 'MAX'}"
+
 class ComDevSerial(ComDev):
     '''
     a serial hardware port on the system (on windows COM9 / linux tty 
@@ -506,6 +664,54 @@ def test_hw_comdevxbee_regularusage(comport="", baudrate=57600):
                 time_stop = time.time() - time_start
                 print("RUNTIME=%f per 100" % time_stop)            
 
+def test_comdevreplay_regularusage(tmp_path):
+    print("testing comdevreplay: regularusage")
+    import meas_archive
+    fs = 1000.0
+    t = numpy.arange(0, 2000) / fs
+    rows = numpy.stack((numpy.sin(t), numpy.cos(t), t), axis=1)
+    p_capture = os.path.join(str(tmp_path), "capture.txt")
+    numpy.savetxt(p_capture, numpy.column_stack((t, rows)), header="t chan0 chan1 chan2")
+
+    #as fast as possible -> deterministic, identical to the recorded data
+    replay = ComDevReplay(file_to_read=p_capture, speed=None, blocksize=300)
+    mdata = measdata.MeasurementData([0, 1, 2], max_short=4000)
+    assert replay.replay(mdata) == 2000 and replay.eof and replay.read() is None
+    assert numpy.allclose(mdata.window_y(), rows) and numpy.allclose(mdata.window_ts(), numpy.round(t*measdata.DEF_NS_PER_S))
+
+    #archived session, time range and channel selection, N x real time
+    arc = meas_archive.MeasurementArchive(3, chunk_rows=256, p_dir=str(tmp_path), name="replay")
+    arc.write(rows, numpy.round(t*measdata.DEF_NS_PER_S).astype(numpy.int64))
+    arc.close()
+    replay = ComDevReplay(archive="replay", p_dir=str(tmp_path), speed=10.0, chans=[2], t0=0.5, t1=1.0)
+    mdata = measdata.MeasurementData([0], max_short=1000)
+    time_start = time.monotonic()
+    assert replay.replay(mdata) == 501 and replay.count == 501
+    assert 0.045 < time.monotonic() - time_start < 0.5 #0.5 s recorded at 10x
+    assert numpy.allclose(mdata.window_y()[:, 0], t[500:1001])
+    replay.close()
+    assert replay.mode == COMMODES.DISCONNECTED and replay.read(block=False) is not None #rewound
+
+def test_comdevreplay_system(tmp_path):
+    print("testing comdevreplay: replay into a measurement system")
+    import appdef
+    import meassys
+    import meas_sensor
+    rows = numpy.random.default_rng(5).normal(size=(100, 6))
+    p_capture = os.path.join(str(tmp_path), "capture_sys.txt")
+    numpy.savetxt(p_capture, numpy.column_stack((numpy.arange(0, 100) / 1000.0, rows)))
+    sensors = [meas_sensor.SensorXKM(appdef.DEF_SENSORTYPES.PRO_PINT_W_CH4, addr_node=1, addr_group=4),
+               meas_sensor.SensorXKM(appdef.DEF_SENSORTYPES.PRO_RKM_W_2CH, addr_node=2, addr_group=1)]
+    msys = meassys.MeasurementSystemXKM(sensors=sensors)
+    msys.md_layout_plan(rows=40)
+
+    replay = ComDevReplay(file_to_read=p_capture, speed=None, blocksize=33) #blocks wrap the ring
+    assert replay.replay(msys) == 100 and msys.md_ring.count == 100
+    md_out, md_in = msys.md_current()
+    assert md_in.shape == (40, 6) and numpy.allclose(md_in, rows[::-1][:40]) #newest first, columns of chans_in
+    assert numpy.allclose(sensors[0].md_current_in(1), rows[-1, 0:4])
+    assert numpy.allclose(sensors[1].md_current_in(3), rows[:-4:-1, 4:6])
+
 def test_comdevxbee_regularusage():
     print("testing comdevxbee: regularusage")
     import testdata
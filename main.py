@@ -419,6 +419,8 @@ class MeasureOscilloscopeMainWidget(BoxLayout):
         #Referenz zum MatplotFigureCustom-Objket
         self.matplotfigure = None   
         self.timeidx = 0
+        self.measurement_data = None #last shown measurement data (for HOLD/SAVE)
+        self.hold = None #held measurement data (MeasurementSnapshot), None if not in HOLD mode
     def build_gui(self):
         
         #TODO ggf. komplett automatisch erstellen? Dazu muss auch der KV-String teil dynamisiert werden...
@@ -488,9 +490,27 @@ class MeasureOscilloscopeMainWidget(BoxLayout):
 
     def ev_btn_save(self):   
         if dbg.DBG_OUT: print("screen_measosci_guikv: ev_btn_save")     
+        if self.measurement_data is None: return
+        self.measurement_data.save(myident="SAVE", saveinfo="Oszilloskop: " + time.strftime("%d.%m.%Y %H:%M:%S"))
 
     def ev_btn_hold(self):   
         if dbg.DBG_OUT: print("screen_measosci_guikv: ev_btn_hold")    
+        if self.hold is not None: #release
+            self.hold = None
+            self.ev_btn_start()
+        elif self.measurement_data is not None: #freeze the shown window, copy-on-write -> ingest is not stalled
+            index, ident = self.measurement_data.save(myident="HOLD", saveinfo="Oszilloskop HOLD")
+            self.hold = self.measurement_data.saved(index-1)
+            self.ev_btn_stop()
+            self.draw_hold()
+
+    def draw_hold(self):
+        '''
+        draws the held snapshot (all saved rows, one line per sensor channel) into the plot
+        '''
+        if self.hold is None: return
+        names = [self.sensor_dict[ident].ids.entry_sensorname.text for ident in self.sensor_dict]
+        self.livePlot.show_snapshot(self.hold.t, self.hold.values(), names)
 
     def ev_btn_sensor(self,button,sensor):
         if dbg.DBG_OUT: print("screen_measosci_guikv: ev_btn_sensor " + button.text + " " + sensor.df_type_v)    
@@ -587,7 +607,10 @@ class MeasureOscilloscopeMainWidget(BoxLayout):
 
     '''
     def update_measurement_data(self,measurement_data):
-        self.update_numpy_data(measurement_data.md_current_y[0],measurement_data.md_current_t[0])
+        self.measurement_data = measurement_data
+        if self.hold is not None: return #HOLD: the shown data is frozen
+        data_t, data_y, count = measurement_data.snapshot(num=1) #lock-free consistent read of the newest row
+        if count > 0: self.update_numpy_data(data_y[0],data_t[0])
 
     ''' Aktualisiert die GUI mit den angegebenen Messwerten.
         Achtung: Die Liste muss genausoviele Elemente haben, wie sie durch die festgelegten
@@ -1131,6 +1154,22 @@ class LivePlot(object):
 
 
 
+    def show_snapshot(self, t, y, names):
+        '''
+        replaces the shown lines by a saved snapshot (HOLD) -> t (N,) seconds, y (N, chans), names .. line per column
+        '''
+        if dbg.DBG_OUT: print("LivePlot: show_snapshot")
+        for col, lineID in enumerate(names[:y.shape[1]]):
+            if not lineID in self.lineX:
+                self.lineX[lineID], = self.ax.plot([], [], label=lineID)
+            self.lineX[lineID].set_data(t, y[:, col])
+        self.ax.legend(loc='upper right')
+        self.ax.relim()
+        self.ax.autoscale_view(True, True, True)
+        self.fig.canvas.draw_idle()
+
+
+
 class MeasureOscilloscopeApp(App):
     '''
     Standallone-Test-App class
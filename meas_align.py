@@ -0,0 +1,218 @@
+'''
+meas_align.py .. alignment of asynchronous sensor streams onto a common time base (i.e., wireless sensors with different
+rates and jitter)
+
+Each source (sensor) delivers blocks of timestamped samples for its channels. The alignment engine resamples all sources
+onto a common grid with the target rate fs (zero-order hold or linear interpolation, vectorized for each block with
+numpy.searchsorted) and emits synchronous rows (channels of all sources concatenated in the order of the sources):
+
+    source 0: ts0 (N0,), vals0 (N0, chans0) --+
+    source 1: ts1 (N1,), vals1 (N1, chans1) --+--> process() -> ts (M,), rows (M, chans0+chans1+..) -> MeasurementData
+    ...                                       --+
+
+A grid row is emitted as soon as all sources delivered samples up to its time. Rows older than the newest timestamp -
+latency (default DEF_LATENCY) are emitted anyway (a late source holds its last value) -> bounded latency, a source that
+stops delivering does not stall the others. latency=None waits for all sources without bound.
+Cross-sensor math (i.e., the sum of wheel loads) is done on aligned rows instead of misaligned, padded rows.
+'''
+#3rd party
+import numpy as np
+import pytest
+
+#project specific
+try:
+    from libxkm import measdata
+except ModuleNotFoundError:
+    import measdata
+
+DBG_OUT = False #enable/disable debugging output
+
+DEF_MODES = ("hold", "linear")
+DEF_LATENCY = 1.0 #default maximum latency in seconds (larger than the block interval of the sources)
+
+class MeasurementAlign():
+    '''
+    resampling of asynchronous sources onto a common time base
+    '''
+    def __init__(self, sources, fs, mode="linear", latency=DEF_LATENCY, mdata=None):
+        '''
+        sources .. number of channels for each source, i.e., [2, 2, 1]
+        fs .. target rate of the common time base (Hz)
+        mode .. "hold" (zero-order hold, last value) or "linear" (linear interpolation between samples)
+        latency .. maximum latency in seconds (rows are emitted even if a source is behind), None -> wait for all sources
+                   without bound (a source that stops delivering stalls the output)
+        mdata .. optional synchronous measurement data, the aligned rows are written to (update_block())
+        '''
+        if mode not in DEF_MODES: raise ValueError(f"unknown alignment mode: {mode}")
+        self.sources = [int(chans) for chans in sources]
+        self.cols = np.cumsum([0] + self.sources) #output columns of each source
+        self.max_chans = int(self.cols[-1])
+        if mdata is not None and mdata.max_chans != self.max_chans:
+            raise TypeError(f"measurement data requires {self.max_chans} channels")
+        self.period_ns = measdata.DEF_NS_PER_S / float(fs)
+        self.mode = mode
+        self.latency_ns = None if latency is None else int(round(latency*measdata.DEF_NS_PER_S))
+        self.mdata = mdata
+        self.reset()
+
+    def reset(self):
+        ''' clears all pending samples, the grid restarts with the next samples '''
+        self.buf_ts = [np.zeros(shape=(0,), dtype=np.int64) for _ in self.sources] #pending samples for each source
+        self.buf_y = [np.zeros(shape=(0, chans), dtype=np.float64) for chans in self.sources]
+        self.ts_grid0 = None #time of grid row 0 (ns)
+        self.k_next = 0 #next grid row to emit
+        self.count = 0 #number of rows emitted
+        self.count_late = 0 #number of emitted rows a source was behind (value held, see latency)
+
+    def push(self, src, ts_ns, vals):
+        '''
+        adds samples of a source: ts_ns .. int64 timestamps in ns (N,) ascending, vals .. values (N, chans) or (N,)
+        '''
+        ts_ns = np.asarray(ts_ns, dtype=np.int64)
+        vals = np.asarray(vals, dtype=np.float64).reshape(len(ts_ns), self.sources[src])
+        if len(ts_ns) == 0: return
+        if len(self.buf_ts[src]) and ts_ns[0] < self.buf_ts[src][-1]: raise ValueError("timestamps must be ascending")
+        self.buf_ts[src] = np.concatenate((self.buf_ts[src], ts_ns))
+        self.buf_y[src] = np.concatenate((self.buf_y[src], vals))
+
+    def push_seconds(self, src, t, vals):
+        ''' adds samples of a source with timestamps in seconds '''
+        self.push(src, np.round(np.asarray(t, dtype=np.float64)*measdata.DEF_NS_PER_S).astype(np.int64), vals)
+
+    def grid(self, k0, k1):
+        ''' timestamps (ns) of the grid rows [k0, k1) '''
+        return self.ts_grid0 + np.round(np.arange(k0, k1) * self.period_ns).astype(np.int64)
+
+    def _ready(self):
+        ''' returns the time (ns) up to which rows can be emitted, None if nothing can be emitted '''
+        last = [ts[-1] if len(ts) else None for ts in self.buf_ts]
+        have = [x for x in last if x is not None]
+        if not have: return None
+        if self.ts_grid0 is None: #grid starts, when all sources delivered (or the latency is exceeded)
+            first = [ts[0] for ts in self.buf_ts if len(ts)]
+            if len(have) < len(last) and (self.latency_ns is None or max(have) - min(first) < self.latency_ns): return None
+            self.ts_grid0 = max(first)
+        ready = min(have) if len(have) == len(last) else None
+        if self.latency_ns is not None: ready = max(max(have) - self.latency_ns, -1 if ready is None else ready)
+        return ready
+
+    def process(self):
+        '''
+        emits all grid rows ready -> returns (ts (M,) int64 ns, rows (M, max_chans)), rows are written to mdata if set
+        '''
+        ready = self._ready()
+        if ready is None or ready < self.ts_grid0: return (np.zeros(shape=(0,), dtype=np.int64),
+                                                           np.zeros(shape=(0, self.max_chans)))
+        k_end = int(np.floor((ready - self.ts_grid0) / self.period_ns)) + 1
+        while k_end > self.k_next and self.grid(k_end-1, k_end)[0] > ready: k_end -= 1 #rounding of the grid
+        if k_end <= self.k_next: return (np.zeros(shape=(0,), dtype=np.int64), np.zeros(shape=(0, self.max_chans)))
+        t = self.grid(self.k_next, k_end)
+        rows = np.full(shape=(len(t), self.max_chans), fill_value=np.nan)
+        late = np.zeros(shape=(len(t),), dtype=bool)
+        for src in range(0, len(self.sources)):
+            ts, y = self.buf_ts[src], self.buf_y[src]
+            if len(ts) == 0:
+                late[:] = True
+                continue
+            i0 = np.searchsorted(ts, t, side="right") - 1 #last sample at or before t
+            valid = i0 >= 0
+            i0 = np.clip(i0, 0, len(ts)-1)
+            late |= t > ts[-1]
+            vals = y[i0]
+            if self.mode == "linear":
+                i1 = np.minimum(i0 + 1, len(ts)-1)
+                dt = (ts[i1] - ts[i0]).astype(np.float64)
+                w = np.divide((t - ts[i0]).astype(np.float64), dt, out=np.zeros(shape=dt.shape), where=dt > 0)
+                vals = vals + w[:, np.newaxis] * (y[i1] - vals)
+            rows[:, self.cols[src]:self.cols[src+1]] = np.where(valid[:, np.newaxis], vals, np.nan)
+            #keep the samples from the last one at or before the last emitted row on (needed for the next rows)
+            keep = max(0, int(i0[-1]))
+            self.buf_ts[src], self.buf_y[src] = ts[keep:], y[keep:]
+        self.k_next = k_end
+        self.count += len(t)
+        self.count_late += int(np.count_nonzero(late))
+        if self.mdata is not None: self.mdata.update_block(rows, t_ns=t)
+        if DBG_OUT: print(f"ALIGN: +{len(t)} rows -> {self.count} (late {self.count_late})")
+        return (t, rows)
+
+def test_usage_regular():
+    '''
+    two sources with different rates and jitter, linear interpolation reproduces a linear signal, zero-order hold
+    '''
+    rng = np.random.default_rng(4)
+    ts_a = np.cumsum(rng.integers(9_000_000, 11_000_000, size=300)) #~100 Hz with jitter
+    ts_b = np.cumsum(rng.integers(3_000_000, 5_000_000, size=800)) + 5_000_000 #~250 Hz with jitter
+    f_a = lambda ts: np.stack((ts*1e-9, -ts*1e-9), axis=1) #linear signals
+    f_b = lambda ts: ts*2e-9 + 1.0
+
+    mdata = measdata.MeasurementData([0, 1, 2], max_short=2000)
+    align = MeasurementAlign([2, 1], fs=200.0, mode="linear", mdata=mdata)
+    out_t, out = [], []
+    for i in range(0, 8):
+        align.push(0, ts_a[i*38:(i+1)*38], f_a(ts_a[i*38:(i+1)*38]))
+        align.push(1, ts_b[i*100:(i+1)*100], f_b(ts_b[i*100:(i+1)*100]))
+        t, rows = align.process()
+        out_t.append(t); out.append(rows)
+        assert len(align.buf_ts[0]) <= 40 and len(align.buf_ts[1]) <= 101 #bounded buffers
+    t, rows = np.concatenate(out_t), np.concatenate(out)
+    assert t[0] == max(ts_a[0], ts_b[0]) and np.all(np.diff(t) == 5_000_000)
+    assert t[-1] <= min(ts_a[-1], ts_b[-1]) and t[-1] + 5_000_000 > min(ts_a[-1], ts_b[-1])
+    assert np.allclose(rows[:, 0:2], f_a(t)) and np.allclose(rows[:, 2], f_b(t))
+    assert align.count == len(t) == mdata.count and align.count_late == 0
+    assert np.array_equal(mdata.window_ts(), t) and np.allclose(mdata.window_y(), rows)
+    assert np.isclose(np.sum(mdata.window_y()[:, [0, 1]], axis=1), 0.0).all() #cross sensor math
+
+    align = MeasurementAlign([1, 1], fs=100.0, mode="hold")
+    align.push(0, [0, 25_000_000], [1.0, 2.0])
+    align.push(1, [5_000_000, 35_000_000], [7.0, 8.0])
+    t, rows = align.process()
+    assert list(t) == [5_000_000, 15_000_000, 25_000_000] and list(rows[:, 0]) == [1.0, 1.0, 2.0]
+    assert list(rows[:, 1]) == [7.0, 7.0, 7.0] and len(align.process()[0]) == 0
+
+def test_latency():
+    '''
+    a source stops delivering: rows are emitted after the latency, the late source holds its last value
+    '''
+    align = MeasurementAlign([1, 1], fs=10.0, mode="hold", latency=0.5)
+    align.push_seconds(0, np.arange(0, 10) * 0.1, np.arange(0, 10))
+    align.push_seconds(1, [0.0, 0.2], [5.0, 6.0])
+    t, rows = align.process()
+    assert np.allclose(t, np.arange(0, 5) * 1e8) and list(rows[:, 1]) == [5.0, 5.0, 6.0, 6.0, 6.0]
+    assert align.count_late == 2
+    with pytest.raises(ValueError):
+        align.push(1, [0], [1.0])
+
+    for latency, num in ((DEF_LATENCY, 21), (None, 1)): #default latency is finite, None waits without bound
+        align = MeasurementAlign([1, 1], fs=10.0, mode="hold", latency=latency)
+        align.push_seconds(0, np.arange(0, 31) * 0.1, np.arange(0, 31))
+        align.push_seconds(1, [0.0], [5.0]) #source 1 stops after its first sample
+        assert len(align.process()[0]) == num and align.count_late == num-1
+    with pytest.raises(ValueError):
+        MeasurementAlign([1], fs=1.0, mode="cubic")
+
+def bench_align(sources=16, chans=2, fs=1000.0, seconds=10.0, blocks=20):
+    '''
+    benchmark: sources with jittered rates around fs, aligned onto fs
+    '''
+    import time
+    rng = np.random.default_rng(8)
+    num = int(fs*seconds)
+    period = int(measdata.DEF_NS_PER_S / fs)
+    ts = [np.cumsum(rng.integers(int(period*0.8), int(period*1.2), size=num)) for _ in range(0, sources)]
+    vals = rng.normal(size=(num, chans))
+    align = MeasurementAlign([chans]*sources, fs=fs)
+    t0 = time.perf_counter()
+    step = num // blocks
+    for i in range(0, num, step):
+        for src in range(0, sources): align.push(src, ts[src][i:i+step], vals[i:i+step])
+        align.process()
+    t_spent = time.perf_counter() - t0
+    print("bench align: sources=%i chans=%i fs=%.0f -> %.3f s for %.1f s data | x%.0f real time | rows=%i"
+          % (sources, sources*chans, fs, t_spent, seconds, seconds/t_spent, align.count))
+
+if __name__ == '__main__':
+    print("running: meas_align.py")
+    test_usage_regular()
+    test_latency()
+    bench_align()
+    print("done")
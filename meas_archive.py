@@ -0,0 +1,390 @@
+'''
+meas_archive.py .. chunked measurement session archive with a random access chunk index
+
+Rows are collected into fixed-size chunks (chunk_rows rows) for each channel group. Full chunks are handed over to a
+background thread, which encodes (delta encoded timestamps, see meas_history.ts_delta_encode()), optionally compresses
+(zlib) and appends them to the data file -> the ingest only copies rows into the current chunk and never waits for
+disk or compression.
+
+Files in the archive directory (default appcfg.CFG.p_dir_meas):
+    <name>.arcd .. data file, chunks appended: [timestamp deltas | y-values of the group columns] (compressed or not)
+    <name>.arci .. chunk index, fixed-size records (idx_dtype()): group, rows, time range, offset/size, min/max
+    <name>.ini  .. layout information (channels, groups, data type, chunk size, compression, scale/offset)
+
+Readers (ArchiveReader) load the index only, find the chunks of a time range with a binary search and decode just those
+chunks (no scan of the data file). The per-chunk min/max values give an overview without decoding anything.
+'''
+#python standard
+import os
+import time
+import itertools
+import zlib
+import queue
+import threading
+import configparser
+#3rd party
+import numpy as np
+import pytest
+
+#project specific
+try:
+    from libxkm import appcfg
+    from libxkm import meas_history
+    from libxkm import measdata
+except ModuleNotFoundError:
+    import appcfg
+    import meas_history #timestamp delta encoding
+    import measdata #timestamp resolution (DEF_NS_PER_S)
+
+DBG_OUT = False #enable/disable debugging output
+
+DEFINI_SEC_ARC = "archive" #ini section with layout information
+DEF_FILEENDING_DATA = ".arcd"
+DEF_FILEENDING_IDX = ".arci"
+DEF_FILEENDING_INI = ".ini"
+DEF_CHUNKROWS = 4096 #default rows per chunk
+CFG_ZLIB_LEVEL = 1 #fast compression (full-rate ingest)
+CFG_QUEUE_CHUNKS = 256 #chunks waiting for the writer thread, the ingest raises if the writer falls this far behind
+
+_ARC_SEQ = itertools.count() #sequence number of generated archive names (unique within the process)
+
+def idx_dtype(max_chans):
+    ''' record type of the chunk index for max_chans channels (min/max of channels outside the group are nan) '''
+    return np.dtype([("group", "<i4"), ("rows", "<i4"), ("ts0", "<i8"), ("ts1", "<i8"), ("offset", "<i8"),
+                     ("nbytes", "<i8"), ("delta_size", "<i4"), ("compressed", "<i4"),
+                     ("min", "<f8", (max_chans,)), ("max", "<f8", (max_chans,))])
+
+class MeasurementArchive():
+    '''
+    archive writer for a measurement session (rows of all channels with shared int64 ns timestamps)
+    '''
+    def __init__(self, max_chans, groups=None, chunk_rows=DEF_CHUNKROWS, dtype=np.float32, compress=True,
+                 scale=None, offset=None, p_dir=None, name=None):
+        '''
+        max_chans .. number of channels (columns of the rows written)
+        groups .. channel groups (lists of columns), each group is stored in its own chunks, None -> one group
+        chunk_rows .. rows per chunk
+        dtype .. data type of the stored y-values (integer types -> raw values, decoded with scale/offset on read)
+        compress .. True -> zlib compressed chunks
+        p_dir .. archive directory, None -> appcfg.CFG.p_dir_meas
+        name .. base file name, None -> generated from the start time, the process id and a sequence number (archives
+                created in the same second do not overwrite each others files)
+        '''
+        if p_dir is None: p_dir = appcfg.CFG.p_dir_meas
+        if not os.path.isdir(p_dir): os.makedirs(p_dir)
+        if name is None: 
+            name = time.strftime("arc_%Y%m%d_%H%M%S", time.localtime()) + "_%i_%i" % (os.getpid(), next(_ARC_SEQ))
+        self.p_dir = os.path.abspath(p_dir)
+        self.name = name
+        self.max_chans = int(max_chans)
+        self.groups = [list(range(0, self.max_chans))] if groups is None else [[int(c) for c in g] for g in groups]
+        self.chunk_rows = int(chunk_rows)
+        self.dtype = np.dtype(dtype)
+        self.compress = bool(compress)
+        self.scale = np.ones(shape=(self.max_chans,)) if scale is None else np.asarray(scale, dtype=float)
+        self.offset = np.zeros(shape=(self.max_chans,)) if offset is None else np.asarray(offset, dtype=float)
+        self.fp_data = os.path.join(self.p_dir, name + DEF_FILEENDING_DATA)
+        self.fp_idx = os.path.join(self.p_dir, name + DEF_FILEENDING_IDX)
+        self.fp_ini = os.path.join(self.p_dir, name + DEF_FILEENDING_INI)
+
+        #current chunk (filled by the ingest thread)
+        self._buf_y = np.empty(shape=(self.chunk_rows, self.max_chans), dtype=self.dtype)
+        self._buf_ts = np.empty(shape=(self.chunk_rows,), dtype=np.int64)
+        self._fill = 0
+        self.count = 0 #rows written (handed over or in the current chunk)
+        self.count_chunks = 0 #chunks written to disk (all groups)
+        self.count_next = None #next row of a measurement, see process()
+        self.count_lost = 0
+
+        #writer thread
+        self.error = None #exception of the writer thread (raised by the next write()/close())
+        self._queue = queue.Queue(maxsize=CFG_QUEUE_CHUNKS)
+        self._f_data = open(self.fp_data, "wb")
+        self._f_idx = open(self.fp_idx, "wb")
+        self.ini_write()
+        self._thread = threading.Thread(target=self._writer, name=f"archive-{name}", daemon=True)
+        self._thread.start()
+
+    def write(self, rows_y, ts_ns):
+        '''
+        adds rows (N, max_chans) with int64 ns timestamps (N,) -> only copies into the current chunk (non-blocking)
+        '''
+        if self.error is not None: raise self.error
+        rows_y = np.asarray(rows_y)
+        ts_ns = np.broadcast_to(np.asarray(ts_ns, dtype=np.int64), (rows_y.shape[0],))
+        i = 0
+        while i < rows_y.shape[0]:
+            n = min(self.chunk_rows - self._fill, rows_y.shape[0] - i)
+            self._buf_y[self._fill:self._fill+n] = rows_y[i:i+n]
+            self._buf_ts[self._fill:self._fill+n] = ts_ns[i:i+n]
+            self._fill += n
+            i += n
+            if self._fill == self.chunk_rows: self._handover()
+        self.count += rows_y.shape[0]
+        return self.count
+
+    def process(self, mdata):
+        '''
+        writes all rows of a measurement (synchronous MeasurementData, raw values) written since the last call
+        ATTENTION: call regularly, rows leaving the measurement window before they are archived are lost (count_lost)
+        '''
+        first = mdata.count - mdata.index
+        if self.count_next is None: self.count_next = first
+        if self.count_next < first:
+            self.count_lost += first - self.count_next
+            self.count_next = first
+        num = mdata.count - self.count_next
+        if num <= 0: return 0
+        ts, y = mdata.rows(self.count_next, mdata.count, raw=True)
+        self.write(y, ts)
+        self.count_next += num
+        return num
+
+    def _handover(self):
+        ''' hands the current chunk over to the writer thread, the ingest continues with a new buffer '''
+        if self._fill == 0: return
+        try:
+            self._queue.put_nowait((self._buf_ts[:self._fill], self._buf_y[:self._fill]))
+        except queue.Full:
+            raise BufferError("archive writer is falling behind (queue full)") from None
+        self._buf_y = np.empty(shape=(self.chunk_rows, self.max_chans), dtype=self.dtype)
+        self._buf_ts = np.empty(shape=(self.chunk_rows,), dtype=np.int64)
+        self._fill = 0
+
+    def _writer(self):
+        ''' writer thread: encodes, compresses and appends chunks and their index records '''
+        rec = np.zeros(shape=(1,), dtype=idx_dtype(self.max_chans))
+        offset = 0
+        while True:
+            item = self._queue.get()
+            if item is None: break
+            if self.error is not None:
+                self._queue.task_done()
+                continue
+            try:
+                ts, y = item
+                ts0, delta = meas_history.ts_delta_encode(ts)
+                for group, cols in enumerate(self.groups):
+                    y_g = np.ascontiguousarray(y[:, cols])
+                    payload = delta.tobytes() + y_g.tobytes()
+                    if self.compress: payload = zlib.compress(payload, CFG_ZLIB_LEVEL)
+                    rec[0] = (group, len(ts), ts0, ts[-1], offset, len(payload), delta.itemsize, int(self.compress),
+                              np.nan, np.nan)
+                    y_val = y_g * self.scale[cols] + self.offset[cols] if self.dtype.kind in "iu" else y_g
+                    rec["min"][0, cols] = y_val.min(axis=0)
+                    rec["max"][0, cols] = y_val.max(axis=0)
+                    self._f_data.write(payload)
+                    offset += len(payload)
+                    self._f_data.flush() #data before index -> readers never see an index record without its chunk
+                    self._f_idx.write(rec.tobytes())
+                    self._f_idx.flush()
+                    self.count_chunks += 1
+                if DBG_OUT: print(f"ARCHIVE: chunk {self.count_chunks} rows={len(ts)}")
+            except Exception as e:
+                self.error = e
+            self._queue.task_done()
+
+    def flush(self):
+        ''' hands over a partial chunk and waits until the writer thread wrote everything '''
+        self._handover()
+        while self._queue.unfinished_tasks > 0 and self._thread.is_alive(): time.sleep(0.001)
+        if self.error is not None: raise self.error
+
+    def close(self):
+        ''' writes the last (partial) chunk, stops the writer thread and closes the files '''
+        if self._thread is None: return
+        self._handover()
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        self._f_data.close()
+        self._f_idx.close()
+        self.ini_write()
+        if self.error is not None: raise self.error
+
+    def ini_write(self):
+        ''' writes layout information into the ini file '''
+        cfgp = configparser.ConfigParser()
+        cfgp[DEFINI_SEC_ARC] = {
+            "max_chans": str(self.max_chans),
+            "groups": ";".join(",".join(str(c) for c in g) for g in self.groups),
+            "dtype": self.dtype.str,
+            "chunk_rows": str(self.chunk_rows),
+            "compress": str(int(self.compress)),
+            "count": str(self.count),
+            "scale": ",".join(repr(float(x)) for x in self.scale),
+            "offset": ",".join(repr(float(x)) for x in self.offset),
+        }
+        with open(self.fp_ini, "w") as f:
+            cfgp.write(f)
+
+    def __str__(self):
+        return f"ARCHIVE {self.name} in {self.p_dir} | CH={self.max_chans} | GROUPS={len(self.groups)} | ROWS={self.count}"
+
+class ArchiveReader():
+    '''
+    random access reader of an archive (can be used while the archive is written, see reload())
+    '''
+    def __init__(self, name, p_dir=None):
+        if p_dir is None: p_dir = appcfg.CFG.p_dir_meas
+        self.p_dir = os.path.abspath(p_dir)
+        self.name = name
+        self.fp_data = os.path.join(self.p_dir, name + DEF_FILEENDING_DATA)
+        self.fp_idx = os.path.join(self.p_dir, name + DEF_FILEENDING_IDX)
+        cfgp = configparser.ConfigParser()
+        if not cfgp.read(os.path.join(self.p_dir, name + DEF_FILEENDING_INI)):
+            raise FileNotFoundError(f"archive ini file is missing: {name}")
+        sec = cfgp[DEFINI_SEC_ARC]
+        self.max_chans = int(sec["max_chans"])
+        self.groups = [[int(c) for c in g.split(",")] for g in sec["groups"].split(";")]
+        self.dtype = np.dtype(sec["dtype"])
+        self.chunk_rows = int(sec["chunk_rows"])
+        self.scale = np.array([float(x) for x in sec["scale"].split(",")])
+        self.offset = np.array([float(x) for x in sec["offset"].split(",")])
+        self.group_of = {c: (g, i) for g, cols in enumerate(self.groups) for i, c in enumerate(cols)}
+        self.reload()
+
+    def reload(self):
+        ''' (re)loads the chunk index (complete records only) '''
+        dtype = idx_dtype(self.max_chans)
+        with open(self.fp_idx, "rb") as f:
+            raw = f.read()
+        self.index = np.frombuffer(raw[:len(raw) - len(raw) % dtype.itemsize], dtype=dtype)
+        self._chunks = [np.flatnonzero(self.index["group"] == g) for g in range(0, len(self.groups))]
+        return len(self.index)
+
+    def chunks(self, t0=None, t1=None, group=0, ns=False):
+        '''
+        index records of the chunks of a group overlapping [t0, t1] (seconds, ns=True -> int64 ns) -> binary search
+        '''
+        rec = self.index[self._chunks[group]]
+        i0 = 0 if t0 is None else int(np.searchsorted(rec["ts1"], _ns(t0, ns), side="left"))
+        i1 = len(rec) if t1 is None else int(np.searchsorted(rec["ts0"], _ns(t1, ns), side="right"))
+        return rec[i0:max(i0, i1)]
+
+    def _decode(self, rec):
+        ''' decodes a chunk -> (ts, y raw of the group columns) '''
+        with open(self.fp_data, "rb") as f:
+            f.seek(int(rec["offset"]))
+            payload = f.read(int(rec["nbytes"]))
+        if rec["compressed"]: payload = zlib.decompress(payload)
+        rows = int(rec["rows"])
+        nbytes_delta = (rows-1) * int(rec["delta_size"])
+        delta = np.frombuffer(payload[:nbytes_delta], dtype=np.int32 if rec["delta_size"] == 4 else np.int64)
+        y = np.frombuffer(payload[nbytes_delta:], dtype=self.dtype).reshape(rows, -1)
+        return (meas_history.ts_delta_decode(int(rec["ts0"]), delta), y)
+
+    def read(self, t0=None, t1=None, chans=None, raw=False, ns=False):
+        '''
+        returns (ts, y) of the time range [t0, t1] -> ts int64 ns (n,), y (n, len(chans)), only overlapping chunks are read
+            chans .. channel columns, None -> all channels
+            raw .. True -> stored (raw) values, False -> decoded values (quantized storage)
+        '''
+        chans = list(range(0, self.max_chans)) if chans is None else [int(c) for c in chans]
+        groups = sorted(set(self.group_of[c][0] for c in chans))
+        ts, parts = None, {}
+        for g in groups:
+            decoded = [self._decode(rec) for rec in self.chunks(t0, t1, g, ns)]
+            if not decoded: return (np.zeros(shape=(0,), dtype=np.int64), np.zeros(shape=(0, len(chans))))
+            ts_g = np.concatenate([d[0] for d in decoded])
+            parts[g] = np.concatenate([d[1] for d in decoded])
+            if ts is None: ts = ts_g
+        i0 = 0 if t0 is None else int(np.searchsorted(ts, _ns(t0, ns), side="left"))
+        i1 = len(ts) if t1 is None else int(np.searchsorted(ts, _ns(t1, ns), side="right"))
+        y = np.stack([parts[self.group_of[c][0]][i0:i1, self.group_of[c][1]] for c in chans], axis=1)
+        if not raw and self.dtype.kind in "iu": y = y * self.scale[chans] + self.offset[chans]
+        return (ts[i0:i1], y)
+
+    def overview(self, group=0):
+        ''' (ts0, ts1, min, max) of all chunks of a group from the index (nothing is decoded) '''
+        rec = self.index[self._chunks[group]]
+        cols = self.groups[group]
+        return (rec["ts0"], rec["ts1"], rec["min"][:, cols], rec["max"][:, cols])
+
+def _ns(t, ns):
+    return int(t) if ns else round(float(t)*measdata.DEF_NS_PER_S)
+
+def test_usage_regular(tmp_path):
+    '''
+    writing blocks (background thread), random access by time, channel groups, partial chunk, quantized values
+    '''
+    max_chans = 4
+    rows = np.arange(0, 1000*max_chans, dtype=np.float32).reshape(1000, max_chans)
+    ts = np.arange(0, 1000, dtype=np.int64) * 1000000 #1 ms
+    arc = MeasurementArchive(max_chans, groups=[[0, 1], [2, 3]], chunk_rows=128, p_dir=str(tmp_path), name="arc")
+    for i in range(0, 1000, 70): arc.write(rows[i:i+70], ts[i:i+70])
+    arc.flush()
+    reader = ArchiveReader("arc", p_dir=str(tmp_path))
+    assert len(reader.index) == 2*8 #7 full chunks and the partial chunk of each group
+    arc.write(rows[-1:], ts[-1] + 1000000)
+    arc.close()
+    assert reader.reload() == 2*9 and reader.read(chans=[1])[1][-1, 0] == rows[-1, 1]
+    t, y = reader.read(0.2005, 0.3)
+    assert t[0] == 201000000 and t[-1] == 300000000 and np.array_equal(y, rows[201:301])
+    assert len(reader.chunks(0.2005, 0.3)) == 2 #rows [128, 384)
+    t, y = reader.read(None, 0.999, chans=[3, 0])
+    assert np.array_equal(t, ts) and np.array_equal(y, rows[:, [3, 0]])
+    ts0, ts1, mn, mx = reader.overview(group=1)
+    assert ts1[-2] == ts[-1] and list(mn[0]) == [2.0, 3.0] and mx[-2, 1] == rows[-1, 3]
+    assert len(reader.read(5.0, 6.0)[0]) == 0
+
+    arc = MeasurementArchive(2, chunk_rows=100, dtype=np.int16, scale=[0.5, 2.0], compress=False,
+                             p_dir=str(tmp_path), name="arc_int")
+    raw = np.stack((np.arange(0, 250), -np.arange(0, 250)), axis=1).astype(np.int16)
+    arc.write(raw, np.arange(0, 250) * 3)
+    arc.close()
+    reader = ArchiveReader("arc_int", p_dir=str(tmp_path))
+    t, y = reader.read(30, 60, ns=True)
+    assert list(t) == list(range(30, 63, 3)) and np.array_equal(y, raw[10:21] * [0.5, 2.0])
+    assert reader.read(raw=True)[1].dtype == np.int16 and reader.overview()[3][-1, 0] == 249*0.5
+
+def test_measurement(tmp_path):
+    '''
+    archiving the rows of a measurement as they arrive (raw values of quantized storage)
+    '''
+    mdata = measdata.MeasurementData([0, 1, 2], max_short=500, dtype=np.int16, scale=0.1)
+    arc = MeasurementArchive(3, chunk_rows=256, dtype=np.int16, scale=mdata.scale, p_dir=str(tmp_path), name="arc_m")
+    rows = np.random.default_rng(1).integers(-1000, 1000, size=(2000, 3)).astype(np.int16)
+    for i in range(0, 2000, 300):
+        mdata.update_block(rows[i:i+300], t_ns=np.arange(i, min(i+300, 2000)) * 100000)
+        arc.process(mdata)
+    arc.close()
+    t, y = ArchiveReader("arc_m", p_dir=str(tmp_path)).read()
+    assert arc.count_lost == 0 and np.array_equal(t, np.arange(0, 2000) * 100000)
+    assert np.allclose(y, rows * mdata.scale)
+
+    #generated names: archives created in the same second must not share (truncate) the files
+    arcs = [MeasurementArchive(1, chunk_rows=8, p_dir=str(tmp_path)) for _ in range(3)]
+    assert len(set(a.fp_data for a in arcs)) == 3
+    for i, a in enumerate(arcs):
+        a.write(np.full(shape=(10, 1), fill_value=i), np.arange(0, 10))
+        a.close()
+    assert [ArchiveReader(a.name, p_dir=str(tmp_path)).read()[1][0, 0] for a in arcs] == [0, 1, 2]
+
+def bench_archive(max_chans=32, fs=10000.0, seconds=10.0, blocksize=500, p_dir=None):
+    '''
+    benchmark: ingest time of full-rate rows (copy into chunks) and total time including the writer thread
+    '''
+    import tempfile
+    num = int(fs*seconds)
+    rows = np.random.default_rng(2).normal(size=(num, max_chans)).astype(np.float32)
+    ts = np.arange(0, num, dtype=np.int64) * int(measdata.DEF_NS_PER_S/fs)
+    with tempfile.TemporaryDirectory() as tmp:
+        arc = MeasurementArchive(max_chans, groups=[list(range(0, max_chans, 2)), list(range(1, max_chans, 2))],
+                                 p_dir=p_dir or tmp, name="bench")
+        t0 = time.perf_counter()
+        t_ingest = 0.0
+        for i in range(0, num, blocksize):
+            t1 = time.perf_counter()
+            arc.write(rows[i:i+blocksize], ts[i:i+blocksize])
+            t_ingest += time.perf_counter() - t1
+        arc.close()
+        t_spent = time.perf_counter() - t0
+        size = os.path.getsize(arc.fp_data)
+    print("bench archive: chans=%i fs=%.0f -> ingest %.3f s, total %.3f s for %.1f s data | x%.0f real time | %.1f MB"
+          % (max_chans, fs, t_ingest, t_spent, seconds, seconds/t_spent, size/1e6))
+
+if __name__ == '__main__':
+    print("running: meas_archive.py")
+    bench_archive()
+    print("done")
@@ -0,0 +1,243 @@
+'''
+meas_calib.py .. vectorized calibration (characteristic curves) of sensor input channels
+
+A calibration maps the raw input channels of a sensor onto its output channels. All curves are evaluated with numpy
+on whole blocks (N, chans_in) - the newest row (chans_in,) is just a block with one row:
+
+    raw (N, chans_in) -> curve per input channel -> combine ("sum", "mean" or None) -> post curve -> (N,) / (N, chans)
+
+Curves:
+    CurvePoly .. polynomial c0 + c1*x + c2*x^2 + .. (Horner)
+    CurvePiecewise .. piecewise-linear through the points (xp, fp), linear extrapolation outside
+    CurveThreshold .. switches between two curves at a threshold, i.e., the RKM "Mittelwertkennlinie" (mean
+                      characteristic curve) applied to the calibrated single inputs above a threshold
+
+Integer raw ADC inputs can be calibrated with a precomputed lookup table (compile_lut()) -> a single numpy take for all
+channels (and the post curve for single input sensors). Float inputs use the table only if all values are integral
+(i.e., ADC counts converted to float64 by the block update), otherwise the curves are evaluated.
+'''
+#3rd party
+import numpy as np
+import pytest
+
+DBG_OUT = False #enable/disable debugging output
+
+DEF_COMBINE = (None, "sum", "mean")
+
+class CurvePoly():
+    '''
+    polynomial characteristic curve c0 + c1*x + c2*x^2 + .. (coefs ascending)
+    '''
+    def __init__(self, coefs):
+        self.coefs = [float(c) for c in coefs]
+        if not self.coefs: raise ValueError("polynomial without coefficients")
+
+    def __call__(self, x):
+        x = np.asarray(x, dtype=np.float64)
+        y = np.full(shape=x.shape, fill_value=self.coefs[-1])
+        for c in self.coefs[-2::-1]: #horner
+            y *= x
+            y += c
+        return y
+
+    def __str__(self):
+        return f"POLY{self.coefs}"
+
+class CurvePiecewise():
+    '''
+    piecewise-linear characteristic curve through the points (xp, fp), xp ascending, linear extrapolation outside
+    '''
+    def __init__(self, xp, fp):
+        self.xp = np.asarray(xp, dtype=np.float64)
+        self.fp = np.asarray(fp, dtype=np.float64)
+        if len(self.xp) < 2 or self.xp.shape != self.fp.shape: raise ValueError("piecewise curve requires >= 2 points")
+        if np.any(np.diff(self.xp) <= 0): raise ValueError("piecewise curve requires ascending x values")
+        self.slope = np.diff(self.fp) / np.diff(self.xp)
+
+    def __call__(self, x):
+        x = np.asarray(x, dtype=np.float64)
+        seg = np.clip(np.searchsorted(self.xp, x, side="right") - 1, 0, len(self.slope) - 1)
+        return self.fp[seg] + self.slope[seg] * (x - self.xp[seg])
+
+    def __str__(self):
+        return f"PIECEWISE[{len(self.xp)} points]"
+
+class CurveThreshold():
+    '''
+    threshold switched characteristic curve -> curve_low below the threshold, curve_high at or above (None -> identity)
+    '''
+    def __init__(self, threshold, curve_low=None, curve_high=None):
+        self.threshold = float(threshold)
+        self.curve_low = curve_low
+        self.curve_high = curve_high
+
+    def __call__(self, x):
+        x = np.asarray(x, dtype=np.float64)
+        low = x if self.curve_low is None else self.curve_low(x)
+        high = x if self.curve_high is None else self.curve_high(x)
+        return np.where(x < self.threshold, low, high)
+
+    def __str__(self):
+        return f"THRESHOLD[{self.threshold}: {self.curve_low} | {self.curve_high}]"
+
+class Calibration():
+    '''
+    calibration of a sensor -> curve per input channel, combination of the channels and a curve after the combination
+    '''
+    def __init__(self, chans, combine="sum", post=None, name=""):
+        '''
+        chans .. curve for each input channel (None -> identity)
+        combine .. None (one output channel per input channel), "sum" or "mean" of the calibrated inputs
+        post .. curve applied after the combination (None -> identity), i.e., CurveThreshold for RKM sensors
+        '''
+        if combine not in DEF_COMBINE: raise ValueError(f"unknown combination: {combine}")
+        self.chans = list(chans)
+        self.combine = combine
+        self.post = post
+        self.name = name
+        self.lut = None #lookup table (chans_in, lut_max-lut_min+1), see compile_lut()
+        self.lut_min = 0
+        self.lut_max = -1
+        self.lut_post = False #True -> post curve is part of the lookup table
+
+    @property
+    def chans_in(self):
+        return len(self.chans)
+
+    def compile_lut(self, lut_min, lut_max):
+        '''
+        precomputes the curves for all integer raw values [lut_min, lut_max] (i.e., 0, 2**16-1 for a 16 bit ADC), raw
+        values outside are clipped -> returns the size of the table (bytes)
+        '''
+        raw = np.arange(int(lut_min), int(lut_max) + 1, dtype=np.float64)
+        self.lut_post = self.chans_in == 1 #single input -> the post curve does not depend on other channels
+        self.lut = np.empty(shape=(self.chans_in, len(raw)), dtype=np.float64)
+        for i, curve in enumerate(self.chans):
+            self.lut[i] = raw if curve is None else curve(raw)
+        if self.lut_post and self.post is not None: self.lut[0] = self.post(self.lut[0])
+        self.lut_min, self.lut_max = int(lut_min), int(lut_max)
+        if DBG_OUT: print(f"CALIB: lut {self.lut.shape} for {self.name}")
+        return self.lut.nbytes
+
+    def _use_lut(self, vals):
+        ''' True -> the lookup table applies (integer raw values, float values only if all are integral) '''
+        return self.lut is not None and (vals.dtype.kind in "iu" or np.array_equal(vals, np.trunc(vals)))
+
+    def inputs(self, vals, use_lut=None):
+        ''' calibrated input channels (N, chans_in) or (chans_in,), use_lut None -> see _use_lut() '''
+        vals = np.asarray(vals)
+        if use_lut is None: use_lut = self._use_lut(vals)
+        if use_lut: #a single take for all channels
+            idx = np.clip(vals, self.lut_min, self.lut_max).astype(np.intp) - self.lut_min
+            idx += np.arange(0, self.chans_in, dtype=np.intp) * self.lut.shape[1]
+            return self.lut.take(idx)
+        vals = vals.astype(np.float64, copy=False)
+        ret = np.empty(shape=vals.shape, dtype=np.float64)
+        for i, curve in enumerate(self.chans):
+            ret[..., i] = vals[..., i] if curve is None else curve(vals[..., i])
+        return ret
+
+    def __call__(self, vals):
+        '''
+        calibrates the raw input values vals (N, chans_in) or (chans_in,) -> (N,) / () combined or per channel
+        '''
+        vals = np.asarray(vals)
+        use_lut = self._use_lut(vals)
+        ret = self.inputs(vals, use_lut)
+        if self.combine == "sum": ret = ret.sum(axis=-1)
+        elif self.combine == "mean": ret = ret.mean(axis=-1)
+        if self.post is not None and not (use_lut and self.lut_post): ret = self.post(ret)
+        return ret
+
+    def __str__(self):
+        return f"CALIB {self.name}: {[str(c) for c in self.chans]} {self.combine} -> {self.post}"
+
+def test_usage_regular():
+    '''
+    curves, combination, threshold switched post curve, block and single row calibration
+    '''
+    x = np.linspace(-10.0, 10.0, 101)
+    assert np.allclose(CurvePoly([1.0, 2.0, 0.5])(x), 1.0 + 2.0*x + 0.5*x*x)
+    pw = CurvePiecewise([0.0, 1.0, 3.0], [0.0, 10.0, 14.0])
+    assert np.allclose(pw([-1.0, 0.5, 1.0, 2.0, 4.0]), [-10.0, 5.0, 10.0, 12.0, 16.0]) #linear extrapolation
+    thr = CurveThreshold(5.0, curve_high=CurvePoly([1.0, 0.9]))
+    assert np.allclose(thr([4.0, 5.0, 10.0]), [4.0, 5.5, 10.0])
+    with pytest.raises(ValueError):
+        CurvePiecewise([0.0, 0.0], [1.0, 2.0])
+    with pytest.raises(ValueError):
+        Calibration([None], combine="max")
+
+    #RKM: single inputs calibrated, summed, mean characteristic curve above a threshold
+    calib = Calibration([CurvePoly([0.0, 2.0]), CurvePoly([1.0, 3.0])], combine="sum", post=thr, name="RKM")
+    rows = np.array([[0.0, 0.0], [1.0, 1.0], [2.0, 1.0]])
+    ref = 2.0*rows[:, 0] + 1.0 + 3.0*rows[:, 1]
+    ref = np.where(ref < 5.0, ref, 1.0 + 0.9*ref)
+    assert np.allclose(calib(rows), ref) and np.isclose(calib(rows[2]), ref[2])
+    assert Calibration([pw, None], combine=None)(rows).shape == (3, 2)
+    assert np.allclose(Calibration([None, None], combine="mean")(rows), rows.mean(axis=1))
+
+def test_lut():
+    '''
+    lookup tables for integer raw values -> identical to the curves, clipped outside
+    '''
+    rng = np.random.default_rng(11)
+    raw = rng.integers(0, 4096, size=(500, 2))
+    curves = [CurvePoly([-3.0, 0.01, 1e-6]), CurvePiecewise([0, 1000, 4095], [0.0, 50.0, 80.0])]
+    calib = Calibration(curves, combine="sum", post=CurveThreshold(60.0, curve_high=CurvePoly([2.0, 1.0])))
+    ref = calib(raw)
+    assert calib.compile_lut(0, 4095) == 2*4096*8
+    assert np.allclose(calib(raw), ref) and np.allclose(calib(raw.astype(np.float64)), ref)
+    assert np.allclose(calib(raw[0]), ref[0])
+
+    single = Calibration([curves[1]], post=CurvePoly([0.0, 2.0]))
+    ref = single(raw[:, :1])
+    single.compile_lut(0, 4095)
+    assert single.lut_post and np.allclose(single(raw[:, :1]), ref)
+    assert np.isclose(single([5000]), single([4095])) #clipped
+
+    frac = raw[:, :1] + 0.5 #no integer raw values -> curves, not truncated to the table
+    assert np.allclose(single(frac), Calibration([curves[1]], post=CurvePoly([0.0, 2.0]))(frac))
+
+def test_sensor():
+    '''
+    calibration of a sensor (block update and single sample update)
+    '''
+    import appdef
+    import meas_sensor
+    mc = meas_sensor.meas_calib #the classes the sensor matches (this file is __main__ if run directly)
+    calib = mc.Calibration([mc.CurvePoly([0.0, 2.0]), mc.CurvePiecewise([0, 100], [0.0, 50.0])],
+                           post=mc.CurveThreshold(60.0, curve_high=mc.CurvePoly([6.0, 0.9])))
+    calib.compile_lut(0, 1023)
+    sen = meas_sensor.SensorXKM(appdef.DEF_SENSORTYPES.PRO_RKM_W_2CH, addr_node=1, calib=calib)
+    sen.md_init(np.zeros(shape=(20, 0)), np.zeros(shape=(20, 0)))
+    raw = np.random.default_rng(13).integers(0, 1024, size=(30, 2))
+    sen.md_update_block(raw[:-1])
+    sen.md_update(raw[-1])
+    assert np.allclose(sen.md_out()[:, 0], calib(raw[::-1][:20]))
+
+def bench_calib(sensors=16, fs=1000.0, seconds=10.0, blocksize=100):
+    '''
+    benchmark: calibration of all sensors (RKM, 2 channels with threshold switched post curve) at full rate
+    '''
+    import time
+    num = int(fs*seconds)
+    raw = np.random.default_rng(12).integers(0, 65536, size=(num, 2))
+    post = CurveThreshold(2.0, curve_high=CurvePoly([0.1, 0.98, 1e-4]))
+    for lut in (False, True):
+        calib = Calibration([CurvePoly([0.0, 1e-4, 1e-10]), CurvePiecewise([0, 30000, 65535], [0.0, 3.0, 6.5])],
+                            post=post)
+        if lut: calib.compile_lut(0, 65535)
+        t0 = time.perf_counter()
+        for _ in range(0, sensors):
+            for i in range(0, num, blocksize): calib(raw[i:i+blocksize])
+        t_spent = time.perf_counter() - t0
+        print("bench calib: sensors=%i fs=%.0f lut=%s -> %.3f s for %.1f s data | x%.0f real time"
+              % (sensors, fs, lut, t_spent, seconds, seconds/t_spent))
+
+if __name__ == '__main__':
+    print("running: meas_calib.py")
+    test_usage_regular()
+    test_lut()
+    test_sensor()
+    bench_calib()
+    print("done")
@@ -0,0 +1,264 @@
+'''
+meas_calibstore.py .. calibration constant store -> per sensor calibration files, compiled kernels with an mtime cache
+
+Calibration constants are kept in ini files in the cfg directory (default appcfg.CFG.p_dir_cfg), one file for each
+sensor (PRODAT ID, df_idpro_v) and calibration date (df_datecali_v):
+
+    calib_<idpro>_<datecali>.ini
+        [calibration] combine = sum, lut_min/lut_max (optional, integer raw values -> lookup table)
+        [chan0], [chan1], .. curve of each input channel: type = poly (coefs) | piecewise (xp, fp) | threshold | none
+        [post] curve after the combination (optional), threshold curves use the sections [<name>.low], [<name>.high]
+
+The store compiles each file once into a meas_calib.Calibration (incl. the lookup table) and caches it, keyed by the
+file and validated with its inode/mtime/size -> sensors with the same constants share one kernel, opening many
+systems does not re-parse anything. apply() hot-swaps the kernel of a sensor (a single attribute assignment, the
+acquisition keeps running and uses the new kernel with the next calibration).
+'''
+#python standard
+import os
+import re
+import tempfile
+import threading
+import configparser
+#3rd party
+import numpy as np
+import pytest
+
+#project specific
+try:
+    from libxkm import appcfg
+    from libxkm import meas_calib
+except ModuleNotFoundError:
+    import appcfg
+    import meas_calib
+
+DBG_OUT = False #enable/disable debugging output
+
+DEFINI_SEC_CALIB = "calibration"
+DEFINI_SEC_POST = "post"
+DEF_FILEBASE = "calib_"
+DEF_FILEENDING = ".ini"
+
+def _key(val):
+    ''' file name part of an ID or a date (only letters, digits, "." and "-") '''
+    return re.sub(r"[^0-9A-Za-z.\-]", "", str(val))
+
+def _floats(val):
+    return [float(x) for x in val.split(",")]
+
+def curve_read(cfgp, name):
+    ''' curve of the ini section name (None -> section is missing or type none) '''
+    if not cfgp.has_section(name): return None
+    sec = cfgp[name]
+    ctype = sec.get("type", "none")
+    if ctype == "none": return None
+    if ctype == "poly": return meas_calib.CurvePoly(_floats(sec["coefs"]))
+    if ctype == "piecewise": return meas_calib.CurvePiecewise(_floats(sec["xp"]), _floats(sec["fp"]))
+    if ctype == "threshold":
+        return meas_calib.CurveThreshold(float(sec["threshold"]), curve_read(cfgp, name + ".low"),
+                                         curve_read(cfgp, name + ".high"))
+    raise ValueError(f"unknown curve type in section [{name}]: {ctype}")
+
+def curve_write(cfgp, name, curve):
+    ''' writes a curve into the ini section name '''
+    fmt = lambda vals: ",".join(repr(float(x)) for x in vals)
+    if curve is None: cfgp[name] = {"type": "none"}
+    elif isinstance(curve, meas_calib.CurvePoly): cfgp[name] = {"type": "poly", "coefs": fmt(curve.coefs)}
+    elif isinstance(curve, meas_calib.CurvePiecewise):
+        cfgp[name] = {"type": "piecewise", "xp": fmt(curve.xp), "fp": fmt(curve.fp)}
+    elif isinstance(curve, meas_calib.CurveThreshold):
+        cfgp[name] = {"type": "threshold", "threshold": repr(curve.threshold)}
+        curve_write(cfgp, name + ".low", curve.curve_low)
+        curve_write(cfgp, name + ".high", curve.curve_high)
+    else: raise TypeError(f"curve can not be stored: {curve}")
+
+class CalibrationStore():
+    '''
+    calibration files of the sensors -> compiled and cached calibrations (meas_calib.Calibration)
+    '''
+    def __init__(self, p_dir=None):
+        if p_dir is None: p_dir = appcfg.CFG.p_dir_cfg
+        self.p_dir = os.path.abspath(p_dir)
+        self._cache = {} #file path -> ((inode, mtime_ns, size), calibration)
+        self._lock = threading.Lock()
+        self.count_compiled = 0 #number of files parsed and compiled (cache misses)
+
+    def fp(self, idpro, datecali):
+        ''' path of the calibration file of a sensor '''
+        return os.path.join(self.p_dir, f"{DEF_FILEBASE}{_key(idpro)}_{_key(datecali)}{DEF_FILEENDING}")
+
+    def dates(self, idpro):
+        ''' available calibration dates of a sensor (ascending) '''
+        prefix = f"{DEF_FILEBASE}{_key(idpro)}_"
+        if not os.path.isdir(self.p_dir): return []
+        return sorted(f[len(prefix):-len(DEF_FILEENDING)] for f in os.listdir(self.p_dir)
+                      if f.startswith(prefix) and f.endswith(DEF_FILEENDING))
+
+    def get(self, idpro, datecali=None):
+        '''
+        compiled calibration of a sensor (datecali None -> newest calibration), None if there is no calibration file
+        -> compiled once, recompiled only if the file changed (inode/mtime/size, save() replaces the file -> new inode)
+        '''
+        if datecali is None:
+            dates = self.dates(idpro)
+            if not dates: return None
+            datecali = dates[-1]
+        fp = self.fp(idpro, datecali)
+        try:
+            st = os.stat(fp)
+        except FileNotFoundError:
+            return None
+        key = (st.st_ino, st.st_mtime_ns, st.st_size)
+        entry = self._cache.get(fp)
+        if entry is not None and entry[0] == key: return entry[1]
+        with self._lock:
+            calib = self._compile(fp, f"{idpro} {datecali}")
+            self._cache[fp] = (key, calib)
+            self.count_compiled += 1
+        if DBG_OUT: print(f"CALIBSTORE: compiled {fp}")
+        return calib
+
+    def _compile(self, fp, name):
+        ''' parses a calibration file -> calibration (lookup table compiled, if configured) '''
+        cfgp = configparser.ConfigParser()
+        if not cfgp.read(fp): raise FileNotFoundError(f"calibration file is missing: {fp}")
+        sec = cfgp[DEFINI_SEC_CALIB]
+        chans = [curve_read(cfgp, f"chan{i}") for i in range(0, int(sec["chans_in"]))]
+        combine = sec.get("combine", "sum")
+        calib = meas_calib.Calibration(chans, combine=None if combine == "none" else combine,
+                                       post=curve_read(cfgp, DEFINI_SEC_POST), name=name)
+        if "lut_min" in sec: calib.compile_lut(int(sec["lut_min"]), int(sec["lut_max"]))
+        return calib
+
+    def save(self, calib, idpro, datecali, lut=None):
+        '''
+        writes the calibration constants of a sensor (replaces the file atomically -> running readers see either the
+        old or the new file), lut .. (lut_min, lut_max) for integer raw values or None
+        '''
+        cfgp = configparser.ConfigParser()
+        cfgp[DEFINI_SEC_CALIB] = {"idpro": str(idpro), "datecali": str(datecali), "chans_in": str(calib.chans_in),
+                                  "combine": str(calib.combine or "none")}
+        if lut is not None: cfgp[DEFINI_SEC_CALIB].update({"lut_min": str(int(lut[0])), "lut_max": str(int(lut[1]))})
+        for i, curve in enumerate(calib.chans): curve_write(cfgp, f"chan{i}", curve)
+        if calib.post is not None: curve_write(cfgp, DEFINI_SEC_POST, calib.post)
+        os.makedirs(self.p_dir, exist_ok=True)
+        fp = self.fp(idpro, datecali)
+        #own temporary file for each save -> concurrent saves of the same sensor do not clobber each other
+        with tempfile.NamedTemporaryFile("w", dir=self.p_dir, prefix=os.path.basename(fp) + ".", suffix=".tmp",
+                                         delete=False) as f:
+            cfgp.write(f)
+        try:
+            os.replace(f.name, fp)
+        except OSError:
+            os.remove(f.name)
+            raise
+        return fp
+
+    def apply(self, sensors):
+        '''
+        sets the calibration of the sensors (by df_idpro_v and df_datecali_v) -> hot-swap, the sensors keep measuring
+        returns the number of sensors with a changed calibration (sensors without a calibration file are not changed)
+        '''
+        count = 0
+        for sen in sensors:
+            calib = self.get(sen.df_idpro_v, sen.df_datecali_v)
+            if calib is not None and calib is not sen.calib:
+                sen.calib = calib #atomic, the next calc_calibrate() uses the new kernel
+                count += 1
+        return count
+
+    def clear(self):
+        ''' clears the cache (all files are compiled again) '''
+        with self._lock:
+            self._cache = {}
+
+    def __str__(self):
+        return f"CALIBSTORE {self.p_dir} | CACHED={len(self._cache)} | COMPILED={self.count_compiled}"
+
+def _rkm(f=2.0):
+    ''' calibration of a RKM sensor for testing '''
+    return meas_calib.Calibration([meas_calib.CurvePoly([0.0, f]), meas_calib.CurvePiecewise([0, 100], [0.0, 50.0])],
+                                  post=meas_calib.CurveThreshold(60.0, curve_high=meas_calib.CurvePoly([6.0, 0.9])))
+
+def test_usage_regular(tmp_path):
+    '''
+    save, compile once, cache hits, newest date, invalidation on changes
+    '''
+    store = CalibrationStore(p_dir=str(tmp_path))
+    raw = np.random.default_rng(21).integers(0, 1024, size=(100, 2))
+    ref = _rkm()(raw)
+    store.save(_rkm(), "123456.01", "20230101", lut=(0, 1023))
+    store.save(_rkm(3.0), "123456.01", "20220101")
+    assert store.dates("123456.01") == ["20220101", "20230101"] and store.get("654321.01") is None
+
+    calib = store.get("123456.01", "20230101")
+    assert calib.lut is not None and np.allclose(calib(raw), ref)
+    assert store.get("123456.01") is calib and store.count_compiled == 1 #newest date, cached
+    assert not np.allclose(store.get("123456.01", "20220101")(raw), ref) and store.count_compiled == 2
+
+    #changed constants -> recompiled
+    store.save(_rkm(4.0), "123456.01", "20230101", lut=(0, 1023)) #same size, possibly the same mtime -> new inode
+    calib_new = store.get("123456.01", "20230101")
+    assert calib_new is not calib and np.allclose(calib_new(raw), _rkm(4.0)(raw)) and store.count_compiled == 3
+    with open(store.fp("1", "2"), "w") as f:
+        f.write("[calibration]\nchans_in = 1\n[chan0]\ntype = cubic\n")
+    with pytest.raises(ValueError):
+        store.get("1", "2")
+
+    #concurrent saves of the same sensor -> no errors, no temporary files left
+    errors = []
+    def _save(f):
+        try:
+            for _ in range(0, 20): store.save(_rkm(f), "123456.01", "20230101")
+        except OSError as e:
+            errors.append(e)
+    threads = [threading.Thread(target=_save, args=(float(k),)) for k in range(1, 5)]
+    for th in threads: th.start()
+    for th in threads: th.join()
+    assert not errors and not [f for f in os.listdir(str(tmp_path)) if f.endswith(".tmp")]
+    assert store.get("123456.01", "20230101").chans_in == 2
+
+def test_hotswap(tmp_path):
+    '''
+    sensors of a measurement system: shared kernels, hot-swap during acquisition
+    '''
+    import appdef
+    import meas_sensor
+    store = CalibrationStore(p_dir=str(tmp_path))
+    store.save(_rkm(), "123456.01", "20230101")
+    sensors = [meas_sensor.SensorXKM(appdef.DEF_SENSORTYPES.PRO_RKM_W_2CH, addr_node=i, df_idpro="123456.01",
+                                     df_datecali="20230101") for i in range(1, 4)]
+    sensors.append(meas_sensor.SensorXKM(appdef.DEF_SENSORTYPES.PRO_RKM_W_2CH, addr_node=4, df_idpro="999"))
+    for sen in sensors: sen.md_init(np.zeros(shape=(10, 0)), np.zeros(shape=(10, 0)))
+    assert store.apply(sensors) == 3 and store.apply(sensors) == 0 and store.count_compiled == 1
+    assert sensors[0].calib is sensors[2].calib and sensors[3].calib is None #shared kernel, no file -> default
+
+    sensors[0].md_update_block([[1.0, 10.0], [2.0, 20.0]])
+    assert np.allclose(sensors[0].md_current_out(), _rkm()([2.0, 20.0]))
+    store.save(_rkm(5.0), "123456.01", "20230101")
+    assert store.apply(sensors) == 3 #hot-swap, no re-initialization of the measurement data
+    sensors[0].md_update_block([[3.0, 30.0]])
+    assert np.allclose(sensors[0].md_current_out(2)[:, 0], [_rkm(5.0)([3.0, 30.0]), _rkm()([2.0, 20.0])])
+
+def bench_calibstore(systems=99, sensors=16, p_dir=None):
+    '''
+    benchmark: applying the calibrations of systems x sensors (different sensors, LUTs), first and cached
+    '''
+    import time
+    import tempfile
+    import types
+    with tempfile.TemporaryDirectory() as tmp:
+        store = CalibrationStore(p_dir=p_dir or tmp)
+        sens = [types.SimpleNamespace(df_idpro_v=f"{100000+i}.{j:02d}", df_datecali_v="20230101", calib=None)
+                for i in range(0, systems) for j in range(0, sensors)]
+        for sen in sens: store.save(_rkm(), sen.df_idpro_v, sen.df_datecali_v, lut=(0, 4095))
+        for run in ("first", "cached"):
+            t0 = time.perf_counter()
+            store.apply(sens)
+            print("bench calibstore: %s -> %i sensors in %.3f s (compiled %i)"
+                  % (run, len(sens), time.perf_counter() - t0, store.count_compiled))
+
+if __name__ == '__main__':
+    print("running: meas_calibstore.py")
+    bench_calibstore()
+    print("done")
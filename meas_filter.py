@@ -0,0 +1,291 @@
+'''
+meas_filter.py .. stateful streaming filter bank (IIR biquads and FIR) for measurement channels
+
+Filters are applied on ingest (MeasurementData.update()/update_block() with filters=FilterBank(..)), the filter state
+is kept across blocks -> filtering is continuous in a stream and nothing is re-filtered on redraw.
+
+A FilterBank is a cascade of stages, each stage works on all channels at once (channels without a filter in the stage
+use a pass-through). Stage types:
+    IIR biquad .. second order section (RBJ audio EQ cookbook), low-pass/high-pass (butterworth cascade for order > 2),
+                  band-pass and notch. The recursion is solved block-wise: for chunks of CFG_CHUNK rows the output is
+                  y = H*v + G*y_init (H lower triangular impulse response matrix) -> a batched matmul for all channels
+                  instead of a python loop over samples
+    FIR        .. windowed-sinc (hamming), applied as a strided convolution over the block
+'''
+#3rd party
+import numpy as np
+import pytest
+
+#project specific
+try:
+    from libxkm import measdata
+except ModuleNotFoundError:
+    import measdata
+
+DBG_OUT = False #enable/disable debugging output
+
+DEF_FTYPES = ("lowpass", "highpass", "bandpass", "notch")
+DEF_Q = 1.0 / np.sqrt(2.0) #butterworth
+DEF_NTAPS = 63 #default number of FIR taps (odd -> linear phase type I)
+CFG_CHUNK = 64 #IIR block solution: rows per chunk (size of the impulse response matrix)
+
+def design_biquad(ftype, fc, fs, q=DEF_Q):
+    '''
+    returns normalized biquad coefficients (b0, b1, b2, a1, a2) for ftype at the (center) frequency fc
+    '''
+    w0 = 2.0*np.pi*fc/fs
+    cw = np.cos(w0)
+    alpha = np.sin(w0) / (2.0*q)
+    if ftype == "lowpass": b = ((1.0-cw)/2.0, 1.0-cw, (1.0-cw)/2.0)
+    elif ftype == "highpass": b = ((1.0+cw)/2.0, -(1.0+cw), (1.0+cw)/2.0)
+    elif ftype == "bandpass": b = (alpha, 0.0, -alpha) #0 dB peak gain
+    elif ftype == "notch": b = (1.0, -2.0*cw, 1.0)
+    else: raise ValueError(f"unknown filter type: {ftype}")
+    a0 = 1.0 + alpha
+    return (b[0]/a0, b[1]/a0, b[2]/a0, -2.0*cw/a0, (1.0-alpha)/a0)
+
+def design_fir(ftype, fc, fs, ntaps=DEF_NTAPS, fc2=None):
+    '''
+    returns FIR taps (windowed-sinc), band-pass and notch (band-stop) use the band [fc, fc2]
+    '''
+    if ntaps % 2 == 0: raise ValueError("FIR filters require an odd number of taps")
+    n = np.arange(ntaps) - (ntaps-1)/2.0
+    win = np.hamming(ntaps)
+    def lowpass(f):
+        h = 2.0*f/fs * np.sinc(2.0*f/fs*n) * win
+        return h / h.sum()
+    delta = (n == 0).astype(float)
+    if ftype == "lowpass": return lowpass(fc)
+    if ftype == "highpass": return delta - lowpass(fc)
+    if fc2 is None: raise ValueError(f"{ftype} FIR filter requires the band [fc, fc2]")
+    if ftype == "bandpass": return lowpass(fc2) - lowpass(fc)
+    if ftype == "notch": return delta - (lowpass(fc2) - lowpass(fc))
+    raise ValueError(f"unknown filter type: {ftype}")
+
+class BiquadStage():
+    '''
+    IIR second order section for all channels (coefficients for each channel), direct form I state
+    '''
+    def __init__(self, coef, chunk=CFG_CHUNK):
+        '''
+        coef .. (5, max_chans) coefficients b0, b1, b2, a1, a2 for each channel
+        '''
+        self.coef = np.asarray(coef, dtype=np.float64)
+        self.chunk = int(chunk)
+        b0, b1, b2, a1, a2 = self.coef
+        max_chans = self.coef.shape[1]
+        L = self.chunk
+
+        #responses of the recursive part y[n] = v[n] - a1*y[n-1] - a2*y[n-2]: impulse (h), initial state (g1, g2)
+        h = np.zeros(shape=(L+2, max_chans))
+        g1 = np.zeros(shape=(L+2, max_chans))
+        g2 = np.zeros(shape=(L+2, max_chans))
+        g1[1] = 1.0 #y[-1]
+        g2[0] = 1.0 #y[-2]
+        for n in range(2, L+2):
+            h[n] = (1.0 if n == 2 else 0.0) - a1*h[n-1] - a2*h[n-2]
+            g1[n] = -a1*g1[n-1] - a2*g1[n-2]
+            g2[n] = -a1*g2[n-1] - a2*g2[n-2]
+        h, g1, g2 = h[2:], g1[2:], g2[2:]
+        idx = np.arange(L)[:, np.newaxis] - np.arange(L)[np.newaxis, :]
+        self.mat_h = np.where(idx[..., np.newaxis] >= 0, h[np.clip(idx, 0, None)], 0.0).transpose(2, 0, 1) #(chans, L, L)
+        self.g1 = g1.T.copy() #(chans, L)
+        self.g2 = g2.T.copy()
+        self.reset()
+
+    def reset(self):
+        max_chans = self.coef.shape[1]
+        self.x_hist = np.zeros(shape=(2, max_chans)) #x[n-2], x[n-1]
+        self.y1 = np.zeros(shape=(max_chans,)) #y[n-1]
+        self.y2 = np.zeros(shape=(max_chans,)) #y[n-2]
+
+    def process(self, x):
+        ''' filters rows x (N, max_chans) -> (N, max_chans) '''
+        b0, b1, b2 = self.coef[0:3]
+        num = x.shape[0]
+        xx = np.concatenate((self.x_hist, x))
+        v = b0*xx[2:] + b1*xx[1:-1] + b2*xx[:-2] #non-recursive part, vectorized over the block
+        L = self.chunk if num > self.chunk else num
+        chunks = -(-num // L)
+        if chunks*L > num: v = np.concatenate((v, np.zeros(shape=(chunks*L - num, v.shape[1]))))
+        #zero state response of all chunks at once (chunks, L, chans), the state is propagated chunk by chunk
+        y = np.matmul(self.mat_h[:, :L, :L], v.reshape(chunks, L, v.shape[1]).transpose(2, 1, 0)).transpose(2, 1, 0)
+        g1, g2 = self.g1[:, :L].T, self.g2[:, :L].T
+        for k in range(0, chunks):
+            y[k] += g1*self.y1 + g2*self.y2
+            n = min(L, num - k*L)
+            self.y2 = y[k, n-2] if n > 1 else self.y1
+            self.y1 = y[k, n-1]
+        self.x_hist = xx[-2:].copy()
+        return y.reshape(chunks*L, -1)[:num]
+
+class FirStage():
+    '''
+    FIR filter for all channels (taps for each channel), the last ntaps-1 rows are the state
+    '''
+    def __init__(self, taps):
+        ''' taps .. (ntaps, max_chans) '''
+        self.taps = np.asarray(taps, dtype=np.float64)
+        self.reset()
+
+    def reset(self):
+        self.x_hist = np.zeros(shape=(self.taps.shape[0]-1, self.taps.shape[1]))
+
+    def process(self, x):
+        ''' filters rows x (N, max_chans) -> (N, max_chans) '''
+        xx = np.concatenate((self.x_hist, x))
+        frames = np.lib.stride_tricks.sliding_window_view(xx, self.taps.shape[0], axis=0) #(N, chans, ntaps)
+        y = np.einsum("nct,tc->nc", frames, self.taps[::-1])
+        self.x_hist = xx[x.shape[0]:].copy()
+        return y
+
+class FilterBank():
+    '''
+    cascade of filter stages for all channels of a measurement
+    '''
+    def __init__(self, max_chans, fs, chunk=CFG_CHUNK):
+        '''
+        max_chans .. number of channels, fs .. sample rate (Hz)
+        '''
+        self.max_chans = int(max_chans)
+        self.fs = float(fs)
+        self.chunk = chunk
+        self.stages = []
+
+    def add(self, ftype, fc, chans=None, fc2=None, q=None, order=2, kind="iir", ntaps=DEF_NTAPS):
+        '''
+        adds a filter stage for the channels chans (None -> all channels)
+            ftype .. "lowpass", "highpass", "bandpass" (band [fc, fc2] or center fc with q), "notch" (center fc with q)
+            order .. IIR low-pass/high-pass: even filter order (butterworth, one biquad per 2 orders)
+            kind .. "iir" or "fir" (FIR band-pass/notch use the band [fc, fc2])
+        '''
+        if ftype not in DEF_FTYPES: raise ValueError(f"unknown filter type: {ftype}")
+        sel = np.zeros(shape=(self.max_chans,), dtype=bool)
+        sel[slice(None) if chans is None else chans] = True
+        if kind == "fir":
+            taps = np.zeros(shape=(ntaps, self.max_chans))
+            taps[0] = 1.0 #pass-through
+            taps[:, sel] = design_fir(ftype, fc, self.fs, ntaps, fc2)[:, np.newaxis]
+            self.stages.append(FirStage(taps))
+            return self
+        if kind != "iir": raise ValueError(f"unknown filter kind: {kind}")
+
+        if ftype in ("bandpass", "notch") and fc2 is not None: #band -> center frequency and quality
+            fc, q = np.sqrt(fc*fc2), np.sqrt(fc*fc2) / (fc2 - fc)
+        if ftype in ("lowpass", "highpass"):
+            if order % 2: raise ValueError("IIR filter order must be even")
+            n = order // 2
+            qs = [1.0 / (2.0*np.cos(np.pi*(2*k+1)/(4*n))) for k in range(0, n)] if q is None else [q]*n
+        else:
+            qs = [DEF_Q if q is None else q]
+        for qk in qs:
+            coef = np.zeros(shape=(5, self.max_chans))
+            coef[0] = 1.0 #pass-through
+            coef[:, sel] = np.array(design_biquad(ftype, fc, self.fs, qk))[:, np.newaxis]
+            self.stages.append(BiquadStage(coef, self.chunk))
+        return self
+
+    def reset(self):
+        ''' clears the filter state of all stages '''
+        for stage in self.stages: stage.reset()
+
+    def process(self, rows):
+        '''
+        filters rows (N, max_chans) or a single row (max_chans,), the state is carried to the next call
+        '''
+        rows = np.asarray(rows, dtype=np.float64)
+        single = rows.ndim == 1
+        y = rows[np.newaxis] if single else rows
+        for stage in self.stages: y = stage.process(y)
+        return y[0] if single else y
+
+def test_usage_regular():
+    '''
+    block-wise filtering equals filtering in one go (state), attenuation of IIR and FIR filters, channel selection
+    '''
+    fs = 1000.0
+    t = np.arange(4000) / fs
+    low = np.sin(2*np.pi*5.0*t)
+    high = np.sin(2*np.pi*200.0*t)
+    rows = np.stack((low + high, low + high, high), axis=1)
+
+    bank = FilterBank(3, fs).add("lowpass", 30.0, chans=[0], order=4).add("lowpass", 30.0, chans=[1], kind="fir", ntaps=101)
+    ref = FilterBank(3, fs).add("lowpass", 30.0, chans=[0], order=4).add("lowpass", 30.0, chans=[1], kind="fir", ntaps=101)
+    y_all = ref.process(rows)
+    y = np.concatenate([bank.process(rows[i:i+n]) for i, n in ((0, 1), (1, 7), (8, 500), (508, 1), (509, 3491))])
+    assert np.allclose(y, y_all)
+
+    #direct recursion (reference for the block solution)
+    y_ref = rows[:, 0].copy()
+    for stage in ref.stages[0:2]:
+        b0, b1, b2, a1, a2 = stage.coef[:, 0]
+        x, y_ref = y_ref, np.zeros(shape=y_ref.shape)
+        for n in range(0, len(x)):
+            y_ref[n] = b0*x[n] + (b1*x[n-1] + b2*x[n-2] - a1*y_ref[n-1] - a2*y_ref[n-2] if n >= 2 else 0.0) \
+                       + (b1*x[0] - a1*y_ref[0] if n == 1 else 0.0)
+    assert np.allclose(y_all[:, 0], y_ref)
+
+    settled = slice(1000, None)
+    assert np.isclose(np.std(y_all[settled, 0]), np.std(low), rtol=0.02) #IIR: pass band amplitude (phase shifted)
+    assert np.max(np.abs(y_all[settled, 1] - np.roll(low, 50)[settled])) < 0.01 #FIR: linear phase, delay 50 rows
+    assert np.array_equal(y_all[:, 2], rows[:, 2]) #channel without filter
+
+    bank = FilterBank(1, fs).add("notch", 200.0, q=5.0)
+    assert np.std(bank.process(rows[:, 2:3])[settled]) < 0.01
+    bank = FilterBank(1, fs).add("bandpass", 150.0, fc2=250.0).add("highpass", 50.0)
+    out = bank.process(rows[:, 1:2])[settled, 0]
+    assert np.isclose(np.std(out), np.std(high), rtol=0.1)
+    with pytest.raises(ValueError):
+        FilterBank(1, fs).add("lowpass", 10.0, order=3)
+
+def test_ingest():
+    '''
+    MeasurementData with ingest filters: row-wise and block-wise updates store the filtered rows, quantized storage
+    '''
+    fs = 1000.0
+    t = np.arange(600) / fs
+    rows = np.stack((np.sin(2*np.pi*10.0*t) + 0.5*np.sin(2*np.pi*300.0*t), np.full(600, 3.0)), axis=1) * 100.0
+    ref = FilterBank(2, fs).add("lowpass", 50.0, order=4).process(rows)
+    mdata = measdata.MeasurementData([0, 1], max_short=1000, filters=FilterBank(2, fs).add("lowpass", 50.0, order=4))
+    for i in range(0, 10): mdata.update(rows[i], t[i])
+    mdata.update_block(rows[10:], t[10:])
+    assert np.allclose(mdata.window_y(), ref)
+    mdata.init_data() #filter state is cleared
+    mdata.update_block(rows, t)
+    assert np.allclose(mdata.window_y(), ref)
+
+    mdata = measdata.MeasurementData([0, 1], max_short=1000, dtype=np.int16, scale=0.01,
+                                     filters=FilterBank(2, fs).add("lowpass", 50.0, order=4))
+    mdata.update_block(rows, t)
+    assert np.array_equal(mdata.window_y(raw=True), np.rint(ref)) and np.allclose(mdata.window_y(), ref*0.01, atol=0.006)
+
+    #saturating input: the overshoot of the filter is clipped to the storage range, it does not wrap around
+    step = np.concatenate((np.zeros(50), np.full(150, 32767.0)))
+    ref = FilterBank(1, fs).add("lowpass", 50.0, order=4).process(step[:, np.newaxis])
+    bank = FilterBank(1, fs).add("lowpass", 50.0, order=4)
+    mdata = measdata.MeasurementData([0], max_short=1000, dtype=np.int16, filters=bank)
+    mdata.update_block(step[:, np.newaxis], np.arange(200) / fs)
+    raw = mdata.window_y(raw=True)
+    assert ref.max() > 32767 and raw.min() >= 0 and raw.max() == 32767
+    assert np.array_equal(raw, np.clip(np.rint(ref), -32768, 32767))
+
+def bench_filter(max_chans=32, fs=10000.0, seconds=5.0, blocksize=500):
+    '''
+    benchmark: 4th order low-pass and notch for max_chans channels at fs
+    '''
+    import time
+    num = int(fs*seconds)
+    rows = np.random.default_rng(7).normal(size=(num, max_chans))
+    bank = FilterBank(max_chans, fs).add("lowpass", 1000.0, order=4).add("notch", 50.0, q=10.0)
+    t0 = time.perf_counter()
+    for i in range(0, num, blocksize): bank.process(rows[i:i+blocksize])
+    t_spent = time.perf_counter() - t0
+    print("bench filter: chans=%i fs=%.0f stages=%i -> %.3f s for %.1f s data | x%.0f real time"
+          % (max_chans, fs, len(bank.stages), t_spent, seconds, seconds/t_spent))
+
+if __name__ == '__main__':
+    print("running: meas_filter.py")
+    test_usage_regular()
+    test_ingest()
+    bench_filter()
+    print("done")
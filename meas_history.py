@@ -0,0 +1,290 @@
+'''
+meas_history.py .. long-term measurement history tier (disk backed, numpy.memmap)
+
+Rows leaving the short in-RAM window of a MeasurementData object are spilled into this tier. Data is stored in
+memory mapped files, so RAM usage is bounded and paging is done by the operating system:
+    <name>_y.dat .. y-values, shape (max_long, max_chans)
+    <name>_t.dat .. t-values, shape (max_long, chans_t) -> one column per channel or a shared column (chans_t=1)
+    <name>.ini   .. layout information (channels, depth, data types, number of written rows, scale/offset)
+
+Quantized (integer) y-values are stored as they are (raw), the ini file holds the per-channel scale and offset
+to decode them (value = raw*scale + offset), see decode().
+
+The history is a ring on disk: as soon as max_long rows are written, the oldest rows are overwritten. Rows are
+addressed by their absolute row number (0 = first row ever written). A measurement can be reopened after a restart
+via load_history() without a reload pass.
+'''
+#python standard
+import os
+import configparser
+#3rd party
+import numpy as np
+import pytest
+
+#project specific
+try:
+    from libxkm import appcfg
+except ModuleNotFoundError:
+    import appcfg
+
+DBG_OUT = False #enable/disable debugging output
+
+DEFINI_SEC_HIST = "history" #ini section with layout information
+DEF_FILEENDING_Y = "_y.dat"
+DEF_FILEENDING_T = "_t.dat"
+DEF_FILEENDING_INI = ".ini"
+CFG_FLUSH_ROWS = 4096 #ini file is updated (flushed) after this number of written rows -> reopen after a crash
+
+class MeasurementHistory():
+    '''
+    disk backed long-term history for measurement data (y-values and t-values for each channel)
+    '''
+    def __init__(self, max_chans, max_long, dtype=np.float32, p_dir=None, name="meas", mode="w+", 
+                 dtype_t=None, scale=None, offset=None, chans_t=None):
+        '''
+        max_chans .. number of measurement channels (columns)
+        max_long .. number of rows the history holds (ring capacity)
+        dtype, dtype_t .. data type of the y-values and of the t-values (None -> same as the y-values)
+        scale, offset .. per-channel decoding of quantized y-values, None -> 1.0 and 0.0 (stored in the ini file)
+        chans_t .. number of t-columns, None -> one for each channel, 1 -> shared timestamp column (i.e., int64 ns)
+        p_dir .. directory for the history files, None -> appcfg.CFG.p_dir_meas
+        name .. base file name of the history files
+        mode .. "w+" create (overwrite) files, "r+" open existing files for reading and writing, "r" read only
+        '''
+        if p_dir is None: p_dir = appcfg.CFG.p_dir_meas
+        if not os.path.isdir(p_dir): os.makedirs(p_dir)
+        self.p_dir = os.path.abspath(p_dir)
+        self.name = name
+        self.max_chans = int(max_chans)
+        self.max_long = int(max_long)
+        self.chans_t = self.max_chans if chans_t is None else int(chans_t)
+        self.dtype = np.dtype(dtype)
+        self.dtype_t = self.dtype if dtype_t is None else np.dtype(dtype_t)
+        self.scale = np.ones(shape=(self.max_chans,)) if scale is None else np.asarray(scale, dtype=float)
+        self.offset = np.zeros(shape=(self.max_chans,)) if offset is None else np.asarray(offset, dtype=float)
+        self.mode = mode
+        self.count = 0 #number of rows written since creation of the history (does not saturate)
+        self._count_flushed = 0
+
+        self.fp_y = os.path.join(self.p_dir, name + DEF_FILEENDING_Y)
+        self.fp_t = os.path.join(self.p_dir, name + DEF_FILEENDING_T)
+        self.fp_ini = os.path.join(self.p_dir, name + DEF_FILEENDING_INI)
+
+        if mode != "w+": self.count = self._count_flushed = self.ini_read()[3]
+        self.md_y = np.memmap(self.fp_y, dtype=self.dtype, mode=mode, shape=(self.max_long, self.max_chans))
+        self.md_t = np.memmap(self.fp_t, dtype=self.dtype_t, mode=mode, shape=(self.max_long, self.chans_t))
+        if mode == "w+": self.ini_write()
+
+    def first(self):
+        ''' returns the absolute row number of the oldest row still available '''
+        return max(0, self.count - self.max_long)
+
+    def write(self, rows_y, rows_t):
+        '''
+        append rows (oldest first) to the history, rows_t can be anything broadcastable to (rows, chans_t), a vector
+        holds one value for each row
+        '''
+        rows_y = np.asarray(rows_y)
+        num = rows_y.shape[0]
+        rows_t = np.asarray(rows_t)
+        if rows_t.ndim == 1: rows_t = rows_t[:, np.newaxis]
+        rows_t = np.broadcast_to(rows_t, (num, self.chans_t))
+        if num > self.max_long: #only the newest rows survive
+            self.count += num - self.max_long
+            rows_y = rows_y[-self.max_long:]
+            rows_t = rows_t[-self.max_long:]
+            num = self.max_long
+
+        pos = self.count % self.max_long
+        first = min(num, self.max_long - pos)
+        self.md_y[pos:pos+first] = rows_y[:first]
+        self.md_t[pos:pos+first] = rows_t[:first]
+        if num > first:
+            self.md_y[0:num-first] = rows_y[first:]
+            self.md_t[0:num-first] = rows_t[first:]
+        self.count += num
+
+        if self.count - self._count_flushed >= CFG_FLUSH_ROWS: self.flush()
+        return self.count
+
+    def rows(self, start=None, stop=None):
+        '''
+        returns (t, y) for the absolute rows [start, stop), oldest first
+            - zero-copy memmap slices, as long as the range is not split by the ring wraparound (otherwise a copy)
+            - start/stop None -> oldest/newest available row
+        '''
+        first = self.first()
+        start = first if start is None else int(start)
+        stop = self.count if stop is None else int(stop)
+        if start < first or stop > self.count or start > stop:
+            raise IndexError(f"history rows [{start}, {stop}) not available, valid is [{first}, {self.count})")
+        pos = start % self.max_long
+        num = stop - start
+        if pos + num <= self.max_long:
+            return (self.md_t[pos:pos+num], self.md_y[pos:pos+num])
+        rest = pos + num - self.max_long
+        return (np.concatenate((self.md_t[pos:], self.md_t[:rest])),
+                np.concatenate((self.md_y[pos:], self.md_y[:rest])))
+
+    def search(self, ts, side="left", col=0):
+        '''
+        binary search (numpy.searchsorted, O(log n)) of the timestamp ts in the time column col -> absolute row number of
+        the first row with time >= ts (side="left") or > ts (side="right"), count if all rows are before ts
+        -> the ring is searched as its two ascending segments (oldest rows up to the wraparound, then the rest)
+        '''
+        first = self.first()
+        pos = first % self.max_long
+        num = self.count - first
+        seg = self.md_t[pos:min(pos+num, self.max_long), col]
+        i = int(np.searchsorted(seg, ts, side=side))
+        if i == len(seg) and pos + num > self.max_long:
+            i += int(np.searchsorted(self.md_t[:pos+num-self.max_long, col], ts, side=side))
+        return first + i
+
+    def decode(self, y, dtype=np.float32):
+        ''' returns decoded y-values (value = raw*scale + offset), y-values of a float history are returned as they are '''
+        if self.dtype.kind == "f": return y
+        return (y * self.scale + self.offset).astype(dtype, copy=False)
+
+    def flush(self):
+        ''' write changed data to disk and update layout information '''
+        if self.mode == "r": return
+        self.md_y.flush()
+        self.md_t.flush()
+        self.ini_write()
+        self._count_flushed = self.count
+
+    def close(self):
+        self.flush()
+        self.md_y = None
+        self.md_t = None
+
+    def ini_write(self):
+        ''' writes layout information into the ini file '''
+        cfgp = configparser.ConfigParser()
+        cfgp[DEFINI_SEC_HIST] = {
+            "max_chans": str(self.max_chans),
+            "max_long": str(self.max_long),
+            "dtype": self.dtype.str,
+            "count": str(self.count),
+            "dtype_t": self.dtype_t.str,
+            "chans_t": str(self.chans_t),
+            "scale": ",".join(repr(float(x)) for x in self.scale),
+            "offset": ",".join(repr(float(x)) for x in self.offset),
+        }
+        with open(self.fp_ini, "w") as f:
+            cfgp.write(f)
+
+    def ini_read(self):
+        ''' returns layout information from the ini file, see ini_read() '''
+        return ini_read(self.fp_ini)
+
+    def __str__(self):
+        return f"HIST {self.name} in {self.p_dir} | CH={self.max_chans} | ROWS={self.count} / MAX={self.max_long}"
+
+def ini_read(fp_ini):
+    '''
+    reads history layout information from an ini file 
+        -> (max_chans, max_long, dtype, count, dtype_t, scale, offset, chans_t)
+    '''
+    cfgp = configparser.ConfigParser()
+    if not cfgp.read(fp_ini): raise FileNotFoundError(f"history ini file is missing: {fp_ini}")
+    sec = cfgp[DEFINI_SEC_HIST]
+    max_chans = int(sec["max_chans"])
+    scale = [float(x) for x in sec["scale"].split(",")] if "scale" in sec else None
+    offset = [float(x) for x in sec["offset"].split(",")] if "offset" in sec else None
+    return (max_chans, int(sec["max_long"]), np.dtype(sec["dtype"]), int(sec["count"]), 
+            np.dtype(sec.get("dtype_t", sec["dtype"])), scale, offset, int(sec.get("chans_t", max_chans)))
+
+def load_history(name, p_dir=None, mode="r"):
+    '''
+    reopens a measurement history (i.e., after a restart) with the layout stored in its ini file
+    '''
+    if p_dir is None: p_dir = appcfg.CFG.p_dir_meas
+    max_chans, max_long, dtype, count, dtype_t, scale, offset, chans_t = ini_read(os.path.join(p_dir, name + DEF_FILEENDING_INI))
+    return MeasurementHistory(max_chans, max_long, dtype=dtype, p_dir=p_dir, name=name, mode=mode, 
+                              dtype_t=dtype_t, scale=scale, offset=offset, chans_t=chans_t)
+
+def ts_delta_encode(ts):
+    '''
+    delta encoding of int64 timestamps for archiving -> (first timestamp, differences) 
+    the differences of regularly sampled data are small and constant, so they fit into a smaller type and compress well
+    '''
+    ts = np.asarray(ts, dtype=np.int64)
+    if len(ts) == 0: return (None, np.zeros(shape=(0,), dtype=np.int64))
+    delta = np.diff(ts)
+    if len(delta) and delta.min() >= np.iinfo(np.int32).min and delta.max() <= np.iinfo(np.int32).max:
+        delta = delta.astype(np.int32)
+    return (int(ts[0]), delta)
+
+def ts_delta_decode(ts0, delta):
+    ''' decodes delta encoded timestamps (see ts_delta_encode()) -> int64 timestamps '''
+    if ts0 is None: return np.zeros(shape=(0,), dtype=np.int64)
+    ts = np.empty(shape=(len(delta)+1,), dtype=np.int64)
+    ts[0] = ts0
+    np.cumsum(delta, dtype=np.int64, out=ts[1:])
+    ts[1:] += ts0
+    return ts
+
+def test_usage_regular(tmp_path):
+    '''
+    writing with wraparound, zero-copy slicing and reopening from disk
+    '''
+    hist = MeasurementHistory(max_chans=3, max_long=10, p_dir=str(tmp_path), name="test")
+    rows = np.arange(0, 3*14, dtype=np.float32).reshape(14, 3)
+    hist.write(rows[0:6], 0.0)
+    t, y = hist.rows(2, 6)
+    assert isinstance(y, np.memmap) and np.array_equal(y, rows[2:6])
+    hist.write(rows[6:14], rows[6:14, 0:1]) #wraps around
+    assert hist.first() == 4 and hist.count == 14
+    t, y = hist.rows()
+    assert np.array_equal(y, rows[4:14])
+    assert np.array_equal(t[2:,2], rows[6:14, 0]) and np.all(t[:2] == 0.0)
+    with pytest.raises(IndexError):
+        hist.rows(0, 5)
+    hist.close()
+
+    hist = load_history("test", p_dir=str(tmp_path))
+    assert hist.count == 14
+    assert np.array_equal(hist.rows(10, 14)[1], rows[10:14])
+    hist.close()
+
+    #quantized y-values, decoded with the scale/offset of the ini file
+    hist = MeasurementHistory(max_chans=2, max_long=10, dtype=np.int16, dtype_t=np.float64, p_dir=str(tmp_path), 
+                              name="test_int", scale=[0.5, 2.0], offset=[0.0, -1.0])
+    hist.write(np.array([[10, 10], [-4, 3]], dtype=np.int16), [[0.1], [0.2]])
+    hist.close()
+    hist = load_history("test_int", p_dir=str(tmp_path))
+    t, y = hist.rows()
+    assert y.dtype == np.int16 and t.dtype == np.float64 and t[1,0] == 0.2
+    assert np.array_equal(hist.decode(y), [[5.0, 19.0], [-2.0, 5.0]])
+    hist.close()
+
+    #shared int64 timestamp column
+    hist = MeasurementHistory(max_chans=3, max_long=10, dtype_t=np.int64, chans_t=1, p_dir=str(tmp_path), name="test_ts")
+    hist.write(rows[0:4], np.arange(0, 4)*1000000007)
+    hist.close()
+    t, y = load_history("test_ts", p_dir=str(tmp_path)).rows()
+    assert t.shape == (4, 1) and t[3,0] == 3000000021
+
+    #binary search of timestamps across the ring wraparound
+    hist = load_history("test_ts", p_dir=str(tmp_path), mode="r+")
+    hist.write(rows[4:14], np.arange(4, 14)*1000)
+    assert hist.first() == 4 and hist.search(6000) == 6 and hist.search(6000, side="right") == 7
+    assert hist.search(11500) == 12 and hist.search(0) == 4 and hist.search(99999) == 14
+
+def test_ts_delta():
+    '''
+    delta encoding of timestamps is lossless
+    '''
+    ts = np.cumsum(np.random.default_rng(4).integers(999000, 1001000, size=1000)) + 2**40
+    ts0, delta = ts_delta_encode(ts)
+    assert delta.dtype == np.int32 and np.array_equal(ts_delta_decode(ts0, delta), ts)
+    assert len(ts_delta_decode(*ts_delta_encode([]))) == 0 and list(ts_delta_decode(*ts_delta_encode([5]))) == [5]
+
+if __name__ == '__main__':
+    import tempfile
+    print("running: meas_history.py")
+    test_usage_regular(tempfile.mkdtemp())
+    test_ts_delta()
+    print("done")
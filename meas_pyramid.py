@@ -0,0 +1,186 @@
+'''
+meas_pyramid.py .. multi-level min/max/mean decimation pyramid for measurement data
+
+The pyramid is updated incrementally with each row or block of rows a MeasurementData object receives. Level i
+combines DEF_LEVELS[i] samples into one bucket (min, max and mean for each channel, time of the first sample).
+Levels are built from the level below, so an update costs O(channels) per row (amortized).
+
+Reading a time range at a target point count selects the finest level with not more buckets than requested points,
+the result are views into the level rings -> O(points) instead of O(samples), used for zoomed-out rendering.
+'''
+#3rd party
+import numpy as np
+import pytest
+
+DBG_OUT = False #enable/disable debugging output
+
+DEF_LEVELS = (8, 64, 512) #samples per bucket for each level (each level must be a multiple of the level below)
+
+class PyramidLevel():
+    '''
+    single pyramid level, buckets are stored in ring buffers with a mirrored second half (contiguous ordered views)
+    '''
+    def __init__(self, factor, ratio, depth, max_chans, dtype):
+        '''
+        factor .. samples per bucket
+        ratio .. items (samples or buckets of the level below) per bucket
+        depth .. number of buckets the level holds
+        '''
+        self.factor = int(factor)
+        self.ratio = int(ratio)
+        self.depth = int(depth)
+        self.count = 0 #buckets written (does not saturate)
+        self.head = 0
+        self.b_t = np.full(shape=(2*self.depth,), fill_value=np.nan, dtype=np.float64)
+        self.b_min = np.full(shape=(2*self.depth, max_chans), fill_value=np.nan, dtype=dtype)
+        self.b_max = np.full(shape=(2*self.depth, max_chans), fill_value=np.nan, dtype=dtype)
+        self.b_mean = np.full(shape=(2*self.depth, max_chans), fill_value=np.nan, dtype=dtype)
+
+        #pending (not yet completed) bucket
+        self.p_num = 0
+        self.p_t = np.nan
+        self.p_min = np.full(shape=(max_chans,), fill_value=np.nan, dtype=np.float64)
+        self.p_max = np.full(shape=(max_chans,), fill_value=np.nan, dtype=np.float64)
+        self.p_sum = np.zeros(shape=(max_chans,), dtype=np.float64)
+
+    def feed(self, t, mn, mx, sm):
+        '''
+        adds items (oldest first) to the level and returns the completed buckets as (t, min, max, sum) or None
+            t .. (n,) time of the first sample of each item, mn/mx/sm .. (n, max_chans) min, max and sum of each item
+        '''
+        n = len(t)
+        i = 0
+        done = []
+        if self.p_num > 0 or n < self.ratio: #fill up the pending bucket first
+            i = min(self.ratio - self.p_num, n)
+            if self.p_num == 0: self.p_t = t[0]
+            np.fmin(self.p_min, np.fmin.reduce(mn[:i], axis=0), out=self.p_min)
+            np.fmax(self.p_max, np.fmax.reduce(mx[:i], axis=0), out=self.p_max)
+            self.p_sum += sm[:i].sum(axis=0)
+            self.p_num += i
+            if self.p_num == self.ratio:
+                done.append((np.array([self.p_t]), self.p_min[np.newaxis].copy(), self.p_max[np.newaxis].copy(),
+                             self.p_sum[np.newaxis].copy()))
+                self.p_num = 0
+                self.p_min.fill(np.nan)
+                self.p_max.fill(np.nan)
+                self.p_sum.fill(0.0)
+
+        nfull = (n - i) // self.ratio
+        if nfull > 0: #complete buckets, vectorized
+            j = i + nfull*self.ratio
+            shape = (nfull, self.ratio, mn.shape[1])
+            done.append((t[i:j:self.ratio], np.fmin.reduce(mn[i:j].reshape(shape), axis=1),
+                         np.fmax.reduce(mx[i:j].reshape(shape), axis=1), sm[i:j].reshape(shape).sum(axis=1)))
+            i = j
+
+        if i < n: #rest goes into the pending bucket
+            self.p_t = t[i]
+            self.p_min[:] = np.fmin.reduce(mn[i:], axis=0)
+            self.p_max[:] = np.fmax.reduce(mx[i:], axis=0)
+            self.p_sum[:] = sm[i:].sum(axis=0)
+            self.p_num = n - i
+
+        if not done: return None
+        if len(done) == 1: b_t, b_mn, b_mx, b_sm = done[0]
+        else: b_t, b_mn, b_mx, b_sm = [np.concatenate(x) for x in zip(*done)]
+        self.write(b_t, b_mn, b_mx, b_sm / self.factor)
+        return (b_t, b_mn, b_mx, b_sm)
+
+    def write(self, b_t, b_mn, b_mx, b_mean):
+        ''' appends completed buckets to the level ring '''
+        num = len(b_t)
+        skip = max(0, num - self.depth)
+        head = (self.head + skip) % self.depth
+        for ring, rows in ((self.b_t, b_t), (self.b_min, b_mn), (self.b_max, b_mx), (self.b_mean, b_mean)):
+            rows = rows[skip:]
+            first = min(len(rows), self.depth - head)
+            ring[head:head+first] = rows[:first]
+            ring[head+self.depth:head+self.depth+first] = rows[:first]
+            if len(rows) > first:
+                ring[0:len(rows)-first] = rows[first:]
+                ring[self.depth:self.depth+len(rows)-first] = rows[first:]
+        self.head = (self.head + num) % self.depth
+        self.count += num
+
+    def window(self):
+        ''' returns ordered views (oldest first) of all valid buckets (t, min, max, mean) '''
+        num = min(self.count, self.depth)
+        end = self.head + self.depth
+        return (self.b_t[end-num:end], self.b_min[end-num:end], self.b_max[end-num:end], self.b_mean[end-num:end])
+
+class MeasurementPyramid():
+    '''
+    min/max/mean decimation pyramid for all channels of a measurement
+    '''
+    def __init__(self, max_chans, max_rows, levels=DEF_LEVELS, dtype=np.float32):
+        '''
+        max_chans .. number of channels
+        max_rows .. number of (newest) samples the pyramid must cover
+        levels .. samples per bucket for each level, i.e., (8, 64, 512)
+        '''
+        self.max_chans = int(max_chans)
+        self.levels = []
+        below = 1
+        for factor in levels:
+            if factor % below != 0: raise ValueError("pyramid levels must be multiples of each other")
+            depth = max(1, -(-int(max_rows) // factor))
+            self.levels.append(PyramidLevel(factor, factor // below, depth, self.max_chans, dtype))
+            below = factor
+
+    def update(self, rows_y, rows_t):
+        '''
+        adds rows (N, max_chans) with their times (N,) to the pyramid, oldest row first
+        '''
+        rows_y = np.asarray(rows_y)
+        ret = (rows_t, rows_y, rows_y, rows_y) #raw samples: min = max = sum = value
+        for lvl in self.levels:
+            ret = lvl.feed(*ret)
+            if ret is None: break
+    
+    def select(self, points, t0=None, t1=None):
+        '''
+        returns (t, min, max, mean) views for the time range [t0, t1] of the finest level having at most points buckets
+        in the range (coarsest level if none qualifies) and the selected level
+        '''
+        for lvl in self.levels:
+            b_t = lvl.window()[0]
+            i0 = 0 if t0 is None else np.searchsorted(b_t, t0, side="left")
+            i1 = len(b_t) if t1 is None else np.searchsorted(b_t, t1, side="right")
+            if i1 - i0 <= points: break
+        return tuple(x[i0:i1] for x in lvl.window()) + (lvl,)
+
+def test_usage_regular():
+    '''
+    incremental updates (rows and blocks) must equal a direct decimation of the full data
+    '''
+    max_chans = 3
+    rows = np.random.default_rng(1).normal(size=(5000, max_chans)).astype(np.float32)
+    times = np.arange(0, 5000, dtype=np.float64)*0.01
+    pyr = MeasurementPyramid(max_chans, max_rows=5000, levels=(8, 64, 512))
+    i = 0
+    for num in [1, 1, 5, 3, 100, 7, 1000, 1, 2000, 1882]:
+        pyr.update(rows[i:i+num], times[i:i+num])
+        i += num
+    assert i == 5000
+    for lvl in pyr.levels:
+        n = 5000 // lvl.factor
+        b_t, b_mn, b_mx, b_mean = lvl.window()
+        assert len(b_t) == n
+        blocks = rows[:n*lvl.factor].reshape(n, lvl.factor, max_chans)
+        assert np.array_equal(b_mn, blocks.min(axis=1))
+        assert np.array_equal(b_mx, blocks.max(axis=1))
+        assert np.allclose(b_mean, blocks.mean(axis=1), atol=1e-5)
+        assert np.array_equal(b_t, times[:n*lvl.factor:lvl.factor])
+
+    t, mn, mx, mean, lvl = pyr.select(points=100)
+    assert lvl.factor == 64 and len(t) == 5000 // 64
+    t, mn, mx, mean, lvl = pyr.select(points=200, t0=10.0, t1=20.0) #1000 samples -> 125 buckets in level 0
+    assert lvl.factor == 8 and t[0] >= 10.0 and t[-1] <= 20.0
+    with pytest.raises(ValueError):
+        MeasurementPyramid(max_chans, 100, levels=(8, 60))
+
+if __name__ == '__main__':
+    print("running: meas_pyramid.py")
+    test_usage_regular()
+    print("done")
@@ -0,0 +1,301 @@
+'''
+meas_rainflow.py .. streaming rainflow cycle counting for fatigue / remaining-life estimation (i.e., crane runway girders)
+
+The counter consumes blocks of rows and keeps only the open residual (reversals not yet closed to a cycle) for each
+channel -> weeks of load history are counted online with fixed memory:
+    1. turning points (reversals) of the block are extracted vectorized, the running extreme is carried to the next block
+    2. reversals are pushed onto the residual stack, closed cycles are removed with the four-point criterion
+       (inner range <= both outer ranges -> full cycle), the residual is counted as half cycles on request
+    3. closed cycles are added to a range/mean histogram (chans, bins_range, bins_mean) and to the Miner damage sum
+
+Miner damage uses an S-N (Woehler) curve for ranges S: N(S) = sn_n * (sn_s/S)^sn_k, i.e., detail category
+sn_s = delta sigma_C at sn_n = 2e6 cycles with slope sn_k = 3 (EN 1993-1-9), cycles below sn_cut are not damaging.
+'''
+#3rd party
+import numpy as np
+import pytest
+
+#project specific
+try:
+    from libxkm import measdata
+except ModuleNotFoundError:
+    import measdata
+
+DBG_OUT = False #enable/disable debugging output
+
+DEF_BINS = 64 #default number of range and mean bins
+DEF_SN_N = 2.0e6 #S-N curve: reference number of cycles
+DEF_SN_K = 3.0 #S-N curve: slope
+
+class RainflowCounter():
+    '''
+    rainflow counting for all channels with range/mean histogram and Miner damage
+    '''
+    def __init__(self, max_chans, range_max, mean_min=None, mean_max=None, bins_range=DEF_BINS, bins_mean=DEF_BINS,
+                 sn_s=1.0, sn_n=DEF_SN_N, sn_k=DEF_SN_K, sn_cut=0.0):
+        '''
+        range_max .. upper edge of the range histogram (larger ranges are counted in the last bin)
+        mean_min, mean_max .. edges of the mean histogram, None -> [-range_max, range_max] (outliers -> outer bins)
+        sn_s, sn_n, sn_k, sn_cut .. S-N curve for the damage sum (see module description)
+        '''
+        self.max_chans = int(max_chans)
+        self.range_max = float(range_max)
+        self.mean_min = -self.range_max if mean_min is None else float(mean_min)
+        self.mean_max = self.range_max if mean_max is None else float(mean_max)
+        self.bins_range = int(bins_range)
+        self.bins_mean = int(bins_mean)
+        self.sn_s, self.sn_n, self.sn_k, self.sn_cut = float(sn_s), float(sn_n), float(sn_k), float(sn_cut)
+        self.reset()
+
+    def reset(self):
+        ''' clears the counts, the histogram and the residual '''
+        self.hist = np.zeros(shape=(self.max_chans, self.bins_range, self.bins_mean), dtype=np.float64)
+        self.cycles = np.zeros(shape=(self.max_chans,), dtype=np.int64) #number of closed (full) cycles
+        self.damage_sum = np.zeros(shape=(self.max_chans,), dtype=np.float64) #Miner damage of the closed cycles
+        self.stack = [[] for _ in range(0, self.max_chans)] #residual reversals for each channel
+        self.cand = np.full(shape=(self.max_chans,), fill_value=np.nan) #running extreme (not yet a reversal)
+        self.direction = np.zeros(shape=(self.max_chans,), dtype=np.int8) #direction of the running extreme
+        self.count = 0 #number of rows counted
+
+    @property
+    def edges_range(self): return np.linspace(0.0, self.range_max, self.bins_range + 1)
+
+    @property
+    def edges_mean(self): return np.linspace(self.mean_min, self.mean_max, self.bins_mean + 1)
+
+    def _reversals(self, chan, col):
+        ''' confirmed reversals of the values col for a channel (vectorized), updates the running extreme '''
+        start = np.isnan(self.cand[chan])
+        x = col if start else np.concatenate(([self.cand[chan]], col))
+        d = np.diff(x)
+        nz = np.flatnonzero(d)
+        self.cand[chan] = x[-1] #a monotone run ends with its extreme
+        if len(nz) == 0: return x[:1] if start else x[:0]
+        s = np.sign(d[nz]).astype(np.int8)
+        prev = np.concatenate(([self.direction[chan]], s[:-1]))
+        self.direction[chan] = s[-1]
+        rev = x[nz[(s != prev) & (prev != 0)]]
+        return np.concatenate((x[:1], rev)) if start else rev
+
+    def _damage(self, ranges):
+        ''' Miner damage of cycles with the given ranges (full cycles) '''
+        ranges = ranges[ranges > self.sn_cut]
+        return np.sum((ranges / self.sn_s) ** self.sn_k) / self.sn_n
+
+    def _bin(self, ranges, means):
+        ''' histogram bin indexes for ranges and means '''
+        ir = np.clip((ranges * (self.bins_range / self.range_max)).astype(np.intp), 0, self.bins_range-1)
+        im = np.clip(((means - self.mean_min) * (self.bins_mean / (self.mean_max - self.mean_min))).astype(np.intp),
+                     0, self.bins_mean-1)
+        return ir, im
+
+    def update(self, rows):
+        '''
+        counts rows (N, max_chans) or a single row (max_chans,) -> returns the number of new closed cycles
+        '''
+        rows = np.asarray(rows, dtype=np.float64)
+        if rows.ndim == 1: rows = rows[np.newaxis]
+        closed = 0
+        for chan in range(0, self.max_chans):
+            stack = self.stack[chan]
+            lo, hi = [], [] #closed cycles (reversal pairs)
+            for r in self._reversals(chan, rows[:, chan]).tolist(): _push(stack, r, lo, hi)
+            if not lo: continue
+            lo, hi = np.array(lo), np.array(hi)
+            ranges, means = np.abs(hi - lo), (hi + lo) / 2.0
+            ir, im = self._bin(ranges, means)
+            np.add.at(self.hist[chan], (ir, im), 1.0)
+            self.damage_sum[chan] += self._damage(ranges)
+            self.cycles[chan] += len(lo)
+            closed += len(lo)
+        self.count += rows.shape[0]
+        if DBG_OUT: print(f"RAINFLOW: +{closed} cycles -> {self.cycles}")
+        return closed
+
+    def residual(self, chan):
+        ''' open reversals of a channel including the running extreme '''
+        stack = self.stack[chan]
+        if np.isnan(self.cand[chan]) or (stack and stack[-1] == self.cand[chan] and self.direction[chan] == 0):
+            return np.array(stack)
+        return np.array(stack + [self.cand[chan]])
+
+    def _residual_cycles(self, chan):
+        '''
+        ranges, means and counts of the residual: the running extreme may still close a full cycle, the remaining
+        reversals are half cycles
+        '''
+        stack = list(self.stack[chan])
+        lo, hi = [], []
+        if not np.isnan(self.cand[chan]) and self.direction[chan] != 0: _push(stack, self.cand[chan], lo, hi)
+        lo, hi = np.array(lo + stack[:-1]), np.array(hi + stack[1:])
+        counts = np.where(np.arange(len(lo)) < len(lo) - max(0, len(stack)-1), 1.0, 0.5)
+        return np.abs(hi - lo), (hi + lo) / 2.0, counts
+
+    def damage(self, residual=False):
+        '''
+        Miner damage sum for each channel (O(1)), residual=True -> including the residual as half cycles
+        '''
+        if not residual: return self.damage_sum.copy()
+        dmg = self.damage_sum.copy()
+        for chan in range(0, self.max_chans):
+            ranges, _, counts = self._residual_cycles(chan)
+            for weight in (0.5, 1.0): dmg[chan] += weight * self._damage(ranges[counts == weight])
+        return dmg
+
+    def histogram(self, residual=False):
+        '''
+        returns (edges_range, edges_mean, counts (chans, bins_range, bins_mean)), residual=True -> including the
+        residual as half cycles
+        '''
+        hist = self.hist
+        if residual:
+            hist = hist.copy()
+            for chan in range(0, self.max_chans):
+                ranges, means, counts = self._residual_cycles(chan)
+                np.add.at(hist[chan], self._bin(ranges, means), counts)
+        return (self.edges_range, self.edges_mean, hist)
+
+    def life(self, residual=False):
+        ''' remaining life factor for each channel: counted history can be repeated 1/D - 1 times (inf if D = 0) '''
+        dmg = self.damage(residual)
+        with np.errstate(divide="ignore"):
+            return 1.0 / dmg - 1.0
+
+def _push(stack, r, lo, hi):
+    '''
+    pushes the reversal r onto the residual stack, closed cycles (four-point criterion) are appended to lo, hi
+    '''
+    stack.append(r)
+    while len(stack) >= 4:
+        a, b, c, d = stack[-4:]
+        inner = abs(b - c)
+        if inner > abs(a - b) or inner > abs(c - d): break
+        lo.append(b)
+        hi.append(c)
+        del stack[-3:-1]
+
+class MeasurementRainflow(RainflowCounter):
+    '''
+    rainflow counting of the rows of a measurement as they arrive (see MeasurementSpectrum for the same pattern)
+    ATTENTION: call process() regularly, rows leaving the measurement window before they are processed are skipped.
+    '''
+    def __init__(self, mdata, range_max, chans=None, zeroed=False, **kwargs):
+        '''
+        mdata .. measurement data (synchronous data), chans .. channel indexes to count (None -> all channels)
+        zeroed .. True -> zero corrected values (only relevant for the mean histogram)
+        kwargs .. see RainflowCounter
+        '''
+        self.mdata = mdata
+        self.chans = None if chans is None else np.asarray(chans, dtype=np.intp)
+        self.zeroed = zeroed
+        super().__init__(mdata.max_chans if chans is None else len(self.chans), range_max, **kwargs)
+
+    def reset(self):
+        super().reset()
+        self.count_next = self.mdata.count #absolute row to count next
+        self.count_lost = 0
+
+    def process(self):
+        ''' counts all rows written since the last call -> returns the number of new closed cycles '''
+        mdata = self.mdata
+        first = mdata.count - mdata.index
+        if self.count_next < first:
+            self.count_lost += first - self.count_next
+            self.count_next = first
+        num = mdata.count - self.count_next
+        if num <= 0: return 0
+        y = mdata.window_y(num, zeroed=self.zeroed)
+        if self.chans is not None: y = y[:, self.chans]
+        self.count_next += num
+        return self.update(y)
+
+def rainflow_ref(x):
+    '''
+    reference (offline, plain python) four-point rainflow counting of a single history -> (ranges, counts), the residual
+    is counted as half cycles
+    '''
+    rev = [x[0]]
+    for v in x[1:]:
+        if v == rev[-1]: continue
+        if len(rev) > 1 and (v - rev[-1]) * (rev[-1] - rev[-2]) > 0: rev[-1] = v #same direction -> extend the run
+        else: rev.append(v)
+    stack, ranges, counts = [], [], []
+    for r in rev:
+        stack.append(r)
+        while len(stack) >= 4 and abs(stack[-3] - stack[-2]) <= min(abs(stack[-4] - stack[-3]), abs(stack[-2] - stack[-1])):
+            ranges.append(abs(stack[-3] - stack[-2])); counts.append(1.0)
+            del stack[-3:-1]
+    for i in range(0, len(stack)-1):
+        ranges.append(abs(stack[i+1] - stack[i])); counts.append(0.5)
+    return np.array(ranges), np.array(counts)
+
+def test_usage_regular():
+    '''
+    textbook history, streaming in blocks equals counting at once, total damage matches the offline reference
+    '''
+    #ASTM E1049 example history, four-point criterion closes (-1, 3) only, the rest is residual (half cycles)
+    hist = np.array([-2.0, 1.0, -3.0, 5.0, -1.0, 3.0, -4.0, 4.0, -2.0])
+    rf = RainflowCounter(1, range_max=10.0, bins_range=10, bins_mean=10, sn_k=1.0, sn_n=1.0)
+    rf.update(np.repeat(hist, 3)[:, np.newaxis]) #repeated values are no reversals
+    assert rf.cycles[0] == 1 and rf.damage()[0] == 4.0
+    assert list(rf.residual(0)) == [-2.0, 1.0, -3.0, 5.0, -4.0, 4.0, -2.0]
+    ranges, counts = rainflow_ref(hist)
+    assert np.isclose(rf.damage(residual=True)[0], np.sum(ranges*counts))
+    assert np.isclose(rf.histogram(residual=True)[2].sum(), counts.sum())
+
+    rng = np.random.default_rng(9)
+    rows = np.cumsum(rng.normal(size=(5000, 2)), axis=0)
+    rows[:, 1] = np.sin(np.arange(5000)/5.0) * 10.0 + rng.normal(scale=0.5, size=5000)
+    rf_all = RainflowCounter(2, range_max=60.0, sn_k=3.0, sn_s=10.0)
+    rf_all.update(rows)
+    rf = RainflowCounter(2, range_max=60.0, sn_k=3.0, sn_s=10.0)
+    for i, n in ((0, 1), (1, 2), (3, 997), (1000, 4000)): rf.update(rows[i:i+n])
+    assert np.array_equal(rf.cycles, rf_all.cycles) and np.allclose(rf.damage(), rf_all.damage())
+    assert np.array_equal(rf.hist, rf_all.hist)
+    for chan in range(0, 2):
+        ranges, counts = rainflow_ref(rows[:, chan])
+        assert np.isclose(rf.damage(residual=True)[chan], np.sum(counts * (ranges/10.0)**3) / DEF_SN_N)
+        assert np.isclose(rf.histogram(residual=True)[2][chan].sum(), counts.sum())
+        assert rf.cycles[chan] + np.sum(rf._residual_cycles(chan)[2] == 1.0) == np.sum(counts == 1.0)
+    assert np.all(rf.life() > rf.life(residual=True))
+
+def test_measurement():
+    '''
+    counting the rows of a measurement, lost rows are reported
+    '''
+    rows = np.sin(np.arange(3000)/3.0)[:, np.newaxis] * np.array([1.0, 2.0, 4.0])
+    mdata = measdata.MeasurementData([0, 1, 2], max_short=1000)
+    rf = MeasurementRainflow(mdata, range_max=10.0, chans=[0, 2])
+    for i in range(0, 2000, 250):
+        mdata.update_block(rows[i:i+250])
+        rf.process()
+    mdata.update_block(rows[2000:])
+    rf.process()
+    ref = RainflowCounter(2, range_max=10.0)
+    ref.update(rows[:, [0, 2]])
+    assert rf.count_lost == 0 and rf.count == 3000 and np.array_equal(rf.cycles, ref.cycles)
+    assert np.allclose(rf.damage()[1] / rf.damage()[0], 4.0**3, rtol=0.01)
+    mdata.update_block(np.vstack((rows, rows)))
+    rf.process()
+    assert rf.count_lost == 5000
+
+def bench_rainflow(max_chans=32, fs=1000.0, seconds=10.0, blocksize=500):
+    '''
+    benchmark: random load histories (worst case, a reversal every few rows) for max_chans channels
+    '''
+    import time
+    num = int(fs*seconds)
+    rows = np.cumsum(np.random.default_rng(3).normal(size=(num, max_chans)), axis=0)
+    rf = RainflowCounter(max_chans, range_max=100.0)
+    t0 = time.perf_counter()
+    for i in range(0, num, blocksize): rf.update(rows[i:i+blocksize])
+    t_spent = time.perf_counter() - t0
+    print("bench rainflow: chans=%i fs=%.0f -> %.3f s for %.1f s data | x%.0f real time | cycles=%i"
+          % (max_chans, fs, t_spent, seconds, seconds/t_spent, rf.cycles.sum()))
+
+if __name__ == '__main__':
+    print("running: meas_rainflow.py")
+    test_usage_regular()
+    test_measurement()
+    bench_rainflow()
+    print("done")
@@ -18,6 +18,7 @@ from dataclasses import dataclass
 
 import dbg
 import meas_channel as channel
+import meas_calib
 import appdef
 
    
@@ -55,6 +56,53 @@ class DEF_STATES(enum.Enum):
     CHARGE = 4 #charging mode
     CALIB = 5 #calibration mode
 
+class SensorRing():
+    '''
+    ring for the measurement data arrays (newest first) -> rows are written in place, nothing is rolled
+        - sample k (0, 1, ..) of a sensor is stored in row rows-1 - k % rows (decreasing), newest first ranges are
+          produced by index arithmetic
+        - mirror .. rows are written twice (array with 2*rows rows) -> every newest first range is a view
+        - the ring (head) is shared by all sensors of a measurement system (count .. samples of the sensor ahead),
+          each sensor keeps its own sample count
+    '''
+    def __init__(self, rows, mirror=False):
+        self.rows = int(rows)
+        self.mirror = bool(mirror)
+        self.count = 0 #head: number of samples written (sensor ahead)
+    
+    def pos(self, count):
+        ''' physical row of the newest sample after count samples (count=0 -> row 0, the initialization data) '''
+        return self.rows - 1 - (count - 1) % self.rows
+    
+    def put(self, ary, count, cols, vals):
+        ''' writes the newest sample (after count samples) of the columns cols '''
+        p = self.pos(count)
+        ary[p, cols] = vals
+        if self.mirror: ary[p + self.rows, cols] = vals
+        if count > self.count: self.count = count
+        return p
+    
+    def put_block(self, ary, count, cols, rows):
+        ''' writes a block of samples rows (oldest first) of the columns cols, the newest is sample count '''
+        num = min(len(rows), self.rows)
+        block = rows[:-num-1:-1] #newest first, only the last rows samples are kept
+        p = self.pos(count)
+        n0 = min(num, self.rows - p)
+        ary[p:p+n0, cols] = block[:n0]
+        ary[0:num-n0, cols] = block[n0:]
+        if self.mirror:
+            ary[p+self.rows:p+self.rows+n0, cols] = block[:n0]
+            ary[self.rows:self.rows+num-n0, cols] = block[n0:]
+        if count > self.count: self.count = count
+        return p
+    
+    def view(self, ary, count, cols, num=None):
+        ''' newest first rows (num, None -> all) of the columns cols after count samples -> a view (if not wrapped) '''
+        num = self.rows if num is None else min(int(num), self.rows)
+        p = self.pos(count)
+        if self.mirror or p + num <= self.rows: return ary[p:p+num, cols]
+        return numpy.concatenate((ary[p:self.rows, cols], ary[0:num-(self.rows-p), cols]))
+
 class SensorXKM():
     ''' 
         PRODAT XKM general (default) sensor definition - handles types PRODAT RKM und BKM 
@@ -100,6 +148,7 @@ class SensorXKM():
         addr_node .. sensor node address in the measurement system (default is None), user handles the type, i.e. string or int
         addr_group .. sensor node group address
         calib .. calibration method/functionality used (default is None), if default standard calibration is used
+                 (appdef.DEF_CALIBRATION or a meas_calib.Calibration -> characteristic curves, vectorized)
         cfg_rx_onlyunique .. only accept unique messages for reception (means discard duplicates)
         '''
         # important working variables
@@ -148,6 +197,10 @@ class SensorXKM():
         self.mdata = mdata # this is obsolet?
         self._marry_in = None  #@handle, set later on -> we operate on big measurement data array // always have independent data structures
         self._marry_out = None #@handle, set later on -> we operate on big measurement data array // always have independent data structures
+        self._mring = None #ring of the measurement data arrays (shared by the sensors of a system), see SensorRing
+        self._mcols_in = slice(0, 0) #columns of the input/output channels (slice -> views)
+        self._mcols_out = slice(0, 0)
+        self.md_count = 0 #number of samples written
         
         #zeroing data -> is an numpy array to much overhead?
         self.zero_in  = [] #holds the current zero values (raw values)
@@ -262,18 +315,18 @@ class SensorXKM():
         
         returns: zero values for (output, input)
         '''
-        if zeroval_in==None:
-            self.zero_in[0,:] = self._marry_in[0, self.chans_in_index]  #this is easy, we simply save the values
+        if zeroval_in is None:
+            self.zero_in[0,:] = self.md_current_in()  #this is easy, we simply save the values
         else:
             self.zero_in[0,:] = zeroval_in
         
-        if zeroval_out==None: 
+        if zeroval_out is None: 
             self.zero_out[0,:] = self.calc_calibrate()
         else:
             self.zero_out[0,:] = zeroval_out
         
         #recalculate the first shown value
-        self._marry_out[0,self.chans_out_index] = self.calc_zero()
+        self._mring.put(self._marry_out, self.md_count, self._mcols_out, self.calc_zero())
         
         return (self.zero_out,self.zero_in)
     
@@ -283,12 +336,16 @@ class SensorXKM():
         '''
         return (self.zero_out,self.zero_in)
     
-    def calc_zero(self):
+    def calc_zero(self, vals=None):
         '''
         calculate zerod output value a single time for the current values (top most entries)
         please note: zeroing calculation is done for output value only.
+        vals .. block of input values (N, chans_in) -> zeroed output values (N, chans_out)
         '''
-        return self.calc_calibrate() - self.zero_out[0,:]
+        if vals is None: return self.calc_calibrate() - self.zero_out[0,:]
+        ret = numpy.asarray(self.calc_calibrate(vals))
+        if ret.ndim == 1: ret = ret[:, numpy.newaxis] #one output value per row
+        return ret - self.zero_out[0,:]
         
     def calc_pre(self):
         '''
@@ -304,29 +361,32 @@ class SensorXKM():
         '''
         if DBG_OUT: print("calc_post()")
     
-    def calc_calibrate(self):
+    def calc_calibrate(self, vals=None):
         '''
         processing: do calculations -> calculate outputs in dependence of inputs 
         @note: we don't know what data changed -> so we don't how much we need to update
 
         #we are taking input channel state and process the output channel state
         #we assume we will only have to process the first line
-
+        vals .. block of input values (N, chans_in) to calibrate at once, None -> newest input values
         '''        
         if DBG_OUT: print("calc_calib()")
+        if vals is None: vals = self.md_current_in()
         match self.calib:
             case appdef.DEF_CALIBRATION.TEST_1_FAKT:
                 #print("DBG!!! CALI VIA DEF_CALIBRATION.TEST_1_FAKT")
                 #a test on a per channel basis we summation and afterwards adding
                 #we have to roll, and afterwards we will have to calibrate the newest
-                ret = numpy.sum(self._marry_in[0, self.chans_in_index]*10.0, axis=0)
+                ret = numpy.sum(vals*10.0, axis=-1)
                 return ret
             case appdef.DEF_CALIBRATION.TEST_2_SUM:
                 #print("DBG!!! CALI VIA DEF_CALIBRATION.TEST_2_SUM")
-                ret = numpy.sum(self._marry_in[0, self.chans_in_index], axis=0)
+                ret = numpy.sum(vals, axis=-1)
                 return ret
+            case meas_calib.Calibration():
+                return self.calib(vals)
             case None:
-                ret = numpy.sum(self._marry_in[0, self.chans_in_index], axis=0)
+                ret = numpy.sum(vals, axis=-1)
                 return ret
             
     def rx_last(self):
@@ -357,18 +417,21 @@ class SensorXKM():
     # measurement data (md_) handling -> we work on a big numpy array   #
     #    -> initialization means, adding a new array column & arry copy #
     #####################################################################
-    def md_register(self, ary_in=None, ary_out=None):
+    def md_register(self, ary_in=None, ary_out=None, ring=None):
         '''
         register measurement object handle (numpy array) for the sensor abstraction to operate on,
         do this for:
             * input channel data (raw data)
             * output channel data (measured and processed data)
+        ring .. ring shared with other sensors (see SensorRing), None -> own ring over all rows of the arrays
         '''
         if ary_in is None: raise TypeError("we need a numpy array structure")
         if ary_out is None: raise TypeError("we need a numpy array structure")         
         
         self._marry_in = ary_in
         self._marry_out = ary_out
+        self._mring = SensorRing(numpy.size(ary_in, 0)) if ring is None else ring
+        self.md_count = 0
          
     def md_info(self):
         '''
@@ -381,57 +444,63 @@ class SensorXKM():
             "input":self.chans_in_index,
             "output":self.chans_out_index,
             "ary-obj-in":self._marry_in,
-            "ary-obj-out": self._marry_out
+            "ary-obj-out": self._marry_out,
+            "ring": self._mring
         }
         
+    def md_layout(self, col_in=0, col_out=0):
+        '''
+        assigns the columns of the input and output array to the sensor channels (consecutive, starting with col_in
+        and col_out) and creates the zero arrays -> nothing is allocated for the measurement data
+        
+        returns: next free input column, next free output column
+        '''
+        self.chans_in_index = list(range(col_in, col_in + len(self.chans_in)))
+        self.chans_out_index = list(range(col_out, col_out + len(self.chans_out)))
+        self._mcols_in = slice(col_in, col_in + len(self.chans_in))
+        self._mcols_out = slice(col_out, col_out + len(self.chans_out))
+        self.zero_in  = numpy.zeros( shape=[1, len(self.chans_in)] )
+        self.zero_out = numpy.zeros( shape=[1, len(self.chans_out)] )
+        if DBG_OUT: print("sensor: layout IN=%s OUT=%s" % (self.chans_in_index, self.chans_out_index))
+        return (col_in + len(self.chans_in), col_out + len(self.chans_out))
+        
+    def md_initval(self):
+        ''' initialization value of the measurement data columns of this sensor '''
+        if dbg.DBG_MEASYS_MDATAINIT_WITH_NODEADDR:
+            try:
+                return float(self.addr_node*10.0)
+            except TypeError:
+                return 0.0
+        return 0.0
+        
     def md_init(self, ary_in, ary_out, axis_datagrow=0, axis_changrow=1):
         '''
         ary .. numpy array to operate on, with this sensor abstraction (it must have enough space for all sensor channels)
-        sel_out .. table selection (array dimenstion) for output data
-        sel_in .. table selection (array dimension) for input data
         axis .. the axis to operate on (the direction to extend the array in)
         @attention: currently not threadsafe (but numpy might be??) -> user must handle everything
+        @note: each call copies the arrays, use MeasurementSystemXKM.md_layout_plan() for a complete system
         
-        returns: expanded input array, expanded output array, zero array
+        returns: expanded input array, expanded output array
         '''
         if DBG_OUT: print("sensor: mdata initialization")
-        if self._marry_in != None: raise AssertionError("to implement, not allow for array to grow indefinitly")
-        if self._marry_out != None: raise AssertionError("to implement, not allow for array to grow indefinitly")
-        
-        self._marry_in = ary_in #create a handle for the measurement data object (array)
-        self._marry_out = ary_out #create a handle for the measurement data object (array)
+        if self._marry_in is not None: raise AssertionError("to implement, not allow for array to grow indefinitly")
+        if self._marry_out is not None: raise AssertionError("to implement, not allow for array to grow indefinitly")
         
-        #we will grow the array automatically for our input and output channels
         #@TODO: we assume always the same max. size for the input and for the output array
-        ylen = numpy.size(self._marry_in, axis_datagrow)
-        ylenb = numpy.size(self._marry_out, axis_datagrow)
+        ylen = numpy.size(ary_in, axis_datagrow)
+        ylenb = numpy.size(ary_out, axis_datagrow)
         if ylen != ylenb: raise TypeError("we currently support only arrays with the same length for input and output data")
-        initdata = numpy.zeros( shape=[ylen,1] )
-        
-        self.zero_in  = numpy.zeros( shape=[1, len(self.chans_in)] )
-        self.zero_out = numpy.zeros( shape=[1, len(self.chans_out)] )
-        
         if dbg.DBG_MEASYS_MDATAINIT_WITH_NODEADDR:
             print("DBG: DBG_MEASYS_MDATAINIT_WITH_NODEADDR ACTIVE -> different array init values")
-            for i,val in enumerate(initdata):
-                initdata[i] = float(self.addr_node*10.0)
         
-        #we need to enter data for each array
-        self.chans_in_index = []
-        for i,chan in enumerate(self.chans_in):
-            self._marry_in = numpy.append(self._marry_in, initdata, axis=axis_changrow)
-            index = numpy.ma.size(self._marry_in, axis=axis_changrow)
-            self.chans_in_index.append(index-1)
-            if DBG_OUT: print("CHAN:%i with selection index %i" % (i, self.chans_in_index[i]) )
-
-        #we need to enter data for each array
-        self.chans_out_index = []
-        for i,chan in enumerate(self.chans_out):
-            self._marry_out = numpy.append(self._marry_out, initdata, axis=axis_changrow)
-            index = numpy.ma.size(self._marry_out, axis=axis_changrow)
-            self.chans_out_index.append(index-1)
-            if DBG_OUT: print("CHAN:%i with selection index %i" % (i, self.chans_out_index[i]) )
-                
+        #all channels of the sensor are appended at once (one copy per array)
+        self.md_layout(numpy.size(ary_in, axis_changrow), numpy.size(ary_out, axis_changrow))
+        shape_in, shape_out = list(numpy.shape(ary_in)), list(numpy.shape(ary_out))
+        shape_in[axis_changrow], shape_out[axis_changrow] = len(self.chans_in), len(self.chans_out)
+        self._marry_in = numpy.append(ary_in, numpy.full(shape_in, self.md_initval()), axis=axis_changrow)
+        self._marry_out = numpy.append(ary_out, numpy.full(shape_out, self.md_initval()), axis=axis_changrow)
+        self._mring = SensorRing(ylen)
+        self.md_count = 0
         return (self._marry_in, self._marry_out) #we return upated sensor information
         
     def md_clear(self, clearval=0.0, clear_in=True, clear_out=True):
@@ -451,43 +520,57 @@ class SensorXKM():
     def md_update_block(self, vals, do_calib=True, do_calc=True):
         '''
         we will update a number of measurement input values (a block)
-        '''
+            vals .. (N, chans_in) input values, oldest first (i.e., the samples of a multi sample packet)
+            the block is written in one operation, calibration and zeroing are done for the whole block at once,
+            calc_pre()/calc_post() are executed once for the block
+            do_calib .. calibrate and zero the block into the output rows, False -> no calibration, the output rows
+                        hold the newest output value (the rows are written anyway, readers never see stale rows)
+        '''
+        vals = numpy.asarray(vals, dtype=numpy.float64).reshape(-1, len(self.chans_in_index))
+        if len(vals) == 0: return
+        if DBG_OUT: print("md_update_block: mary_in: %i rows" % len(vals))
+        
+        if do_calib != True: held = self.md_current_out().copy() #newest output before the block
+        self.md_count += len(vals)
+        self._mring.put_block(self._marry_in, self.md_count, self._mcols_in, vals)
+        if do_calc == True: 
+            self.calc_pre()
+        
+        #calibration routine and zeroing -> written to the newest output rows
+        vals = vals[-self._mring.rows:]
+        out = self.calc_zero(vals) if do_calib == True else held
+        out = numpy.broadcast_to(out, (len(vals), len(self.chans_out_index)))
+        self._mring.put_block(self._marry_out, self.md_count, self._mcols_out, out)
+        
+        if do_calc == True:
+            self.calc_post()
+        
                       
     def md_update(self, vals, do_calib=True, do_calc=True):
         '''
             update measurement values -> new data is added to measurement input channel data. 
-             - we are using a sliding window by default, old data is removed
-             - oldest data moves to the end
+             - we are using a ring (see SensorRing), the newest row is written in place, old data is overwritten
+             - views returned by md_current(), md_in(), md_out() are ordered:
              - INDEX 0 .. NEWEST DATA
              - 
              - INDEX N .. OLDEST DATA
             
-            @param do_calib .. execute calibration routines to update output data from input data (means calibration)
+            @param do_calib .. execute calibration routines to update output data from input data (means calibration),
+                               False -> no calibration, the output row holds the newest output value
             @param do_calc .. execute additional calculations, any processing functionality if required
         '''
         if DBG_OUT: print("md_update: mary_in: " + str(vals))
         
-        #problem is -> we can not create a copy of the original array, we can only roll a copied section from memory
-        #slowest possible update approach (copy over by value)
-        aslice = self._marry_in[:,  self.chans_in_index]
-        rolled = numpy.roll(aslice, shift=1, axis=0) #select axis for rolling (=shifting)
-        rolled[0,:] = vals[0:len(self.chans_in_index)] #will it update a whole line
-        self._marry_in[: , self.chans_in_index] = rolled
+        if do_calib != True: held = self.md_current_out().copy() #newest output before the update
+        self.md_count += 1
+        self._mring.put(self._marry_in, self.md_count, self._mcols_in, vals[0:len(self.chans_in_index)])
         #additional processing
         if do_calc == True: 
             self.calc_pre()
         
-        #calibration routine
-        #print(self._marry_out)
-        if do_calib == True: 
-            ret = self.calc_calibrate()
-            aslice = self._marry_out[:, self.chans_out_index]
-            rolled = numpy.roll(aslice,shift=1,axis=0) #select axis for rolling (=shifting)
-            rolled[0,:] = ret
-            self._marry_out[:, self.chans_out_index] = rolled            
-        
-        #zeroing is always done
-        self._marry_out[0 , self.chans_out_index] = self.calc_zero()
+        #calibration routine and zeroing -> written to the newest output row
+        out = self.calc_zero() if do_calib == True else held
+        self._mring.put(self._marry_out, self.md_count, self._mcols_out, out)
         
         if do_calc == True:
             self.calc_post()
@@ -505,16 +588,8 @@ class SensorXKM():
         retin = None
         retout = None
         
-        if self._marry_out is not None:
-            if num is None:
-                retout = self._marry_out[0, self.chans_out_index]
-            else:
-                retout = self._marry_out[0:num, self.chans_out_index]
-        if self._marry_in is not None:
-            if num is None:
-                retin = self._marry_in[0, self.chans_in_index]
-            else:
-                retin = self._marry_in[0:num, self.chans_in_index]
+        if self._marry_out is not None: retout = self.md_current_out(num)
+        if self._marry_in is not None: retin = self.md_current_in(num)
         
         #return (self._marry_out[0:num, self.chans_out_index], self._marry_in[0:num, self.chans_in_index]) #return the newest value
         return (retout, retin)
@@ -524,30 +599,30 @@ class SensorXKM():
         returns the current (newest) input values (the raw uncalibrated input data) 
         '''
         if num is None:
-            return self._marry_in[0, self.chans_in_index] #return the newest value
+            return self._marry_in[self._mring.pos(self.md_count), self._mcols_in] #return the newest value
         else:
-            return self._marry_in[0:num, self.chans_in_index]
+            return self._mring.view(self._marry_in, self.md_count, self._mcols_in, num)
     
     def md_current_out(self, num=None):
         '''
         returns the current (newest) output values (the raw calibrated output data)
         '''
         if num is None:
-            return self._marry_out[0, self.chans_out_index] #return the newest value
+            return self._marry_out[self._mring.pos(self.md_count), self._mcols_out] #return the newest value
         else:
-            return self._marry_out[0:num, self.chans_out_index]
+            return self._mring.view(self._marry_out, self.md_count, self._mcols_out, num)
         
     def md_in(self):
         '''
         returns all input measurement channel data (this object takes care of)
         '''
-        return self._marry_in[:, self.chans_in_index] #return the newest value
+        return self._mring.view(self._marry_in, self.md_count, self._mcols_in) #newest first
     
     def md_out(self):
         '''
         returns all output measurement channels data (this object takes care of)
         '''
-        return self._marry_out[:, self.chans_out_index] #return the newest value
+        return self._mring.view(self._marry_out, self.md_count, self._mcols_out) #newest first
         
     def channels(self):
         '''
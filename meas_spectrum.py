@@ -0,0 +1,206 @@
+'''
+meas_spectrum.py .. streaming spectral analysis (Welch PSD) for measurement channels, i.e., vibration monitoring
+
+The engine consumes the rows of a MeasurementData object as they arrive. Rows are cut into overlapping segments of
+nfft rows (hop = nfft*(1-overlap)), each segment is detrended (mean), windowed and transformed with a single batched
+numpy rfft call for all complete segments and all channels (no loop over channels or segments):
+
+    frames (segments, channels, nfft) -> rfft(axis=-1) -> |X|^2 -> running Welch average (channels, nfft//2+1)
+
+The running average (or an exponential average) and the spectrum of the newest segment are kept, so the GUI reads the
+latest spectrum in O(1) without recomputing over the history.
+ATTENTION: call process() regularly, rows leaving the measurement window before they are processed are skipped.
+'''
+#3rd party
+import numpy as np
+import pytest
+
+#project specific
+try:
+    from libxkm import measdata
+except ModuleNotFoundError:
+    import measdata
+
+DBG_OUT = False #enable/disable debugging output
+
+DEF_NFFT = 1024 #segment length (rows)
+DEF_OVERLAP = 0.5 #segment overlap (0.5 = 50 %, typical for a hann window)
+
+def window_get(name, nfft):
+    ''' returns the window function (nfft,) -> "hann", "hamming", "blackman" or "rect" '''
+    if name == "hann": return np.hanning(nfft + 1)[:-1] #periodic window
+    if name == "hamming": return np.hamming(nfft + 1)[:-1]
+    if name == "blackman": return np.blackman(nfft + 1)[:-1]
+    if name == "rect": return np.ones(shape=(nfft,))
+    raise ValueError(f"unknown window: {name}")
+
+class MeasurementSpectrum():
+    '''
+    running Welch power spectral density for all (or selected) channels of a measurement
+    '''
+    def __init__(self, mdata, nfft=DEF_NFFT, overlap=DEF_OVERLAP, window="hann", fs=None, chans=None, alpha=None,
+                 zeroed=False):
+        '''
+        mdata .. measurement data (synchronous data)
+        nfft .. segment length, overlap .. segment overlap [0, 1)
+        fs .. sample rate (Hz), None -> estimated from the timestamps of the first processed rows
+        chans .. channel indexes to analyze, None -> all channels
+        alpha .. None -> linear average of all segments since reset(), otherwise exponential average (weight of the
+                 newest segment, i.e., 0.1)
+        zeroed .. True -> zero corrected values (only relevant for the DC bin)
+        '''
+        if nfft > mdata.max_y_short: raise ValueError(f"nfft={nfft} exceeds the measurement window ({mdata.max_y_short})")
+        self.mdata = mdata
+        self.nfft = int(nfft)
+        self.hop = max(1, int(round(self.nfft * (1.0 - overlap))))
+        self.win = window_get(window, self.nfft)
+        self.chans = None if chans is None else np.asarray(chans, dtype=np.intp)
+        self.max_chans = mdata.max_chans if chans is None else len(self.chans)
+        self.alpha = alpha
+        self.zeroed = zeroed
+        self.fs = fs
+        self.reset()
+
+    def reset(self):
+        ''' clears the averages, the next segment starts with the next row written '''
+        self.seg_next = self.mdata.count #absolute row of the next segment start
+        self.num = 0 #number of averaged segments
+        self.count_lost = 0 #rows skipped, because process() was called too late
+        self.psd_avg = np.zeros(shape=(self.max_chans, self.nfft//2 + 1), dtype=np.float64)
+        self.psd_last = np.zeros(shape=(self.max_chans, self.nfft//2 + 1), dtype=np.float64)
+        self.ts_last = None #timestamp of the first row of the newest segment
+
+    @property
+    def freqs(self):
+        ''' frequencies of the PSD bins (Hz), None as long as the sample rate is unknown '''
+        if self.fs is None: return None
+        return np.fft.rfftfreq(self.nfft, 1.0/self.fs)
+
+    def _scale(self):
+        ''' density scaling of |X|^2 for a one-sided PSD (units^2/Hz) '''
+        scale = np.full(shape=(self.nfft//2 + 1,), fill_value=2.0 / (self.fs * np.sum(self.win*self.win)))
+        scale[0] /= 2.0
+        if self.nfft % 2 == 0: scale[-1] /= 2.0
+        return scale
+
+    def process(self):
+        '''
+        transforms all complete segments written since the last call -> returns the number of new segments
+        '''
+        mdata = self.mdata
+        first = mdata.count - mdata.index #oldest row in the window
+        if self.seg_next < first: #rows are overwritten already -> continue with the oldest available segment
+            skip = -(-(first - self.seg_next) // self.hop) * self.hop
+            self.count_lost += skip
+            self.seg_next += skip
+        num = (mdata.count - self.seg_next - self.nfft) // self.hop + 1 #complete segments
+        if num <= 0: return 0
+
+        rows = (num - 1)*self.hop + self.nfft
+        ts = mdata.window_ts(mdata.count - self.seg_next)[:rows]
+        if self.fs is None:
+            period = np.median(np.diff(ts))
+            if period <= 0: #i.e., blocks written without timestamps (all rows of a block share the arrival time)
+                raise ValueError("sample rate can not be estimated from the timestamps, specify fs")
+            self.fs = measdata.DEF_NS_PER_S / period
+        y = mdata.window_y(mdata.count - self.seg_next, zeroed=self.zeroed)[:rows]
+        if self.chans is not None: y = y[:, self.chans]
+
+        #frames (segments, channels, nfft) as strided view, one batched rfft for everything
+        frames = np.lib.stride_tricks.sliding_window_view(y, self.nfft, axis=0)[::self.hop]
+        frames = frames - frames.mean(axis=-1, keepdims=True)
+        spec = np.fft.rfft(frames * self.win, axis=-1)
+        psd = (spec.real*spec.real + spec.imag*spec.imag) * self._scale() #(segments, channels, bins)
+
+        if self.alpha is None:
+            self.psd_avg += (psd.sum(axis=0) - num*self.psd_avg) / (self.num + num)
+        else:
+            for k in range(0, num): #exponential average, segments in order
+                self.psd_avg += self.alpha * (psd[k] - self.psd_avg) if self.num + k > 0 else psd[k] - self.psd_avg
+        self.psd_last[:] = psd[-1]
+        self.ts_last = int(ts[(num-1)*self.hop])
+        self.num += num
+        self.seg_next += num*self.hop
+        if DBG_OUT: print(f"SPECTRUM: +{num} segments -> {self.num}")
+        return num
+
+    def psd(self, last=False):
+        '''
+        returns (freqs, psd) -> psd (channels, nfft//2+1) in units^2/Hz, averaged (default) or of the newest segment
+        '''
+        return (self.freqs, self.psd_last if last else self.psd_avg)
+
+    def peak(self, last=False):
+        ''' frequency of the highest PSD bin (without DC) for each channel, None as long as no segment is processed '''
+        if self.num == 0: return None #sample rate and spectrum are unknown yet
+        freqs, psd = self.psd(last)
+        return freqs[1 + np.argmax(psd[:, 1:], axis=1)]
+
+def test_usage_regular():
+    '''
+    sine tone and noise: peak frequency, Parseval (PSD integrates to the variance) and chunked processing
+    '''
+    fs = 1000.0
+    num = 8192
+    rng = np.random.default_rng(5)
+    t = np.arange(num) / fs
+    rows = np.stack((np.sin(2*np.pi*125.0*t) * 2.0, rng.normal(scale=3.0, size=num), np.full(num, 5.0)), axis=1)
+    mdata = measdata.MeasurementData([0, 1, 2], max_short=2048)
+    spec = MeasurementSpectrum(mdata, nfft=256, overlap=0.5)
+    segments = 0
+    for i in range(0, num, 700):
+        mdata.update_block(rows[i:i+700], t[i:i+700])
+        segments += spec.process()
+    assert segments == spec.num == (num - 256) // 128 + 1 and spec.count_lost == 0
+    assert np.isclose(spec.fs, fs)
+    freqs, psd = spec.psd()
+    assert spec.peak()[0] == 125.0
+    df = freqs[1] - freqs[0]
+    assert np.isclose(psd[0].sum()*df, 2.0, rtol=0.05) #sine amplitude 2 -> variance 2
+    assert np.isclose(psd[1].sum()*df, 9.0, rtol=0.1)
+    assert np.allclose(psd[2], 0.0) #constant -> removed by detrending
+
+    #selected channels, exponential average, lost rows
+    mdata.init_data()
+    spec = MeasurementSpectrum(mdata, nfft=256, overlap=0.75, chans=[0], alpha=0.2, fs=fs)
+    mdata.update_block(rows[:4096], t[:4096]) #larger than the window
+    assert spec.process() == (2048 - 256) // 64 + 1 and spec.count_lost == 2048
+    assert spec.psd()[1].shape == (1, 129) and spec.peak(last=True)[0] == 125.0
+    with pytest.raises(ValueError):
+        MeasurementSpectrum(mdata, nfft=4096)
+
+    #blocks without timestamps -> the sample rate must be specified
+    mdata.init_data()
+    spec = MeasurementSpectrum(mdata, nfft=256)
+    assert spec.peak() is None and spec.freqs is None #nothing processed yet
+    mdata.update_block(rows[:1000])
+    with pytest.raises(ValueError):
+        spec.process()
+    spec = MeasurementSpectrum(mdata, nfft=256, fs=fs)
+    assert spec.peak() is None and spec.process() == 0 and spec.peak() is None #fs known, no segment yet
+    mdata.update_block(rows[1000:2000])
+    assert spec.process() > 0 and spec.peak()[0] == 125.0
+
+def bench_spectrum(max_chans=32, fs=10000.0, seconds=5.0, nfft=1024, blocksize=500):
+    '''
+    benchmark: real time factor for max_chans channels at fs (BKM channels at full rate)
+    '''
+    import time
+    num = int(fs*seconds)
+    rows = np.random.default_rng(6).normal(size=(num, max_chans)).astype(np.float32)
+    mdata = measdata.MeasurementData([x for x in range(0,max_chans)], max_short=8*nfft)
+    spec = MeasurementSpectrum(mdata, nfft=nfft, fs=fs)
+    t_spent = 0.0
+    for i in range(0, num, blocksize):
+        mdata.update_block(rows[i:i+blocksize], np.arange(i, i+blocksize)/fs)
+        t0 = time.perf_counter()
+        spec.process()
+        t_spent += time.perf_counter() - t0
+    print("bench spectrum: chans=%i fs=%.0f nfft=%i -> %.3f s for %.1f s data | x%.0f real time"
+          % (max_chans, fs, nfft, t_spent, seconds, seconds/t_spent))
+
+if __name__ == '__main__':
+    print("running: meas_spectrum.py")
+    test_usage_regular()
+    bench_spectrum()
+    print("done")
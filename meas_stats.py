@@ -0,0 +1,148 @@
+'''
+meas_stats.py .. running (incremental) statistics for measurement channels
+
+Statistics are updated with blocks of rows (N, max_chans), the block is reduced vectorized and merged into the running
+values (parallel variant of Welford's algorithm, numerically stable) -> O(channels) per row and O(1) per query:
+    n, mean, var/std (population, ddof selectable), min, max, rms and peak-to-peak (p2p) for each channel
+
+MeasurementData keeps a session statistic (since init_data()) and a statistic since the last zeroing, see
+MeasurementData.stats().
+'''
+#3rd party
+import numpy as np
+import pytest
+
+DBG_OUT = False #enable/disable debugging output
+
+class RunningStats():
+    '''
+    running statistics for all channels (accumulators are float64, independent of the data type of the measurement)
+    '''
+    def __init__(self, max_chans):
+        self.max_chans = int(max_chans)
+        self.reset()
+
+    def reset(self):
+        ''' clears all statistics (i.e., after zeroing) '''
+        self.n = 0 #number of rows
+        self.mean = np.zeros(shape=(self.max_chans,), dtype=np.float64)
+        self.m2 = np.zeros(shape=(self.max_chans,), dtype=np.float64) #sum of squared differences to the mean
+        self.min = np.full(shape=(self.max_chans,), fill_value=np.nan, dtype=np.float64)
+        self.max = np.full(shape=(self.max_chans,), fill_value=np.nan, dtype=np.float64)
+
+    def update(self, rows):
+        '''
+        adds rows (N, max_chans) or a single row (max_chans,) to the statistics
+        '''
+        return self.merge(block_reduce(rows))
+
+    def merge(self, block):
+        '''
+        merges a reduced block (see block_reduce()) into the statistics -> a block can be merged into several statistics
+        '''
+        num, mean_b, m2_b, mn_b, mx_b = block
+        if num == 0: return self.n
+        n = self.n + num
+        delta = mean_b - self.mean
+        self.mean += delta * (num / n)
+        self.m2 += m2_b + delta*delta * (self.n * num / n)
+        np.fmin(self.min, mn_b, out=self.min)
+        np.fmax(self.max, mx_b, out=self.max)
+        self.n = n
+        return self.n
+
+    def var(self, ddof=0):
+        ''' variance for each channel (ddof=1 -> sample variance), nan if not enough rows '''
+        if self.n <= ddof: return np.full(shape=(self.max_chans,), fill_value=np.nan)
+        return self.m2 / (self.n - ddof)
+
+    def std(self, ddof=0):
+        ''' standard deviation for each channel '''
+        return np.sqrt(self.var(ddof))
+
+    def rms(self):
+        ''' root mean square for each channel '''
+        if self.n == 0: return np.full(shape=(self.max_chans,), fill_value=np.nan)
+        return np.sqrt(self.mean*self.mean + self.m2 / self.n)
+
+    def p2p(self):
+        ''' peak-to-peak value for each channel '''
+        return self.max - self.min
+
+    def result(self):
+        ''' all statistics as dictionary (i.e., for reports) '''
+        return {
+            'n':    self.n,
+            'mean': self.mean.copy(),
+            'std':  self.std(),
+            'min':  self.min.copy(),
+            'max':  self.max.copy(),
+            'rms':  self.rms(),
+            'p2p':  self.p2p(),
+        }
+
+    def shifted(self, offset):
+        '''
+        returns a copy of the statistics for values shifted by offset (scalar or one value for each channel), i.e., for 
+        zero corrected values -> mean/min/max/rms follow the shift, var/std stay the same
+        '''
+        stats = RunningStats(self.max_chans)
+        stats.n = self.n
+        stats.mean = self.mean + offset
+        stats.m2 = self.m2.copy()
+        stats.min = self.min + offset
+        stats.max = self.max + offset
+        return stats
+
+    def __str__(self):
+        return f"STATS N={self.n} | MEAN={self.mean} | STD={self.std()} | MIN={self.min} | MAX={self.max}"
+
+def block_reduce(rows):
+    '''
+    reduces rows (N, max_chans) or a single row to (num, mean, m2, min, max) for RunningStats.merge()
+    '''
+    rows = np.asarray(rows, dtype=np.float64)
+    if rows.ndim == 1: rows = rows[np.newaxis]
+    if rows.shape[0] == 0: return (0, None, None, None, None)
+    mean_b = rows.mean(axis=0)
+    diff = rows - mean_b
+    return (rows.shape[0], mean_b, np.einsum("ij,ij->j", diff, diff), 
+            np.fmin.reduce(rows, axis=0), np.fmax.reduce(rows, axis=0))
+
+def stats_from(rows, max_chans=None):
+    '''
+    returns the statistics of the given rows (N, max_chans) as RunningStats object
+    '''
+    rows = np.asarray(rows)
+    stats = RunningStats(rows.shape[-1] if max_chans is None else max_chans)
+    stats.update(rows)
+    return stats
+
+def test_usage_regular():
+    '''
+    block-wise and row-wise updates must match a direct calculation
+    '''
+    max_chans = 3
+    rows = np.random.default_rng(2).normal(loc=1000.0, scale=2.0, size=(2000, max_chans)).astype(np.float32)
+    stats = RunningStats(max_chans)
+    i = 0
+    for num in [1, 1, 7, 64, 500, 1, 1426]:
+        stats.update(rows[i:i+num] if num > 1 else rows[i])
+        i += num
+    assert i == 2000 and stats.n == 2000
+    ref = rows.astype(np.float64)
+    assert np.allclose(stats.mean, ref.mean(axis=0))
+    assert np.allclose(stats.var(), ref.var(axis=0))
+    assert np.allclose(stats.std(ddof=1), ref.std(axis=0, ddof=1))
+    assert np.allclose(stats.rms(), np.sqrt((ref*ref).mean(axis=0)))
+    assert np.array_equal(stats.min, ref.min(axis=0)) and np.array_equal(stats.p2p(), np.ptp(ref, axis=0))
+    assert np.allclose(stats_from(rows).result()['std'], stats.std())
+    shifted = stats.shifted(-ref.mean(axis=0))
+    assert np.allclose(shifted.mean, 0.0) and np.allclose(shifted.rms(), ref.std(axis=0))
+    stats.reset()
+    assert stats.n == 0 and np.all(np.isnan(stats.rms()))
+
+if __name__ == '__main__':
+    print("running: meas_stats.py")
+    test_usage_regular()
+    print("done")
@@ -0,0 +1,413 @@
+'''
+meas_trigger.py .. trigger engine for the oscilloscope (edge, level, window and slope triggers)
+
+A trigger watches a single channel of a MeasurementData object. process() scans all rows written since the last call
+vectorized (one comparison over the new rows, not a loop over samples) and captures a pre-/post-trigger window around
+each trigger event from the ring buffer -> only the capture window is copied, never the whole history.
+
+    pre rows | trigger row | post rows   (capture, available as soon as the post rows are written)
+
+MeasurementSegments (segmented/sequence acquisition) uses the same event detection, but writes each event into a
+preallocated segment array (segments, samples, max_chans) -> no python object per event, vectorized batch analysis.
+
+Modes:
+    NORMAL .. capture on trigger events only
+    AUTO   .. as NORMAL, but a capture of the newest rows is forced, if there is no trigger for auto_timeout seconds
+    SINGLE .. capture the first trigger event only, arm() again for the next capture
+
+ATTENTION: captures are taken from the ring -> pre + post + rows per process() call must fit into max_y_short, call
+process() regularly (i.e., after each update_block() or with the GUI refresh).
+'''
+#python standard
+from enum import Enum
+from dataclasses import dataclass
+#3rd party
+import numpy as np
+import pytest
+
+#project specific
+try:
+    from libxkm import measdata
+except ModuleNotFoundError:
+    import measdata
+
+DBG_OUT = False #enable/disable debugging output
+
+DEF_PRE = 100 #default number of pre-trigger rows
+DEF_POST = 400 #default number of post-trigger rows
+CFG_AUTO_TIMEOUT = 0.5 #AUTO mode: forced capture after this time without trigger (seconds)
+
+class DEF_TRIGTYPES(Enum):
+    RISING  = 0 #value crosses level upwards
+    FALLING = 1 #value crosses level downwards
+    LEVEL   = 2 #value crosses level in any direction
+    WINDOW  = 3 #value leaves the band [level, level2]
+    SLOPE   = 4 #slope (per second) reaches level (level >= 0: rising, level < 0: falling slope)
+
+class DEF_TRIGMODES(Enum):
+    AUTO   = 0
+    NORMAL = 1
+    SINGLE = 2
+
+@dataclass
+class TriggerCapture():
+    ''' captured rows around a trigger event '''
+    row : int = 0 #absolute row number of the trigger event
+    ts : int = 0 #timestamp of the trigger event (int64 ns since start)
+    pre : int = 0 #number of rows before the trigger row (trigger row is t[pre], y[pre])
+    t : np.ndarray = None #times in seconds (rows, max_chans)
+    y : np.ndarray = None #values (rows, max_chans)
+    forced : bool = False #True -> AUTO mode capture without trigger event
+
+class MeasurementTrigger():
+    '''
+    trigger on a single channel of a measurement (measdata.MeasurementData, synchronous data)
+    '''
+    def __init__(self, mdata, chan=0, trigtype=DEF_TRIGTYPES.RISING, level=0.0, level2=None,
+                 mode=DEF_TRIGMODES.NORMAL, pre=DEF_PRE, post=DEF_POST, holdoff=0.0,
+                 auto_timeout=CFG_AUTO_TIMEOUT, zeroed=False):
+        '''
+        mdata .. measurement data to watch
+        chan .. channel index to trigger on
+        level, level2 .. trigger level (WINDOW: band [level, level2], SLOPE: slope per second)
+        pre, post .. number of rows captured before and after the trigger row
+        holdoff .. minimum time between two trigger events (seconds)
+        zeroed .. True -> levels are compared to zero corrected values
+        '''
+        if pre + post + 1 > mdata.max_y_short:
+            raise ValueError(f"capture window ({pre}+{post}+1 rows) exceeds the measurement window ({mdata.max_y_short})")
+        if trigtype == DEF_TRIGTYPES.WINDOW and level2 is None: raise ValueError("window trigger requires level2")
+        self.mdata = mdata
+        self.chan = chan
+        self.trigtype = trigtype
+        self.level = level
+        self.level2 = level2
+        self.mode = mode
+        self.pre = int(pre)
+        self.post = int(post)
+        self.holdoff_ns = int(holdoff * measdata.DEF_NS_PER_S)
+        self.auto_ns = int(auto_timeout * measdata.DEF_NS_PER_S)
+        self.zeroed = zeroed
+        self.reset()
+
+    def reset(self):
+        ''' starts scanning with the next row written, clears pending captures '''
+        self.count_scanned = self.mdata.count #rows [0, count_scanned) are scanned
+        self.y_prev = np.nan #last scanned value (edge detection across process() calls)
+        self.ts_prev = None
+        #reference for the first AUTO timeout: newest row already in the window, else the first scanned row
+        self.ts_first = int(self.mdata.window_ts(1)[0]) if self.mdata.index > 0 else None
+        self.slope_prev = False
+        self.ts_trig = None #timestamp of the last trigger event (holdoff, AUTO timeout)
+        self.ts_capture = None #timestamp of the last capture (AUTO timeout)
+        self.pending = [] #trigger events waiting for their post rows [(row, ts), ..]
+        self.count_lost = 0 #rows not scanned and events dropped (rows overwritten), process() called too late
+        self.armed = True
+
+    def arm(self):
+        ''' (re-)arms the trigger, i.e., in SINGLE mode '''
+        self.armed = True
+
+    def _hits(self, y, ts):
+        '''
+        returns the indexes of the rows satisfying the trigger condition (vectorized), y/ts are the new rows
+        '''
+        a = np.concatenate(([self.y_prev], y[:-1])) #previous value of each row
+        b = y
+        if self.trigtype == DEF_TRIGTYPES.RISING:
+            cond = (a < self.level) & (b >= self.level)
+        elif self.trigtype == DEF_TRIGTYPES.FALLING:
+            cond = (a > self.level) & (b <= self.level)
+        elif self.trigtype == DEF_TRIGTYPES.LEVEL:
+            cond = ((a < self.level) & (b >= self.level)) | ((a > self.level) & (b <= self.level))
+        elif self.trigtype == DEF_TRIGTYPES.WINDOW:
+            inside_a = (a >= self.level) & (a <= self.level2)
+            inside_b = (b >= self.level) & (b <= self.level2)
+            cond = inside_a & ~(inside_b | np.isnan(b))
+        elif self.trigtype == DEF_TRIGTYPES.SLOPE:
+            ts_a = np.concatenate(([ts[0] if self.ts_prev is None else self.ts_prev], ts[:-1]))
+            with np.errstate(divide="ignore", invalid="ignore"):
+                slope = (b - a) / ((ts - ts_a) / measdata.DEF_NS_PER_S)
+            steep = (slope >= self.level) if self.level >= 0 else (slope <= self.level)
+            cond = steep & ~np.concatenate(([self.slope_prev], steep[:-1])) #first row of a steep section only
+            self.slope_prev = bool(steep[-1])
+        else:
+            raise ValueError(f"unknown trigger type: {self.trigtype}")
+        return np.flatnonzero(cond)
+
+    def _holdoff(self, ts_hits):
+        '''
+        returns the indexes of the events respecting the holdoff (each accepted event restarts the holdoff)
+        '''
+        keep = []
+        last = self.ts_trig
+        for i, ts in enumerate(ts_hits.tolist()):
+            if last is None or ts - last >= self.holdoff_ns:
+                keep.append(i)
+                last = ts
+        return keep
+
+    def _scan(self):
+        '''
+        scans all rows written since the last scan -> absolute rows and timestamps of the accepted trigger events
+        '''
+        mdata = self.mdata
+        num = mdata.count - self.count_scanned
+        if num > mdata.index: #rows are overwritten already
+            self.count_lost += num - mdata.index
+            self.count_scanned = mdata.count - mdata.index
+            num = mdata.index
+        if num <= 0: return (np.zeros(shape=(0,), dtype=np.int64), np.zeros(shape=(0,), dtype=np.int64))
+
+        ts = mdata.window_ts(num)
+        y = mdata.window_chan(self.chan, num, zeroed=self.zeroed)[1]
+        if self.ts_first is None: self.ts_first = int(ts[0])
+        hits = self._hits(y, ts) #always, keeps track of the slope state
+        if not self.armed: hits = hits[:0]
+        if self.holdoff_ns > 0 and len(hits): hits = hits[self._holdoff(ts[hits])]
+        if self.mode == DEF_TRIGMODES.SINGLE and len(hits):
+            hits = hits[:1]
+            self.armed = False
+        if len(hits): self.ts_trig = int(ts[hits[-1]])
+        rows = self.count_scanned + hits
+        ts_hits = ts[hits]
+        self.y_prev = y[-1]
+        self.ts_prev = int(ts[-1])
+        self.count_scanned = mdata.count
+        return (rows, ts_hits)
+
+    def process(self):
+        '''
+        scans all new rows for trigger events and returns the completed captures (list of TriggerCapture)
+        '''
+        mdata = self.mdata
+        rows, ts_hits = self._scan()
+        self.pending.extend(zip(rows.tolist(), ts_hits.tolist()))
+
+        captures = []
+        first = mdata.count - mdata.index #oldest row in the window
+        while self.pending and self.pending[0][0] + self.post < mdata.count: #post rows are written
+            row, ts_trig = self.pending.pop(0)
+            if row - self.pre < first and first > 0: #pre rows are overwritten already
+                self.count_lost += 1
+                continue
+            captures.append(self._capture(row, ts_trig))
+
+        #AUTO: free running capture, if there was no trigger for auto_timeout (as soon as pre+post+1 rows are available)
+        if self.mode == DEF_TRIGMODES.AUTO and not self.pending and mdata.index > self.pre + self.post:
+            ts_last = int(mdata.window_ts(1)[0])
+            ts_ref = max(x for x in (self.ts_trig, self.ts_capture, self.ts_first) if x is not None)
+            if ts_last - ts_ref >= self.auto_ns:
+                captures.append(self._capture(mdata.count - 1 - self.post, ts_last, forced=True))
+        return captures
+
+    def _capture(self, row, ts_trig, forced=False):
+        '''
+        copies the rows [row-pre, row+post] (as far as available) out of the ring
+        '''
+        mdata = self.mdata
+        first = mdata.count - mdata.index #oldest row in the window
+        start = max(row - self.pre, first)
+        stop = min(row + self.post + 1, mdata.count)
+        num = mdata.count - start
+        t = mdata.window_t(num)[:stop-start].copy()
+        y = mdata.window_y(num, zeroed=self.zeroed)[:stop-start].copy()
+        self.ts_capture = int(mdata.window_ts(mdata.count - stop + 1)[0])
+        if DBG_OUT: print(f"TRIGGER: row={row} rows=[{start}, {stop}) forced={forced}")
+        return TriggerCapture(row=row, ts=ts_trig, pre=row-start, t=t, y=y, forced=forced)
+
+class MeasurementSegments(MeasurementTrigger):
+    '''
+    segmented (sequence) acquisition: trigger events are written into preallocated segments
+        seg_y (segments, samples, max_chans) .. rows around each event (raw values of quantized storage, see values())
+        seg_ts, seg_row (segments,) .. timestamp (int64 ns since start) and absolute row of each event
+    samples = pre + 1 + post, the event row is seg_y[:, pre]. As soon as all segments are used, further events are
+    counted in count_missed (see clear()).
+    '''
+    def __init__(self, mdata, segments, chan=0, trigtype=DEF_TRIGTYPES.RISING, level=0.0, level2=None, 
+                 pre=DEF_PRE, post=DEF_POST, holdoff=0.0, zeroed=False):
+        super(MeasurementSegments, self).__init__(mdata, chan, trigtype, level, level2, DEF_TRIGMODES.NORMAL, 
+                                                  pre, post, holdoff, zeroed=zeroed)
+        self.segments = int(segments)
+        self.samples = self.pre + 1 + self.post
+        self.seg_y = np.zeros(shape=(self.segments, self.samples, mdata.max_chans), dtype=mdata.dtype)
+        self.seg_ts = np.zeros(shape=(self.segments,), dtype=np.int64)
+        self.seg_row = np.zeros(shape=(self.segments,), dtype=np.int64)
+        self.clear()
+
+    def reset(self):
+        super(MeasurementSegments, self).reset()
+        self._pend_row = np.zeros(shape=(0,), dtype=np.int64) #events waiting for their post rows
+        self._pend_ts = np.zeros(shape=(0,), dtype=np.int64)
+
+    def clear(self):
+        ''' frees all segments (data is overwritten by the next events) '''
+        self.num = 0 #number of used segments
+        self.count_missed = 0 #events not stored (all segments used or rows not available anymore)
+
+    def process(self):
+        '''
+        scans all new rows and writes completed events into the next free segments -> returns the number of new segments
+        '''
+        mdata = self.mdata
+        rows, ts_hits = self._scan()
+        if len(rows):
+            self._pend_row = np.concatenate((self._pend_row, rows))
+            self._pend_ts = np.concatenate((self._pend_ts, ts_hits))
+        done = int(np.searchsorted(self._pend_row, mdata.count - self.post, side="left")) #post rows are written
+        if done == 0: return 0
+        rows, ts_hits = self._pend_row[:done], self._pend_ts[:done]
+        self._pend_row, self._pend_ts = self._pend_row[done:], self._pend_ts[done:]
+
+        first = mdata.count - mdata.index #oldest row in the window
+        ok = rows - self.pre >= first
+        rows, ts_hits = rows[ok], ts_hits[ok]
+        num = min(len(rows), self.segments - self.num)
+        self.count_missed += done - num
+        if num == 0: return 0
+
+        #all segments of this call with a single gather out of the window (view)
+        win = mdata.window_y(mdata.index, raw=True)
+        idx = (rows[:num] - self.pre - first)[:, np.newaxis] + np.arange(self.samples)
+        self.seg_y[self.num:self.num+num] = win[idx]
+        self.seg_ts[self.num:self.num+num] = ts_hits[:num]
+        self.seg_row[self.num:self.num+num] = rows[:num]
+        self.num += num
+        if DBG_OUT: print(f"SEGMENTS: +{num} -> {self.num}/{self.segments}")
+        return num
+
+    def values(self, zeroed=False):
+        ''' (decoded) values of the used segments (num, samples, max_chans) '''
+        y = self.mdata.decode(self.seg_y[:self.num])
+        return y - self.mdata.md_zero_y[0] if zeroed else y
+
+    def times(self):
+        ''' event times in seconds since start (num,) '''
+        return self.seg_ts[:self.num] / measdata.DEF_NS_PER_S
+
+    def peaks(self, zeroed=False):
+        ''' maximum of each used segment and channel (num, max_chans), i.e., peak load of each crane pass '''
+        return self.values(zeroed).max(axis=1)
+
+def test_usage_regular():
+    '''
+    edge triggers on a pulse train (row-wise and block-wise ingest), holdoff and SINGLE mode
+    '''
+    max_chans = 2
+    mdata = measdata.MeasurementData([x for x in range(0,max_chans)], max_short=250)
+    trig = MeasurementTrigger(mdata, chan=1, level=0.5, pre=5, post=10)
+    pulses = np.zeros(shape=(300,))
+    for k in (20, 60, 150, 160): pulses[k:k+8] = 1.0 #rising edges at rows 20, 60, 150, 160
+    rows = np.stack((np.arange(300), pulses), axis=1)
+    times = np.arange(300) * 0.001
+    captures = []
+    for i in range(0, 100):
+        mdata.update(rows[i], [times[i]]*max_chans)
+        if i % 7 == 0: captures += trig.process()
+    mdata.update_block(rows[100:300], times[100:300])
+    captures += trig.process()
+    assert [c.row for c in captures] == [20, 60, 150, 160]
+    cap = captures[1]
+    assert cap.pre == 5 and len(cap.y) == 16 and cap.y[cap.pre, 1] == 1.0 and cap.y[cap.pre-1, 1] == 0.0
+    assert cap.y[0, 0] == 55 and np.isclose(cap.t[cap.pre, 0], 0.06) and trig.count_lost == 0
+
+    #holdoff suppresses the edge at row 160, falling edges
+    mdata.init_data()
+    trig = MeasurementTrigger(mdata, chan=1, trigtype=DEF_TRIGTYPES.FALLING, level=0.5, pre=2, post=2, holdoff=0.02)
+    mdata.update_block(rows[0:200], times[0:200])
+    assert [c.row for c in trig.process()] == [28, 68, 158]
+
+    #SINGLE mode and window trigger
+    mdata.init_data()
+    trig = MeasurementTrigger(mdata, chan=1, trigtype=DEF_TRIGTYPES.WINDOW, level=-0.5, level2=0.5,
+                              mode=DEF_TRIGMODES.SINGLE, pre=2, post=2)
+    mdata.update_block(rows[0:100], times[0:100])
+    assert [c.row for c in trig.process()] == [20] and not trig.armed
+    trig.arm()
+    mdata.update_block(rows[100:200], times[100:200])
+    assert [c.row for c in trig.process()] == [150]
+
+    #process() called too late: events whose rows are overwritten in the ring are dropped (counted as lost)
+    mdata.init_data()
+    trig = MeasurementTrigger(mdata, chan=1, level=0.5, pre=5, post=10)
+    mdata.update_block(rows[0:65], times[0:65])
+    assert [c.row for c in trig.process()] == [20] and [p[0] for p in trig.pending] == [60] #waits for post rows
+    mdata.update_block(rows[65:300], times[65:300])
+    mdata.update_block(rows[0:65], times[0:65] + 0.3) #row 60 (and its pre rows) leave the window of 250 rows
+    captures = trig.process()
+    assert [c.row for c in captures] == [150, 160, 320] and all(c.pre == 5 and len(c.y) == 16 for c in captures)
+    assert trig.count_lost == 1 + 50 #dropped event at row 60, 50 rows not scanned
+
+def test_slope_auto():
+    '''
+    slope trigger on a ramp, AUTO mode forces captures without trigger events
+    '''
+    mdata = measdata.MeasurementData([0], max_short=100)
+    ramp = np.concatenate((np.zeros(30), np.arange(0, 20)*10.0, np.full(50, 190.0)))
+    trig = MeasurementTrigger(mdata, chan=0, trigtype=DEF_TRIGTYPES.SLOPE, level=5000.0, pre=3, post=3)
+    mdata.update_block(ramp[:, np.newaxis], np.arange(100)*0.001) #ramp: 10 per ms = 10000 per second
+    assert [c.row for c in trig.process()] == [31]
+
+    mdata.init_data()
+    trig = MeasurementTrigger(mdata, chan=0, mode=DEF_TRIGMODES.AUTO, level=1000.0, pre=3, post=3, auto_timeout=0.05)
+    mdata.update_block(np.zeros(shape=(40, 1)), np.arange(40)*0.001)
+    assert trig.process() == []
+    mdata.update_block(np.zeros(shape=(20, 1)), np.arange(40, 60)*0.001)
+    captures = trig.process()
+    assert len(captures) == 1 and captures[0].forced and len(captures[0].y) == 7
+    with pytest.raises(ValueError):
+        MeasurementTrigger(mdata, pre=50, post=50)
+
+    #AUTO right after start: no forced capture before pre+post+1 rows are written
+    mdata.init_data()
+    trig = MeasurementTrigger(mdata, chan=0, mode=DEF_TRIGMODES.AUTO, level=1000.0, pre=3, post=3, auto_timeout=0.05)
+    mdata.update_block(np.zeros(shape=(2, 1)), [0.0, 0.1])
+    assert trig.process() == []
+    mdata.update_block(np.zeros(shape=(5, 1)), np.arange(2, 7)*0.1)
+    captures = trig.process()
+    assert len(captures) == 1 and captures[0].forced and captures[0].pre == 3 and len(captures[0].y) == 7
+
+    #AUTO on a filled window: no new rows -> no capture (timeout starts at the newest row), forced after the timeout
+    trig = MeasurementTrigger(mdata, chan=0, mode=DEF_TRIGMODES.AUTO, level=1000.0, pre=3, post=3, auto_timeout=0.25)
+    assert trig.ts_first == 600000000 and trig.process() == []
+    mdata.update_block(np.zeros(shape=(2, 1)), [0.7, 0.8])
+    assert trig.process() == []
+    mdata.update_block(np.zeros(shape=(1, 1)), [0.9])
+    captures = trig.process()
+    assert len(captures) == 1 and captures[0].forced and captures[0].ts == 900000000
+
+def test_segments():
+    '''
+    segmented acquisition: many events into preallocated segments, batch analysis over all segments
+    '''
+    max_chans = 2
+    mdata = measdata.MeasurementData([x for x in range(0,max_chans)], max_short=1000, dtype=np.int16)
+    seg = MeasurementSegments(mdata, segments=300, chan=0, level=50, pre=2, post=5)
+    period = 20
+    wave = np.tile(np.concatenate((np.zeros(10), np.full(10, 100.0))), 250) #rising edge every 20 rows
+    rows = np.stack((wave, np.arange(5000) % 1000), axis=1).astype(np.int16)
+    for i in range(0, 5000, 500):
+        mdata.update_block(rows[i:i+500], np.arange(i, i+500)*0.001)
+        seg.process()
+    assert seg.num == 250 and seg.count_missed == 0 and seg.count_lost == 0
+    assert np.array_equal(seg.seg_row[:seg.num], np.arange(10, 5000, period))
+    assert np.array_equal(seg.values()[:, :, 0], np.tile([0, 0, 100, 100, 100, 100, 100, 100], (250, 1)))
+    assert np.array_equal(seg.peaks()[:, 1], (seg.seg_row[:seg.num] + 5) % 1000)
+    assert np.allclose(seg.times()[0:2], [0.01, 0.03])
+    mdata.update_block(rows[0:100], np.arange(5000, 5100)*0.001)
+    seg.process()
+    assert seg.num == 255
+
+    seg.clear()
+    assert seg.num == 0
+    seg = MeasurementSegments(mdata, segments=3, chan=0, level=50, pre=2, post=5) #full -> further events are missed
+    mdata.update_block(rows[0:100], np.arange(5100, 5200)*0.001)
+    seg.process()
+    assert seg.num == 3 and seg.count_missed == 2 and seg.seg_y.shape == (3, 8, max_chans)
+
+if __name__ == '__main__':
+    print("running: meas_trigger.py")
+    test_usage_regular()
+    test_slope_auto()
+    test_segments()
+    print("done")
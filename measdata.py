@@ -6,7 +6,9 @@ TODO:
     --> Messwertarray muss asynchrone Befuellung unterstuetzen bzw. befuellung mit eigenen zeitmesswerten
 '''
 #python standard
+import os
 import time
+import itertools
 from dataclasses import dataclass
 import threading #thread safe data access support
 #3rd party
@@ -18,13 +20,20 @@ import pytest
 try:
     from libxkm import appdef
     from libxkm import meassys
+    from libxkm import meas_history
+    from libxkm import meas_pyramid
+    from libxkm import meas_stats
 except ModuleNotFoundError:
     import appdef
     import meassys #need measurement channel specification
+    import meas_history #long-term history tier (disk backed)
+    import meas_pyramid #min/max decimation pyramid
+    import meas_stats #running channel statistics
     
 DEF_DATATYPE = np.float32 #in case float only -> throws depreciation warning
 DEF_DEPTHSHORT = 50
 DEF_DEPTHFULL  = 1000
+DEF_NS_PER_S = 1000000000 #timestamps are int64 nanoseconds
 
 #at end of names of attributes
 DEF_PYOBJ_FIELDSTR = "_f" #identifier for field names in python object attributes (attribute name based processing)
@@ -33,6 +42,12 @@ DEF_PYOBJ_VASTR = "_v" #identifiert for value names in python object attributes
 DBG_OUT = False #enable/disable debugging output
 CFG_ZEROMONITOR = True #enable/disable zero monitor
 CFG_INITVAL = np.nan #initialization value for measurement data arrays (y-data, t-data)
+CFG_INITVAL_RAW = 0 #initialization value for quantized (integer) y-data
+CFG_PYRBATCH = 64 #row-wise updates are fed into the decimation pyramid in batches of (at least) this number of rows
+CFG_STATSBATCH = 64 #row-wise updates are fed into the running statistics in batches of this number of rows
+CFG_SNAPSHOT_RETRIES = 1000 #max. number of read attempts for a consistent snapshot, see MeasurementData.snapshot()
+
+_HIST_SEQ = itertools.count() #sequence number of generated history file names (unique within the process)
 
 
 class ErrorFinalizedWrite(Exception):
@@ -41,6 +56,45 @@ class ErrorFinalizedWrite(Exception):
     '''
     pass
 
+class ErrorSnapshot(Exception):
+    '''
+    raised, if a reader does not get a consistent snapshot (writer is too fast for the requested window)
+    '''
+    pass
+
+@dataclass
+class MeasurementSnapshot():
+    ''' 
+    saved rows of a measurement (HOLD/SAVE), see MeasurementData.save() -> copy-on-write: t and y are views into the 
+    ring buffer until the writer is going to overwrite the rows, then they are copied (is_copy)
+    '''
+    index : int = 0 #index of the saved data (key in md_saved_info)
+    ident : str = "" #user identifier, i.e., "HOLD"
+    info : str = "" #saving information (md_saved_info)
+    start : int = 0 #absolute row number of the first saved row
+    count : int = 0 #number of rows written, when the data was saved (saved rows are [start, start+len(t)))
+    ts : np.ndarray = None #shared timestamps (int64 ns since start), see t
+    y : np.ndarray = None #raw values in case of quantized storage, see values()
+    is_copy : bool = False
+    decode : object = None #decoding function for quantized storage (None -> y are values)
+    
+    @property
+    def t(self):
+        ''' saved row times in seconds since start '''
+        return self.ts / DEF_NS_PER_S
+    
+    def values(self):
+        ''' returns the saved (decoded) y-values '''
+        return self.y if self.decode is None else self.decode(self.y)
+    
+    def materialize(self):
+        ''' copies the rows, the snapshot does not share memory with the ring anymore '''
+        if not self.is_copy:
+            self.ts = self.ts.copy()
+            self.y = self.y.copy()
+            self.is_copy = True
+        return self
+
 @dataclass
 class MeasurementInfoData():
     ''' Measurements - additional information to a measurment process, as needed for the report '''    
@@ -71,24 +125,68 @@ class MeasurementData(MeasurementInfoData):
     Measurement data is organized in numpy arrays, created via self.init_data(). Numpy arrays are organized in channels:
     
     (1) Y-values self.md_current_y .. current measurement values -> 2D numpy array [zeile : spalte]
-        - newest values are first (zeile 0)
-        - oldest values are last  (zeile -1)
+        - oldest values are first (zeile 0)
+        - newest values are at zeile self.index-1 (zeile -1 as soon as the window is saturated)
         
         CH0 CH1 CH2 .. CHN (oldest value)
         ..
         CH0 CH1 CH2 .. CHN (newest value)
         
     (2) t-values self.md_current_t 
-        - newest values are first (zeile 0)
-        - oldest values are last (zeile -1)    
+        - same ordering as the y-values, float seconds since start for each channel (calculated on read)
+        - stored is a single int64 timestamp column (self._ring_ts, nanoseconds since start, time.monotonic_ns() or a 
+          sensor clock), all channels of a row share it -> exact timing for long runs, per-channel time differences 
+          are modelled by constant offsets (self.t_offset, seconds), see window_ts() for the raw timestamps
+    
+    Data is stored in a head indexed ring buffer (self._ring_y, self._ring_ts), appending a row is O(1). Each row is written 
+    twice (at self.head and self.head+max_y_short), so every window of max_y_short consecutive rows is a contiguous
+    numpy view -> md_current_y, window_y()/window_ts(), last_y() never copy data. 
+    ATTENTION: views are handles into the ring, rows are overwritten after max_y_short further updates
+    Time ranges: index_of() maps a time to an absolute row number with a binary search over the window timestamps and the
+    long-term history tier (O(log n)), select_time() returns the rows of [t0, t1] (or the last seconds) as views.
+    
+    Saved data: save() captures the whole window (or a time range) as MeasurementSnapshot in O(1), the snapshot shares 
+    memory with the ring. The writer copies held snapshots right before it overwrites their rows (self.held_limit) ->
+    HOLD does not stall the ingest and nothing is copied, if the hold is released in time.
+    
+    Quantized storage: with an integer dtype (i.e., np.int16 for raw ADC values) the y-values are stored as they are 
+    (raw), values are decoded lazily on read with a per-channel scale and offset: value = raw*scale + offset. Reads 
+    (window_y(), window_chan(), last_y(), snapshot(), history(), rows(), decimate(), stats()) return decoded values (a new 
+    array of the rows read), raw=True returns raw views. Times, zero values and saved rows are always floats.
+    
+    Zero correction: zero_set() only stores the zero values (self.md_zero_y), the raw data is never modified. Zeroed data 
+    is calculated lazily on read (zeroed=True for window_y(), window_chan(), snapshot(), last_y(), stats()) -> the
+    subtraction is done for the rows read only and re-zeroing is O(channels), even after the fact.
+    
+    Asynchronous data: channels (i.e., sensors reporting independently with different rates) can be updated channel-wise
+    via update_chans(). Each channel advances its own ring position (self.index_chan) and writes its own time column
+    (self._ring_tc, allocated with the first channel-wise update), read them with window_chan(). The measurement data is in asynchronous mode after the first channel-wise update
+    (self.is_async) -> row-wise ingest and row-wise views/pyramid/history are for synchronous data only.
+    
+    Threading: single writer (collector/aggregator thread), multiple readers (i.e., GUI). The writer never blocks, it 
+    increments self.seq before and after each write (odd = write in progress) and announces the rows it is going to
+    write in self.count_wr. Readers use snapshot() -> consistent window without locks and without copying the whole ring.
     '''
     
     def __init__(self, chans=[], chans_info=[], chan_sel = None,
-                 max_long=DEF_DEPTHFULL, max_short=DEF_DEPTHSHORT, dtype = DEF_DATATYPE):
+                 max_long=DEF_DEPTHFULL, max_short=DEF_DEPTHSHORT, dtype = DEF_DATATYPE,
+                 use_hist=False, p_dir_hist=None, hist_name=None, pyr_levels=meas_pyramid.DEF_LEVELS, use_stats=True,
+                 scale=None, offset=None, t_offset=None, filters=None):
         '''
         chans .. the measurement data channels to use, we store a measurement data channel list
-        depth .. time history depth to work with (number of values) default = 2048 [big data array]
-        depthshort = time history depth for short measurement data default = 100
+        max_long .. time history depth of the long-term history tier (number of rows on disk, used if use_hist)
+        max_short .. time history depth for short measurement data (in RAM)
+        dtype .. data type of the y-values, integer types (np.int16, np.int32) -> quantized storage of raw values
+        scale, offset .. quantized storage: per-channel decoding value = raw*scale + offset (None -> 1.0 and 0.0)
+        t_offset .. per-channel time offset in seconds, added to the shared timestamp on read (None -> 0.0)
+        use_hist .. enable the long-term history tier, rows leaving the short window are spilled to disk (numpy.memmap)
+        p_dir_hist .. directory for the history files, None -> CFG.p_dir_meas
+        hist_name .. base file name for the history files, None -> generated from the start time, the process id and a
+                     sequence number (objects created in the same second do not overwrite each others files)
+        pyr_levels .. samples per bucket for each level of the min/max decimation pyramid, None -> no pyramid
+        use_stats .. keep running channel statistics (session and since zeroing), see stats()
+        filters .. meas_filter.FilterBank applied on ingest (update()/update_block()), the stored rows are filtered
+                   (quantized storage: the raw values are filtered and rounded)
         chan_sel .. channel selection support a dictionary with channel lists to support grouping (TODO)
             {
             'multimeter':[1,2,3],
@@ -102,11 +200,31 @@ class MeasurementData(MeasurementInfoData):
         self.chans = chans #the description list of measurement data channels
         self.chans_info = chans_info  #optional: measurement channel information 
         self.max_chans = len(self.chans)
-        self.dtype = dtype
+        self.dtype = np.dtype(dtype)
+        self.is_quantized = self.dtype.kind in "iu"
+        self.dtype_val = DEF_DATATYPE if self.is_quantized else self.dtype #data type of (decoded) values and times
+        self.scale = np.ones(shape=(self.max_chans,), dtype=self.dtype_val)
+        self.offset = np.zeros(shape=(self.max_chans,), dtype=self.dtype_val)
+        self.set_scale(scale, offset)
+        self.t_offset = np.zeros(shape=(self.max_chans,), dtype=np.float64)
+        if t_offset is not None: self.t_offset[:] = t_offset
         self.max_y_long = int(max_long) 
         self.max_y_short = int(max_short)
+        self.pyr_levels = pyr_levels
+        self.use_stats = use_stats
+        self.filters = filters
         self.init_data()
         self.init_flags()
+        
+        #long-term history tier (None, if not used)
+        self.hist = None
+        if use_hist:
+            if hist_name is None: 
+                hist_name = time.strftime("meas_%Y%m%d_%H%M%S", time.localtime(self.time_start)) \
+                            + "_%i_%i" % (os.getpid(), next(_HIST_SEQ))
+            self.hist = meas_history.MeasurementHistory(self.max_chans, self.max_y_long, dtype=self.dtype, 
+                                                        p_dir=p_dir_hist, name=hist_name, dtype_t=np.int64, chans_t=1,
+                                                        scale=self.scale, offset=self.offset)
 
         #external object handles (if needed)
         self.h_report = None #handle to a measurement report, this file can be a part of
@@ -119,25 +237,58 @@ class MeasurementData(MeasurementInfoData):
         '''
         clearing all measurement data (a clean reset) and ensuring a default state after initialization
         '''
-        if not keeptime: self.time_start = time.time()
+        if not keeptime: 
+            self.time_start = time.time()
+            self.time_start_ns = time.monotonic_ns() #internal timestamps are relative to this (t = 0)
         
         #a global row counter for row-wise updates
-        self.index = 0  #current data index to write to 
+        self.index = 0  #number of valid rows in the current window (saturates at max_y_short)
+        self.count = 0  #number of rows written since initialization (does not saturate)
+        self.head = 0   #ring position the next row is written to
+        self.count_spilled = 0 #rows [0, count_spilled) are written to the long-term history tier
+        self.count_wr = 0 #rows [0, count_wr) are written or in progress of being written (writer announcement)
+        self.seq = 0 #write sequence counter, odd while the writer is modifying the ring (see snapshot())
         
         #index for saved measurement data
         self.index_saved = 0
         
-        #an individual channel index counter, for channel-wise updates
-        self.index_chan = np.zeros(shape=(1, self.max_chans), dtype=int) #individual update conter
+        #an individual channel index counter, for channel-wise updates (number of values written for each channel)
+        self.index_chan = np.zeros(shape=(self.max_chans,), dtype=np.int64) #individual update conter
+        self.is_async = False #True after the first channel-wise update, see update_chans()
                 
-        #measurement data variables
-        self.md_current_t  = np.full(shape=(self.max_y_short, self.max_chans), fill_value= CFG_INITVAL, dtype=self.dtype)  #layer: values
-        self.md_current_y  = np.full(shape=(self.max_y_short, self.max_chans), fill_value= CFG_INITVAL, dtype=self.dtype)  #layer: times
-        self.md_saved_t    = np.full(shape=(self.max_y_short, self.max_chans), fill_value= CFG_INITVAL, dtype=self.dtype)  #layer: saved - valed
-        self.md_saved_y    = np.full(shape=(self.max_y_short, self.max_chans), fill_value= CFG_INITVAL, dtype=self.dtype)  #layer: values
+        #measurement data variables -> ring buffer with mirrored second half, see class description
+        self._ring_ts = np.zeros(shape=(2*self.max_y_short,), dtype=np.int64)  #layer: times (shared, ns since start)
+        self._ring_tc = None #layer: times for each channel (ns), asynchronous data only -> see update_chans()
+        self._ring_y = np.full(shape=(2*self.max_y_short, self.max_chans), 
+                               fill_value= CFG_INITVAL_RAW if self.is_quantized else CFG_INITVAL, dtype=self.dtype)  #layer: values
+        self.md_saved_t    = np.full(shape=(self.max_y_short, self.max_chans), fill_value= CFG_INITVAL, dtype=np.float64)  #layer: saved - valed
+        self.md_saved_y    = np.full(shape=(self.max_y_short, self.max_chans), fill_value= CFG_INITVAL, dtype=self.dtype_val)  #layer: values
         self.md_saved_info = {}
-        self.md_zero_y     = np.zeros(shape=(1, self.max_chans), dtype=self.dtype) #zero y-value for each channel
-        self.md_zero_t     = np.zeros(shape=(1, self.max_chans), dtype=self.dtype) #optinoal zero t-value for each channel (= start of measurement)
+        self.md_saved = {} #saved data as MeasurementSnapshot for each index of md_saved_info
+        self._held = [] #saved snapshots still sharing memory with the ring
+        self.held_limit = float("inf") #the writer copies held snapshots before writing this absolute row
+        self._lock_held = threading.Lock() #save() vs. writer copying held snapshots (never taken for regular writes)
+        self.md_zero_y     = np.zeros(shape=(1, self.max_chans), dtype=self.dtype_val) #zero y-value for each channel
+        self.md_zero_t     = np.zeros(shape=(1, self.max_chans), dtype=np.float64) #optinoal zero t-value for each channel (= start of measurement)
+        
+        #decimation pyramid, covers the whole history depth (short window and long-term history)
+        #rows are fed in batches (rows are still in the window), rows [0, count_pyr) are in the pyramid
+        self.pyr = None
+        self.count_pyr = 0
+        self.pyr_batch = min(max(self.pyr_levels[0], CFG_PYRBATCH), self.max_y_short) if self.pyr_levels else 0
+        if self.pyr_levels: 
+            self.pyr = meas_pyramid.MeasurementPyramid(self.max_chans, max(self.max_y_short, self.max_y_long), 
+                                                       levels=self.pyr_levels, dtype=self.dtype_val)
+        
+        #running statistics (session and since zeroing), fed in batches as the pyramid, rows [0, count_stats) are in
+        self.stats_all = meas_stats.RunningStats(self.max_chans) if self.use_stats else None
+        self.stats_zero = meas_stats.RunningStats(self.max_chans) if self.use_stats else None
+        self.count_stats = 0
+        self.stats_batch = min(CFG_STATSBATCH, self.max_y_short)
+        self._stats_win = None #cached statistics of the current window (count, RunningStats)
+        
+        #ingest filters start with a clean state
+        if self.filters is not None: self.filters.reset()
         
         #saved data including 
         
@@ -147,11 +298,142 @@ class MeasurementData(MeasurementInfoData):
     def init_flags(self):
         self.is_finalized = False #in case finalized, now changes are possible anymore
         self.is_zeroed = False #in case of first zeroing is true
+    
+    def set_scale(self, scale=None, offset=None):
+        '''
+        quantized storage: sets the per-channel decoding (value = raw*scale + offset), None -> keep the current values
+        -> O(channels), stored raw data is not touched
+        '''
+        if scale is not None: self.scale[:] = scale
+        if offset is not None: self.offset[:] = offset
+        if self.is_quantized and getattr(self, "hist", None) is not None: 
+            self.hist.scale[:] = self.scale
+            self.hist.offset[:] = self.offset
+    
+    def decode(self, y, chan=slice(None)):
+        ''' returns decoded values of raw y-values (rows or values of channel(s) chan), unchanged if not quantized '''
+        if not self.is_quantized: return y
+        return (y * self.scale[chan] + self.offset[chan]).astype(self.dtype_val, copy=False)
+    
+    def encode(self, vals, chan=slice(None)):
+        ''' returns raw values for values (rounded and clipped to the storage data type), unchanged if not quantized '''
+        if not self.is_quantized: return vals
+        info = np.iinfo(self.dtype)
+        raw = np.rint((np.asarray(vals, dtype=np.float64) - self.offset[chan]) / self.scale[chan])
+        return np.clip(raw, info.min, info.max).astype(self.dtype)
+    
+    def to_ns(self, t):
+        ''' converts times (seconds since start) to int64 timestamps (ns since start) '''
+        return np.rint(np.asarray(t, dtype=np.float64) * DEF_NS_PER_S).astype(np.int64)
+    
+    def to_seconds(self, ts, chan=None):
+        ''' 
+        converts int64 timestamps (ns since start) to float seconds including the channel time offsets
+            chan .. None -> one column for each channel (.., max_chans), otherwise times of the channel chan
+        '''
+        t = ts / DEF_NS_PER_S
+        if chan is None: return t[..., np.newaxis] + self.t_offset
+        return t + self.t_offset[chan]
+    
+    @property
+    def md_current_t(self):
+        ''' current t-values (oldest first) in seconds for each channel, shape (max_y_short, max_chans), calculated '''
+        start = self.head + self.max_y_short - self.index
+        return self.to_seconds(self._ring_ts[start:start+self.max_y_short])
+
+    @property
+    def md_current_y(self):
+        ''' current y-values (oldest first) as view into the ring buffer, shape (max_y_short, max_chans), raw if quantized '''
+        start = self.head + self.max_y_short - self.index
+        return self._ring_y[start:start+self.max_y_short]
+    
+    def _window(self, ring, num=None, newest_first=False, head=None, index=None):
+        '''
+        returns a view of the last num valid rows of a ring array (all valid rows if num is None)
+        head, index .. ring state to use (None -> current state)
+        '''
+        if head is None: head = self.head
+        if index is None: index = self.index
+        num = index if num is None else max(0, min(int(num), index))
+        end = head + self.max_y_short #newest row is always end-1 (in the mirrored half)
+        if newest_first:
+            stop = end - 1 - num
+            return ring[end-1:(stop if stop >= 0 else None):-1]
+        return ring[end-num:end]
+    
+    def window_y(self, num=None, newest_first=False, zeroed=False, raw=False):
+        '''
+        ordered view of the last num y-values (rows), without copying data
+        newest_first .. False -> oldest row first (default), True -> newest row first
+        zeroed .. True -> zero corrected values (a new array of the requested rows, the ring is not modified)
+        raw .. quantized storage: True -> raw values (view), False -> decoded values (a new array)
+        '''
+        y = self._window(self._ring_y, num, newest_first)
+        if raw: return y
+        if zeroed: return self.decode(y) - self.md_zero_y[0]
+        return self.decode(y)
+    
+    def window_t(self, num=None, newest_first=False, per_chan=True):
+        '''
+        t-values of the last num rows in seconds, see window_y(), calculated from the shared timestamps
+        per_chan .. True -> one column for each channel (including time offsets), False -> the row times (num,) 
+        '''
+        ts = self._window(self._ring_ts, num, newest_first)
+        return self.to_seconds(ts) if per_chan else ts / DEF_NS_PER_S
+    
+    def window_ts(self, num=None, newest_first=False):
+        '''
+        ordered view of the last num timestamps (int64 ns since start, shared by all channels), without copying data
+        '''
+        return self._window(self._ring_ts, num, newest_first)
+    
+    def snapshot(self, num=None, newest_first=False, copy=True, retries=CFG_SNAPSHOT_RETRIES, zeroed=False, raw=False,
+                 ts=False):
+        '''
+        lock-free consistent read of the last num rows (all valid rows if None) -> returns (t, y, count)
+            count .. absolute number of rows written, when the snapshot was taken (newest row is count-1)
+            copy .. True -> copies of the requested rows only (safe to keep)
+                    False -> views into the ring, consistent when returned but overwritten after 
+                             max_y_short-num further rows (use for immediate processing, i.e., drawing)
+            zeroed .. True -> zero corrected y-values (always a new array)
+            raw .. quantized storage: True -> raw y-values, False -> decoded y-values (always a new array)
+            ts .. True -> t are the shared int64 timestamps (num,), False -> seconds for each channel (num, max_chans)
+        
+        Protocol (single writer / multiple readers): 
+            (1) read ring state (head, index, count) between two equal and even self.seq values
+            (2) take the rows (views or copies)
+            (3) rows are valid, if the writer did not start to overwrite them in the meantime (self.count_wr)
+        the writer is never blocked, the reader retries instead (raises ErrorSnapshot after retries attempts)
+        '''
+        for i in range(0, retries):
+            seq = self.seq
+            if seq & 1: #write in progress
+                time.sleep(0)
+                continue
+            head, index, count = self.head, self.index, self.count
+            if seq != self.seq: continue
+            
+            num_rows = index if num is None else max(0, min(int(num), index))
+            t = self._window(self._ring_ts, num_rows, newest_first, head, index)
+            y = self._window(self._ring_y, num_rows, newest_first, head, index)
+            if copy:
+                t = t.copy()
+                y = y.copy()
+            #oldest taken row (count-num_rows) is overwritten by the write of row count-num_rows+max_y_short
+            if self.seq == seq or self.count_wr <= count - num_rows + self.max_y_short:
+                if not ts: t = self.to_seconds(t)
+                if raw: return (t, y, count)
+                y = self.decode(y)
+                if zeroed:
+                    if copy or self.is_quantized: np.subtract(y, self.md_zero_y[0], out=y)
+                    else: y = y - self.md_zero_y[0]
+                return (t, y, count)
+        raise ErrorSnapshot(f"no consistent snapshot after {retries} attempts (num={num})")
         
     def datasets(self):
         ''' 
             returns a dictionary with datasets names and their data handles -> numpy arrays
-            ATTENTION: reading/writing data in background
+            ATTENTION: reading/writing data in background, use snapshot() for consistent reads of the current data
         '''
         datasets = {
             'current_t':  self.md_current_t,
@@ -159,6 +441,7 @@ class MeasurementData(MeasurementInfoData):
             'saved_t':    self.md_saved_t,
             'saved_y':    self.md_saved_y,
             'saved_info': self.md_saved_info, #additional measurement info for saved data
+            'saved':      self.md_saved, #saved windows (MeasurementSnapshot) for each index of saved_info
             'zero_y':     self.md_zero_y,
             'zero_t':     self.md_zero_t,
         }
@@ -172,8 +455,11 @@ class MeasurementData(MeasurementInfoData):
         vals_t .. optional time values
         ''' 
         self.is_zeroed = True
-        if vals==None: vals = self.md_current_y[self.index-1,:] #last entry is self.index - 1
-        if vals_t==None: vals_t = self.md_current_t[self.index-1,:] #last entry is self.index - 1
+        if self.stats_all is not None: #rows up to now belong to the previous zero
+            self._stats_feed()
+            self.stats_zero.reset()
+        if vals is None: vals = self.last_y() #newest row of the ring
+        if vals_t is None: vals_t = self.last_t()
         
         #default case, no channel selection is active -> store zero values, without additional selection
         if self.index >= 1:    
@@ -184,24 +470,43 @@ class MeasurementData(MeasurementInfoData):
         return [self.md_zero_y[0,:], self.md_zero_t[0,:]]
     
     def zero_y(self):
-        ''' returns zero measurement value information '''
+        ''' returns zero measurement value information (the zero correction of all zeroed=True reads) '''
         return self.md_zero_y[0,:] 
                     
     def zero_t(self):
         ''' returns zero measurement time information '''
         return self.md_zero_t[0,:]
     
-    def save(self, myident="", index=None, saveinfo="Was, wo und in welchem Zusammenhang"):
+    def save(self, myident="", index=None, saveinfo="Was, wo und in welchem Zusammenhang", t0=None, t1=None):
         '''
         save current measurement data  into saved measurement data set, provide saving information 
         
         can be used for "HOLD" functionality of current measurement.
+            - the last row goes to md_saved_t/md_saved_y (as long as index < max_y_short)
+            - the whole window (rows in the time range [t0, t1] if given) is saved as MeasurementSnapshot, see saved()
+              -> O(1) and no copy, the writer copies the rows before it overwrites them (copy-on-write)
         '''
+        if self.is_async: raise TypeError("asynchronous measurement data -> use window_chan()")
         if index == None: index = self.index_saved
         
-        self.md_saved_t[index,:] = self.md_current_t[self.index,:]
-        self.md_saved_y[index,:] = self.md_current_y[self.index,:]
+        with self._lock_held:
+            while True:
+                t, y, count = self.snapshot(copy=False, raw=True, ts=True)
+                i0 = 0 if t0 is None else np.searchsorted(t, self.to_ns(t0), side="left")
+                i1 = len(t) if t1 is None else np.searchsorted(t, self.to_ns(t1), side="right")
+                start = count - len(t) + i0
+                #announce the rows before checking the writer -> the writer copies them before overwriting
+                self.held_limit = min(self.held_limit, start + self.max_y_short)
+                if self.count_wr <= start + self.max_y_short: break #rows are not touched by the writer yet
+            snap = MeasurementSnapshot(index=index, ident=myident, info=saveinfo, start=start, count=count, 
+                                       ts=t[i0:i1], y=y[i0:i1], decode=self.decode if self.is_quantized else None)
+            self._held.append(snap)
+        
+        if index < self.md_saved_y.shape[0]:
+            self.md_saved_t[index,:] = self.last_t()
+            self.md_saved_y[index,:] = self.last_y()
         self.md_saved_info[index] = saveinfo 
+        self.md_saved[index] = snap
 
         if DBG_OUT: 
             print("S(%04i): V=" % self.index_saved + str(self.md_saved_y[index,:]) + "\t t=" + str(self.md_saved_t) )
@@ -209,11 +514,29 @@ class MeasurementData(MeasurementInfoData):
         self.index_saved = index + 1
         return [self.index_saved, myident]
     
-    def update(self, data_y=[], data_t=None):
+    def saved(self, index=None):
+        ''' returns saved data as MeasurementSnapshot (newest if index is None) '''
+        if index is None: index = self.index_saved - 1
+        return self.md_saved[index]
+    
+    def _held_copy(self):
+        '''
+        writer: copies all held snapshots (still sharing memory with the ring), called before rows are overwritten
+        '''
+        with self._lock_held:
+            for snap in self._held: snap.materialize()
+            self._held = []
+            self.held_limit = float("inf")
+    
+    def update(self, data_y=[], data_t=None, t_ns=None):
         ''' 
         a user is adding measurement data to our array, by adding a full data line row.
         in the default case, timing information is added automatically
         
+        data_t .. time in seconds since start, a single value or one value for each channel (the row shares the time of
+                  the first channel, see t_offset for per-channel differences)
+        t_ns .. int64 timestamp in ns since start (i.e., from a sensor clock), used instead of data_t
+        
         checktype .. True -> we are checking/converting the data type, to make sure, correct data is added. The user should work with 
         the expected data types, to speed things up
         
@@ -223,38 +546,347 @@ class MeasurementData(MeasurementInfoData):
         '''
         if self.is_finalized: raise ErrorFinalizedWrite()
         if len(data_y) != self.max_chans: raise TypeError("data length missmatch for data_y -> synchronous data is required!")
+        if self.is_async: raise TypeError("asynchronous measurement data -> use update_chans()")
+        if self.filters is not None: data_y = self._filter(np.asarray(data_y)[np.newaxis])[0]
 
-        #in case saturated, we will roll data and first element will be last element?
-        #rolling large data consumes a lot of memory? / rolling data will make things slower?
-        if self.index >= self.max_y_short:
-            self.md_current_t = np.roll(self.md_current_t, shift=-1, axis=0)
-            self.md_current_y = np.roll(self.md_current_y, shift=-1, axis=0)
-            self.index -= 1
+        #adding t_data (timing or x values) / internal timestamp is used in case of None -> shared int64 ns timestamp
+        if t_ns is not None: ts = int(t_ns)
+        elif data_t is None: ts = time.monotonic_ns()-self.time_start_ns
+        elif np.isscalar(data_t): ts = round(float(data_t)*DEF_NS_PER_S)
+        elif len(data_t) != self.max_chans: raise TypeError("data length missmatch for data_t!")
+        else: ts = round(float(data_t[0])*DEF_NS_PER_S)
         
-        #adding t_data (timing or x values) / internal timestamp is used in case of None.      
-        if data_t==None: 
-            self.md_current_t[self.index] = [time.time()-self.time_start]*self.max_chans
-        else: 
-            if len(data_t) != self.max_chans: raise TypeError("data length missmatch for data_t!")
-            self.md_current_t[self.index] = [time.time()-self.time_start]*self.max_chans
+        #ring buffer: no rolling, we write the row at head and at its mirrored position head+max_y_short
+        row = self.head
+        if self.hist is not None and self.index == self.max_y_short: 
+            self._hist_spill(self.count - self.max_y_short + 1) #oldest row is leaving the window
         
-        #adding y-data (values)
-        self.md_current_y[self.index] = data_y
+        self.count_wr = self.count + 1
+        if self.count >= self.held_limit: self._held_copy() #row count-max_y_short is held
+        self.seq += 1 #odd -> write in progress
+        try:
+            self._ring_ts[row] = ts
+            self._ring_ts[row+self.max_y_short] = ts
+            
+            #adding y-data (values)
+            self._ring_y[row] = data_y
+            self._ring_y[row+self.max_y_short] = data_y
+            
+            #optinal debugging output
+            if DBG_OUT: 
+                print(">(%04i): V=" % self.index + str(data_y) + "\t t=" + str(ts) )
+                print("=Z:%04i: V=" % self.index + str(self._ring_y[row]) + "\t t=" + str(self._ring_ts[row]) )
+            
+            #adding data, we keep track of the latest data
+            self.head = row+1 if row+1 < self.max_y_short else 0
+            self.count += 1
+            if self.index < self.max_y_short: self.index = self.index+1
+        finally:
+            self.count_wr = self.count
+            self.seq += 1 #even -> ring state is consistent
+        if self.pyr is not None and self.count - self.count_pyr >= self.pyr_batch: self._pyr_feed()
+        if self.stats_all is not None and self.count - self.count_stats >= self.stats_batch: self._stats_feed()
+        return self.index
+
+    def _ring_write(self, ring, rows, head):
+        '''
+        writes rows (at most max_y_short) into a ring array starting at head, handles wraparound and the mirrored half
+        '''
+        first = min(len(rows), self.max_y_short-head)
+        ring[head:head+first] = rows[:first]
+        ring[head+self.max_y_short:head+self.max_y_short+first] = rows[:first]
+        rest = len(rows) - first
+        if rest > 0:
+            ring[0:rest] = rows[first:]
+            ring[self.max_y_short:self.max_y_short+rest] = rows[first:]
+    
+    def update_block(self, rows_y, rows_t=None, t_ns=None):
+        '''
+        a user is adding a block of measurement data rows (i.e., a radio packet holding many samples) -> same semantics as
+        update(), but all rows are written with a single vectorized operation.
         
-        #optinal debugging output
-        if DBG_OUT: 
-            print(">(%04i): V=" % self.index + str(data_y) + "\t t=" + str(data_t) )
-            print("=Z:%04i: V=" % self.index + str(self.md_current_y[self.index]) + "\t t=" + str(self.md_current_t[self.index]) )
+        rows_y .. array-like with shape (N, max_chans), oldest row first
+        rows_t .. None -> internal timestamp (arrival time of the block) for all rows
+                  shape (N,) -> one time per row in seconds since start (used for all channels)
+                  shape (N, max_chans) -> time for each row and channel (the row shares the time of the first channel)
+        t_ns .. int64 timestamps in ns since start (N,) or a single one (i.e., from a sensor clock), used instead of rows_t
         
-        #adding data, we keep track of the latest data
-        self.index = self.index+1
+        returns:
+            index .. number of valid rows in the current window (as update())
+        '''
+        if self.is_finalized: raise ErrorFinalizedWrite()
+        if self.is_async: raise TypeError("asynchronous measurement data -> use update_chans()")
+        rows_y = np.asarray(rows_y)
+        if rows_y.ndim != 2 or rows_y.shape[1] != self.max_chans: 
+            raise TypeError("data shape missmatch for rows_y -> synchronous data (N, max_chans) is required!")
+        num = rows_y.shape[0]
+        if num == 0: return self.index
+        if self.filters is not None: rows_y = self._filter(rows_y)
+        
+        if t_ns is not None:
+            rows_ts = np.broadcast_to(np.asarray(t_ns, dtype=np.int64), (num,))
+        elif rows_t is None:
+            rows_ts = np.full(shape=(num,), fill_value=time.monotonic_ns()-self.time_start_ns, dtype=np.int64)
+        else:
+            rows_t = np.asarray(rows_t)
+            if rows_t.ndim == 2 and rows_t.shape[1] in (1, self.max_chans): rows_t = rows_t[:, 0]
+            if rows_t.shape != (num,): raise TypeError("data shape missmatch for rows_t!")
+            rows_ts = self.to_ns(rows_t)
+        
+        #rows leaving the window are spilled into the long-term history (oldest window rows first, then block rows)
+        if self.hist is not None:
+            leaving = max(0, self.index + num - self.max_y_short)
+            self._hist_spill(self.count - self.index + min(leaving, self.index))
+            if leaving > self.index:
+                self.hist.write(rows_y[:leaving-self.index], rows_ts[:leaving-self.index])
+                self.count_spilled = self.count + leaving - self.index
+        
+        #decimation pyramid: pending window rows first, then the block (before the ring is overwritten)
+        if self.pyr is not None: 
+            self._pyr_feed()
+            self.pyr.update(self.decode(rows_y), rows_ts / DEF_NS_PER_S)
+            self.count_pyr += num
+        
+        #running statistics: pending window rows first, then the block
+        if self.stats_all is not None:
+            self._stats_feed()
+            block = meas_stats.block_reduce(self.decode(rows_y))
+            self.stats_all.merge(block)
+            self.stats_zero.merge(block)
+            self.count_stats += num
+        
+        #only the newest max_y_short rows survive in the window -> skip everything else
+        skip = max(0, num - self.max_y_short)
+        head = (self.head + skip) % self.max_y_short
+        self.count_wr = self.count + num
+        if self.count + num > self.held_limit: self._held_copy()
+        self.seq += 1 #odd -> write in progress
+        try:
+            self._ring_write(self._ring_ts, rows_ts[skip:], head)
+            self._ring_write(self._ring_y, rows_y[skip:], head)
+            
+            if DBG_OUT: print(">(%04i): BLOCK N=%i" % (self.index, num))
+            
+            self.head = (self.head + num) % self.max_y_short
+            self.count += num
+            self.index = min(self.index + num, self.max_y_short)
+        finally:
+            self.count_wr = self.count
+            self.seq += 1 #even -> ring state is consistent
         return self.index
 
+    def _filter(self, rows):
+        ''' applies the ingest filters to rows (N, max_chans) -> rows to store (quantized: rounded and clipped) '''
+        rows = self.filters.process(rows)
+        if not self.is_quantized: return rows
+        info = np.iinfo(self.dtype) #filter overshoot must not wrap around in the integer ring
+        return np.clip(np.rint(rows), info.min, info.max)
+
+    def update_chans(self, chans_index, vals, vals_t=None, t_ns=None):
+        '''
+        channel-wise (asynchronous) update: adds one value for each of the given channels, every channel advances its own
+        ring position (self.index_chan) -> costs O(len(chans_index)), independent of the number of channels
+        
+        chans_index .. channel indexes (columns) to update, each channel only once, i.e., [4,5] for a two channel sensor
+        vals .. one value for each channel
+        vals_t .. None -> internal timestamp, a single time or one time for each channel (seconds since start)
+        t_ns .. int64 timestamp(s) in ns since start, used instead of vals_t
+        
+        returns: number of values written for each of the updated channels
+        '''
+        if self.is_finalized: raise ErrorFinalizedWrite()
+        if len(vals) != len(chans_index): raise TypeError("data length missmatch for chans_index and vals!")
+        if t_ns is not None: ts = np.asarray(t_ns, dtype=np.int64)
+        elif vals_t is None: ts = time.monotonic_ns()-self.time_start_ns
+        else: ts = self.to_ns(vals_t)
+        if not self.is_async: #channels continue behind the synchronous rows written so far (with their timestamps)
+            self.index_chan[:] = self.count
+            self._ring_tc = np.repeat(self._ring_ts[:, np.newaxis], self.max_chans, axis=1)
+            self.is_async = True
+        
+        cols = np.asarray(chans_index, dtype=np.intp)
+        pos = self.index_chan[cols] % self.max_y_short
+        self.seq += 1 #odd -> write in progress
+        try:
+            self._ring_y[pos, cols] = vals
+            self._ring_y[pos+self.max_y_short, cols] = vals
+            self._ring_tc[pos, cols] = ts
+            self._ring_tc[pos+self.max_y_short, cols] = ts
+            self.index_chan[cols] += 1
+        finally:
+            self.seq += 1
+        if DBG_OUT: print(">CH%s: V=%s t=%s" % (str(chans_index), str(vals), str(ts)))
+        return self.index_chan[cols]
+    
+    def window_chan(self, chan, num=None, newest_first=False, zeroed=False, raw=False):
+        '''
+        ordered views (t, y) of the last num values of a single channel (all valid values if None), without copying data
+        -> works for synchronous and asynchronous (channel-wise updated) data, t are seconds (calculated)
+        zeroed .. True -> zero corrected y-values (a new array)
+        raw .. quantized storage: True -> raw values (view), False -> decoded values (a new array)
+        '''
+        count = int(self.index_chan[chan]) if self.is_async else self.count
+        valid = min(count, self.max_y_short)
+        num = valid if num is None else max(0, min(int(num), valid))
+        end = count % self.max_y_short + self.max_y_short
+        if newest_first:
+            stop = end - 1 - num
+            sel = slice(end-1, (stop if stop >= 0 else None), -1)
+        else:
+            sel = slice(end-num, end)
+        t = self.to_seconds(self._ring_tc[sel, chan] if self.is_async else self._ring_ts[sel], chan)
+        if raw: return (t, self._ring_y[sel, chan])
+        y = self.decode(self._ring_y[sel, chan], chan)
+        if zeroed: return (t, y - self.md_zero_y[0, chan])
+        return (t, y)
+    
+    def _hist_spill(self, upto):
+        '''
+        writes all rows with absolute row number < upto, which are not yet in the long-term history (must be in the window)
+        '''
+        first = self.count - self.index #absolute row number of the oldest window row
+        start = max(self.count_spilled, first)
+        if upto > start:
+            self.hist.write(self.window_y(raw=True)[start-first:upto-first], self.window_ts()[start-first:upto-first])
+        self.count_spilled = max(self.count_spilled, upto)
+    
+    def history(self, start=None, stop=None, raw=False):
+        '''
+        returns (t, y) of the long-term history tier for the absolute history rows [start, stop) -> zero-copy memmap slices,
+        see meas_history.MeasurementHistory.rows()
+            raw .. True -> shared int64 timestamps (rows, 1) and raw y-values
+                   False -> seconds for each channel and decoded y-values (if quantized)
+        '''
+        if self.hist is None: raise AssertionError("long-term history is not enabled (use_hist)")
+        t, y = self.hist.rows(start, stop)
+        if raw: return (t, y)
+        return (self.to_seconds(t[:, 0]), self.decode(y))
+    
+    def index_of(self, t, side="left", ns=False):
+        '''
+        absolute row number for the time t (seconds since start, ns=True -> int64 ns since start) -> binary search
+        (numpy.searchsorted) of the window timestamps and the long-term history tier, O(log n) without scanning
+            side .. "left" -> first row with time >= t, "right" -> first row with time > t
+        times before the oldest available row return the oldest row, times after the newest row return self.count
+        '''
+        if self.is_async: raise TypeError("asynchronous measurement data -> use window_chan()")
+        ts = int(t) if ns else round(float(t)*DEF_NS_PER_S)
+        first = self.count - self.index
+        i = int(np.searchsorted(self.window_ts(), ts, side=side)) #mirrored ring -> contiguous view, no wraparound
+        if i > 0 or self.hist is None or self.hist.count == self.hist.first(): return first + i
+        return min(self.hist.search(ts, side), first)
+    
+    def rows_of(self, t0=None, t1=None, last=None, ns=False):
+        '''
+        absolute rows [start, stop) of the time range [t0, t1] (None -> oldest/newest available row)
+            last .. the last seconds (ns) up to the newest row instead of t0, i.e., last=10.0 -> the last 10 seconds
+        '''
+        if last is not None and self.index > 0:
+            t0 = int(self._ring_ts[self.head-1]) - (int(last) if ns else round(float(last)*DEF_NS_PER_S))
+            ns = True
+        start = self.count - self.index
+        if self.hist is not None: start = min(start, self.hist.first())
+        if t0 is not None: start = self.index_of(t0, "left", ns)
+        stop = self.count if t1 is None else self.index_of(t1, "right", ns)
+        return (start, max(start, stop))
+    
+    def rows(self, start=None, stop=None, raw=False):
+        '''
+        returns (ts, y) of the absolute rows [start, stop) -> ts int64 ns (n,), y (n, max_chans)
+            - zero-copy views, if the rows are inside the window or inside the history (not split by its wraparound)
+            - rows spanning the history and the window are concatenated (a copy)
+        raw .. quantized storage: True -> raw values, False -> decoded values (a new array)
+        '''
+        first = self.count - self.index
+        start = first if start is None else int(start)
+        stop = self.count if stop is None else int(stop)
+        if start >= first:
+            if stop > self.count: raise IndexError(f"rows [{start}, {stop}) not available, newest is {self.count-1}")
+            ts, y = self.window_ts()[start-first:stop-first], self.window_y(raw=True)[start-first:stop-first]
+        else:
+            if self.hist is None: raise IndexError(f"rows [{start}, {stop}) not available, oldest is {first}")
+            stop_hist = min(stop, self.hist.count) #history and window overlap after finalize()
+            ts, y = self.hist.rows(start, stop_hist)
+            ts = ts[:, 0]
+            if stop > stop_hist:
+                ts = np.concatenate((ts, self.window_ts()[stop_hist-first:stop-first]))
+                y = np.concatenate((y, self.window_y(raw=True)[stop_hist-first:stop-first]))
+        return (ts, y if raw else self.decode(y))
+    
+    def select_time(self, t0=None, t1=None, last=None, raw=False, ns=False):
+        '''
+        returns (ts, y) of all rows in the time range [t0, t1] (seconds since start, ns=True -> int64 ns) via binary search
+        -> i.e., marker deltas, zoom windows, report excerpts and trigger context, see rows_of() and rows()
+        '''
+        return self.rows(*self.rows_of(t0, t1, last, ns), raw=raw)
+    
+    def _pyr_feed(self):
+        '''
+        feeds all window rows not yet in the decimation pyramid (rows [count_pyr, count))
+        '''
+        num = self.count - self.count_pyr
+        if num > 0:
+            self.pyr.update(self.window_y(num), self.window_t(num, per_chan=False))
+            self.count_pyr = self.count
+    
+    def _stats_feed(self):
+        '''
+        feeds all window rows not yet in the running statistics (rows [count_stats, count))
+        '''
+        num = self.count - self.count_stats
+        if num > 0:
+            block = meas_stats.block_reduce(self.window_y(num))
+            self.stats_all.merge(block)
+            self.stats_zero.merge(block)
+            self.count_stats = self.count
+    
+    def stats(self, kind="all", zeroed=False):
+        '''
+        returns running statistics (meas_stats.RunningStats) for all channels, query the values via the object, i.e.,
+        mdata.stats("zero").mean, mdata.stats().rms(), mdata.stats("window").p2p()
+            kind .. "all" -> whole session (since init_data()), "zero" -> since the last zeroing, 
+                    "window" -> current window (calculated once per new data, cached)
+            zeroed .. True -> statistics of the zero corrected values (a shifted copy, O(channels))
+        '''
+        if kind == "window":
+            if self._stats_win is None or self._stats_win[0] != self.count:
+                self._stats_win = (self.count, meas_stats.stats_from(self.window_y(), self.max_chans))
+            stats = self._stats_win[1]
+        elif self.stats_all is None: 
+            raise AssertionError("running statistics are not enabled (use_stats)")
+        elif kind == "all": 
+            self._stats_feed()
+            stats = self.stats_all
+        elif kind == "zero": 
+            self._stats_feed()
+            stats = self.stats_zero
+        else: 
+            raise ValueError(f"unknown statistics: {kind}")
+        return stats.shifted(-self.md_zero_y[0]) if zeroed else stats
+    
+    def decimate(self, points, t0=None, t1=None):
+        '''
+        returns data of the time range [t0, t1] with at most (about) points rows for plotting: (t, y_min, y_max, y_mean)
+            - raw rows from the current window, if the range is covered by the window and fits into points
+            - decimation pyramid buckets otherwise (see meas_pyramid.MeasurementPyramid.select()) -> O(points)
+        t .. time vector (time of first sample of a bucket), y_XXX .. (n, max_chans)
+        '''
+        first = self.count - self.index
+        win_ts = self.window_ts()
+        i0 = 0 if t0 is None else int(np.searchsorted(win_ts, round(t0*DEF_NS_PER_S), side="left"))
+        i1 = self.index if t1 is None else int(np.searchsorted(win_ts, round(t1*DEF_NS_PER_S), side="right"))
+        covered = (i0 > 0) or (first == 0) #range starts inside the window
+        if self.pyr is not None: self._pyr_feed() #newest rows
+        if self.pyr is None or (covered and i1 - i0 <= points):
+            win_y = self.window_y()[i0:i1]
+            return (win_ts[i0:i1] / DEF_NS_PER_S, win_y, win_y, win_y)
+        return self.pyr.select(points, t0, t1)[0:4]
+    
     def calculate(self):
         '''
         calculate all dependent data -> zero data and any user specific data
         '''
-        pass
+        if self.stats_all is not None: self._stats_feed()
 
     def finalize(self, finalized=True):
         '''
@@ -262,6 +894,9 @@ class MeasurementData(MeasurementInfoData):
         '''
         self.is_finalized  = finalized
         self.calculate()
+        if self.hist is not None: #the complete measurement goes to disk
+            self._hist_spill(self.count)
+            self.hist.flush()
              
     #convenience functions
     def last(self):
@@ -269,15 +904,27 @@ class MeasurementData(MeasurementInfoData):
         return the last channel data with a time vector and a value vector 
             (t[..], y[..])
         '''
-        return (self.md_current_t[self.index], self.md_current_t[self.index] )
+        return (self.last_t(), self.last_y())
     
-    def last_y(self):
-        ''' returns last values (y) '''
-        return self.md_current_y[self.index-1]
+    def last_y(self, zeroed=False, raw=False):
+        ''' 
+        returns last values (y) -> newest value of each channel in asynchronous mode, zeroed -> zero corrected, 
+        raw -> raw values of quantized storage 
+        '''
+        if self.is_async: 
+            last = self._ring_y[(self.index_chan-1) % self.max_y_short + self.max_y_short, np.arange(self.max_chans)]
+        else:
+            last = self._ring_y[self.head+self.max_y_short-1]
+        if raw: return last
+        last = self.decode(last)
+        return last - self.md_zero_y[0] if zeroed else last
    
     def last_t(self):
-        ''' returns last values (t) '''
-        return self.md_current_t[self.index-1]
+        ''' returns last values (t) in seconds -> newest value of each channel in asynchronous mode '''
+        if self.is_async: 
+            ts = self._ring_tc[(self.index_chan-1) % self.max_y_short + self.max_y_short, np.arange(self.max_chans)]
+            return ts / DEF_NS_PER_S + self.t_offset
+        return self.to_seconds(self._ring_ts[self.head+self.max_y_short-1])
             
     def show_current(self):
         print(self.md_current_y)
@@ -363,9 +1010,347 @@ def test_usage_regular():
     mdataBKM = MeasurementDataBKM()
         
     return True
+
+def test_ring_ordered_views():
+    '''
+    ring buffer: ordered views must match the sliding window behaviour (oldest first / newest first)
+    '''
+    max_chans = 3
+    depth = 8
+    mdata = MeasurementData([x for x in range(0,max_chans)], max_short=depth)
+    for i in range(0,5):
+        mdata.update([i]*max_chans, [i*0.1]*max_chans)
+    assert mdata.index == 5
+    assert list(mdata.window_y()[:,0]) == [0,1,2,3,4]
+    assert list(mdata.window_y(newest_first=True)[:,0]) == [4,3,2,1,0]
+    assert np.all(np.isnan(mdata.md_current_y[5:,:])) #not yet written rows
+    
+    for i in range(5,21): #saturate and wrap around several times
+        mdata.update([i]*max_chans, [i*0.1]*max_chans)
+        expected = list(range(max(0,i+1-depth), i+1))
+        assert list(mdata.md_current_y[:mdata.index,1]) == expected
+        assert list(mdata.window_y(newest_first=True)[:,2]) == expected[::-1]
+        assert mdata.last_y()[0] == i
+        assert np.isclose(mdata.last_t()[0], i*0.1)
+    assert mdata.index == depth
+    assert mdata.count == 21
+    assert list(mdata.window_y(3)[:,0]) == [18,19,20]
+    assert list(mdata.window_y(3, newest_first=True)[:,0]) == [20,19,18]
+    assert np.shares_memory(mdata.window_y(), mdata._ring_y) #no copies
+    assert mdata.zero_set()[0][0] == 20
+
+def test_update_block():
+    '''
+    block ingest must give the same window as row-wise ingest (including wraparound and blocks larger than the window)
+    '''
+    max_chans = 4
+    depth = 10
+    mdata_rows = MeasurementData([x for x in range(0,max_chans)], max_short=depth)
+    mdata_block = MeasurementData([x for x in range(0,max_chans)], max_short=depth)
+    start = 0
+    for num in [3, 1, 7, 0, 10, 25, 4]:
+        block_y = np.arange(start*max_chans, (start+num)*max_chans, dtype=float).reshape(num, max_chans)
+        block_t = np.arange(start, start+num, dtype=float)*0.5
+        for i in range(0,num): mdata_rows.update(block_y[i], [block_t[i]]*max_chans)
+        assert mdata_block.update_block(block_y, block_t) == mdata_rows.index
+        start += num
+        assert mdata_block.count == mdata_rows.count
+        assert mdata_block.head == mdata_rows.head
+        assert np.array_equal(mdata_block.window_y(), mdata_rows.window_y())
+        assert np.array_equal(mdata_block.window_t(), mdata_rows.window_t())
+    with pytest.raises(TypeError):
+        mdata_block.update_block(np.zeros(shape=(2, max_chans+1)))
+    mdata_block.finalize()
+    with pytest.raises(ErrorFinalizedWrite):
+        mdata_block.update_block(np.zeros(shape=(2, max_chans)))
+
+def test_history_spill(tmp_path):
+    '''
+    rows leaving the short window must arrive in the long-term history in order (row and block updates)
+    '''
+    max_chans = 2
+    mdata = MeasurementData([x for x in range(0,max_chans)], max_short=4, max_long=100, 
+                            use_hist=True, p_dir_hist=str(tmp_path), hist_name="spill")
+    for i in range(0,6): mdata.update([i]*max_chans, [i]*max_chans)
+    assert mdata.hist.count == 2
+    mdata.update_block(np.arange(6, 16).repeat(max_chans).reshape(10, max_chans))
+    assert mdata.hist.count == 12
+    mdata.update_block(np.full(shape=(1, max_chans), fill_value=16))
+    t, y = mdata.history()
+    assert list(y[:,1]) == list(range(0, 13))
+    assert list(t[0:6,0]) == list(range(0, 6))
+    mdata.finalize()
+    assert mdata.hist.count == 17
+    hist = meas_history.load_history("spill", p_dir=str(tmp_path))
+    assert list(hist.rows()[1][:,0]) == list(range(0, 17))
+
+    #generated names: objects created in the same second must not share (truncate) the history files
+    mdatas = [MeasurementData([0], max_short=4, max_long=10, use_hist=True, p_dir_hist=str(tmp_path)) for _ in range(3)]
+    assert len(set(m.hist.fp_y for m in mdatas)) == 3
+    for i, m in enumerate(mdatas): m.update_block(np.full(shape=(6, 1), fill_value=i))
+    assert [m.history()[1][0,0] for m in mdatas] == [0, 1, 2]
+
+def test_decimate():
+    '''
+    zoomed in -> raw window rows, zoomed out -> min/max pyramid buckets
+    '''
+    max_chans = 2
+    mdata = MeasurementData([x for x in range(0,max_chans)], max_short=100, max_long=10000, pyr_levels=(8, 64))
+    for i in range(0,10): mdata.update([i, -i], [i*0.01]*max_chans)
+    data = np.arange(10, 5000, dtype=float)
+    mdata.update_block(np.stack((data, -data), axis=1), data*0.01)
+    t, y_min, y_max, y_mean = mdata.decimate(points=50, t0=49.595)
+    assert len(t) == 40 and y_min is y_max and y_min[0,0] == 4960
+    t, y_min, y_max, y_mean = mdata.decimate(points=100)
+    assert len(t) == 5000 // 64
+    assert y_min[0,0] == 0 and y_max[0,0] == 63 and y_min[0,1] == -63 and y_mean[0,0] == 31.5
+
+def test_snapshot_concurrent():
+    '''
+    a reader thread must never see torn rows, while a writer thread is adding rows (each row holds a single value)
+    '''
+    max_chans = 16
+    mdata = MeasurementData([x for x in range(0,max_chans)], max_short=64)
+    errors = []
+    done = threading.Event()
+    
+    def reader():
+        while not done.is_set():
+            t, y, count = mdata.snapshot(num=16)
+            if len(y) == 0: continue
+            if not np.all(y == y[:, 0:1]): errors.append("torn row")
+            if not np.array_equal(y[:, 0], np.arange(count-len(y), count)): errors.append("inconsistent window")
+    
+    th = threading.Thread(target=reader)
+    th.start()
+    try:
+        for i in range(0, 20000, 4):
+            if i % 8: mdata.update([i]*max_chans)
+            else: mdata.update_block(np.arange(i, i+4).repeat(max_chans).reshape(4, max_chans))
+            if i % 8: mdata.update_block(np.arange(i+1, i+4).repeat(max_chans).reshape(3, max_chans))
+    finally:
+        done.set()
+        th.join()
+    assert errors == []
+    t, y, count = mdata.snapshot(num=3, newest_first=True)
+    assert count == 20000 and list(y[:,5]) == [19999, 19998, 19997]
+
+def test_update_chans():
+    '''
+    channel-wise updates: channels with different rates, each channel keeps its own history and timestamps
+    '''
+    max_chans = 4
+    mdata = MeasurementData([x for x in range(0,max_chans)], max_short=5)
+    mdata.update([0]*max_chans, [0.0]*max_chans) #synchronous start
+    for i in range(1,13):
+        mdata.update_chans([0,1], [i, -i], i*0.1) #fast sensor (two channels)
+        if i % 4 == 0: mdata.update_chans([3], [i*100], [i*0.1]) #slow sensor
+    assert list(mdata.index_chan) == [13, 13, 1, 4]
+    t, y = mdata.window_chan(0)
+    assert list(y) == [8, 9, 10, 11, 12] and np.allclose(t, [0.8, 0.9, 1.0, 1.1, 1.2])
+    assert list(mdata.window_chan(1, 2, newest_first=True)[1]) == [-12, -11]
+    assert list(mdata.window_chan(3)[1]) == [0, 400, 800, 1200]
+    assert list(mdata.window_chan(2)[1]) == [0]
+    assert list(mdata.last_y()) == [12, -12, 0, 1200]
+    with pytest.raises(TypeError):
+        mdata.update([1]*max_chans)
+    mdata.init_data() #back to synchronous data
+    mdata.update([1]*max_chans)
+    assert list(mdata.window_chan(2)[1]) == [1]
+
+def test_stats():
+    '''
+    running statistics: session, since zeroing and window (row-wise and block-wise updates)
+    '''
+    max_chans = 3
+    rows = np.random.default_rng(3).normal(size=(300, max_chans)).astype(np.float32)
+    mdata = MeasurementData([x for x in range(0,max_chans)], max_short=50)
+    for i in range(0,100): mdata.update(rows[i])
+    mdata.update_block(rows[100:170])
+    assert mdata.stats().n == 170 and np.allclose(mdata.stats().mean, rows[:170].mean(axis=0), atol=1e-6)
+    mdata.zero_set()
+    for i in range(170,200): mdata.update(rows[i])
+    mdata.update_block(rows[200:300])
+    zero = mdata.stats("zero")
+    assert zero.n == 130 and np.allclose(zero.std(), rows[170:].std(axis=0), atol=1e-6)
+    assert np.array_equal(zero.max, rows[170:].max(axis=0))
+    assert mdata.stats("all").n == 300
+    assert np.allclose(mdata.stats("window").rms(), np.sqrt((rows[250:].astype(float)**2).mean(axis=0)))
+    with pytest.raises(ValueError):
+        mdata.stats("unknown")
+
+def test_zeroed_views():
+    '''
+    zero correction is applied on read, the raw data is untouched and the zero can be changed afterwards
+    '''
+    max_chans = 3
+    mdata = MeasurementData([x for x in range(0,max_chans)], max_short=10)
+    for i in range(0,20): mdata.update([i, 10*i, 100*i])
+    mdata.zero_set()
+    assert list(mdata.window_y(2, zeroed=True)[-1]) == [0, 0, 0]
+    assert list(mdata.window_y(2)[-1]) == [19, 190, 1900] #raw data
+    mdata.zero_set([10, 100, 1000]) #re-zeroing after the fact
+    assert list(mdata.window_y(1, zeroed=True)[0]) == [9, 90, 900]
+    assert list(mdata.last_y(zeroed=True)) == [9, 90, 900]
+    assert list(mdata.window_chan(1, 2, zeroed=True)[1]) == [80, 90]
+    t, y, count = mdata.snapshot(3, zeroed=True)
+    assert list(y[:,0]) == [7, 8, 9] and list(mdata.window_y(3)[:,0]) == [17, 18, 19]
+    t, y, count = mdata.snapshot(3, copy=False, zeroed=True)
+    assert list(y[:,2]) == [700, 800, 900]
+    stats = mdata.stats("window", zeroed=True)
+    assert stats.mean[0] == 4.5 and stats.min[2] == 0 and stats.std()[0] == mdata.stats("window").std()[0]
+
+def test_save_hold():
+    '''
+    HOLD/SAVE: the window is saved without copying, rows are copied right before the ring overwrites them
+    '''
+    max_chans = 2
+    mdata = MeasurementData([x for x in range(0,max_chans)], max_short=10)
+    for i in range(0,15): mdata.update([i, -i], [i, i])
+    mdata.save("HOLD", saveinfo="hold 1")
+    mdata.save("SAVE", saveinfo="range", t0=11, t1=12)
+    snap = mdata.saved(0)
+    assert snap.info == "hold 1" and snap.start == 5 and not snap.is_copy
+    assert np.shares_memory(snap.y, mdata._ring_y) and list(snap.y[:,0]) == list(range(5,15))
+    assert list(mdata.saved().t) == [11, 12] and mdata.saved().start == 11
+    for i in range(15,30): mdata.update([i, -i], [i, i]) #rows 5.. are overwritten
+    assert snap.is_copy and mdata.saved(1).is_copy and mdata.held_limit == float("inf")
+    assert list(snap.y[:,1]) == list(range(-5,-15,-1)) and list(mdata.saved().y[:,0]) == [11, 12]
+    mdata.save("HOLD")
+    mdata.update_block(np.ones((10, max_chans)))
+    assert mdata.saved().is_copy and list(mdata.saved().y[:,0]) == list(range(20,30))
+    
+    #concurrent writer: every saved row must be consistent (y = t)
+    for i in range(30,40): mdata.update([i, i], [i, i])
+    stop = threading.Event()
+    def writer():
+        i = 40
+        while not stop.is_set():
+            mdata.update([i, i], [i, i])
+            i += 1
+    th = threading.Thread(target=writer)
+    th.start()
+    try:
+        snaps = [mdata.saved(mdata.save("HOLD")[0]-1) for i in range(0,200)]
+    finally:
+        stop.set()
+        th.join()
+    for snap in snaps:
+        assert np.array_equal(snap.y[:,0], snap.t) and np.all(np.diff(snap.t) == 1)
+
+def test_quantized():
+    '''
+    quantized storage: raw int16 values in the ring and the history, decoded values on read
+    '''
+    max_chans = 2
+    mdata = MeasurementData([x for x in range(0,max_chans)], max_short=8, dtype=np.int16, scale=[0.01, 0.5], 
+                            offset=[0.0, -100.0])
+    assert mdata._ring_y.dtype == np.int16 and mdata._ring_ts.dtype == np.int64
+    for i in range(0,20): mdata.update([i*100, i], [i, i])
+    mdata.update_block(mdata.encode(np.array([[20.0, -90.0], [21.0, -89.5]])), [20, 21])
+    assert list(mdata.window_y(2, raw=True)[:,0]) == [2000, 2100]
+    assert np.allclose(mdata.window_y(3), [[19, -90.5], [20, -90], [21, -89.5]])
+    assert np.allclose(mdata.window_chan(1, 1)[1], [-89.5]) and np.allclose(mdata.last_y(), [21, -89.5])
+    mdata.zero_set()
+    assert np.allclose(mdata.snapshot(2, zeroed=True)[1], [[-1, -0.5], [0, 0]])
+    assert np.allclose(mdata.stats("all").max, [21, -89.5]) and np.allclose(mdata.decimate(100)[2][0], [7, -96.5])
+    mdata.save("HOLD")
+    assert mdata.saved().y.dtype == np.int16 and np.allclose(mdata.saved().values()[-1], [21, -89.5])
+    mdata.set_scale(scale=[0.02, 1.0]) #changing the decoding afterwards
+    assert np.allclose(mdata.last_y(), [42, -79])
+    assert mdata.encode([1000.0, 0.0])[0] == 32767 #clipped
+
+def test_timestamps():
+    '''
+    shared int64 timestamps: exact for long runs, per-channel offsets, sensor clock and channel-wise time columns
+    '''
+    max_chans = 3
+    mdata = MeasurementData([x for x in range(0,max_chans)], max_short=10, t_offset=[0.0, 0.0, -0.5])
+    day = 86400*DEF_NS_PER_S
+    for i in range(0,5): mdata.update([i]*max_chans, t_ns=day + i*1000) #1 us steps after one day
+    assert list(np.diff(mdata.window_ts())) == [1000]*4 and mdata._ring_ts.nbytes == 2*10*8
+    assert np.isclose(mdata.last_t()[0], 86400.000004) and np.isclose(mdata.last_t()[2], 86399.500004)
+    mdata.update_block(np.ones((2, max_chans)), t_ns=[day + 5000, day + 6000])
+    t, y, count = mdata.snapshot(2, ts=True)
+    assert list(t) == [day + 5000, day + 6000] and mdata.snapshot(2)[0].shape == (2, max_chans)
+    mdata.update([7]*max_chans) #internal monotonic timestamp (restarted measurement clock)
+    mdata.update_chans([1], [8], 100.25)
+    assert list(mdata.window_chan(1, 2)[0]) == [mdata.window_t(1, per_chan=False)[0], 100.25]
+    assert mdata.window_chan(0, 1)[0][0] == mdata.window_t(1, per_chan=False)[0]
+
+def test_time_index(tmp_path):
+    '''
+    binary search time index over the window and the long-term history (ring wraparound of both), zero-copy slices
+    '''
+    max_chans = 2
+    mdata = MeasurementData([x for x in range(0,max_chans)], max_short=50, max_long=120, dtype=np.int16, scale=0.5,
+                            use_hist=True, p_dir_hist=str(tmp_path), hist_name="tindex")
+    rows = np.arange(0, 2*300, dtype=np.int16).reshape(300, max_chans)
+    mdata.update_block(rows[:170], np.arange(0, 170) * 0.1)
+    for i in range(170, 300): mdata.update(rows[i], i * 0.1)
+    assert mdata.count - mdata.index == 250 and mdata.hist.first() == 130 #both rings wrapped
+
+    assert mdata.index_of(26.0) == 260 and mdata.index_of(26.0, side="right") == 261 and mdata.index_of(26.01) == 261
+    assert mdata.index_of(15.0) == 150 and mdata.index_of(0.0) == 130 and mdata.index_of(99.0) == 300
+    ts, y = mdata.select_time(26.0, 27.0, raw=True)
+    assert list(ts) == [i*100000000 for i in range(260, 271)] and np.shares_memory(y, mdata._ring_y)
+    assert np.array_equal(y, rows[260:271])
+    ts, y = mdata.select_time(14.0, 14.5)
+    assert list(y[:, 0]) == [i*max_chans*0.5 for i in range(140, 146)] and np.shares_memory(ts, mdata.hist.md_t)
+    ts, y = mdata.select_time(24.0, 25.5) #history and window
+    assert list(ts) == [i*100000000 for i in range(240, 256)] and np.array_equal(y, rows[240:256]*0.5)
+    ts, y = mdata.select_time(last=1.0, raw=True)
+    assert list(y[:, 1]) == list(rows[289:300, 1]) and mdata.rows_of() == (130, 300)
+    assert mdata.rows_of(31.0, 40.0) == (300, 300) and len(mdata.select_time(31.0)[0]) == 0
+    mdata.finalize() #history overlaps the window
+    assert np.array_equal(mdata.select_time(20.0, raw=True)[1], rows[200:300])
+
+def bench_update_block(max_chans=32, depth=5000, samples=20000, blocksize=64):
+    '''
+    microbenchmark: row-wise update() against update_block() for bursty (packet based) data
+    '''
+    rows = np.ones(shape=(samples, max_chans), dtype=DEF_DATATYPE)
+    mdata = MeasurementData([x for x in range(0,max_chans)], max_short=depth)
+    t0 = time.perf_counter()
+    for i in range(0,samples): mdata.update(rows[i])
+    t_rows = (time.perf_counter()-t0)/samples
+    mdata = MeasurementData([x for x in range(0,max_chans)], max_short=depth)
+    t0 = time.perf_counter()
+    for i in range(0,samples,blocksize): mdata.update_block(rows[i:i+blocksize])
+    t_block = (time.perf_counter()-t0)/samples
+    print("bench update_block: N=%i chans=%i -> row: %6.2f us/sample | block: %6.3f us/sample | x%.1f" % 
+          (blocksize, max_chans, t_rows*1e6, t_block*1e6, t_rows/t_block))
+    return (t_rows, t_block)
+
+def bench_update_depth(depths=(50, 500, 5000, 50000), max_chans=32, samples=20000):
+    '''
+    microbenchmark: cost per update() for different window depths, must stay constant (O(1) appends)
+    '''
+    row = [1.0]*max_chans
+    res = {}
+    for depth in depths:
+        mdata = MeasurementData([x for x in range(0,max_chans)], max_short=depth)
+        for i in range(0,depth): mdata.update(row) #saturate first, we want the steady state
+        t0 = time.perf_counter()
+        for i in range(0,samples): mdata.update(row)
+        res[depth] = (time.perf_counter()-t0)/samples
+        print("bench update: depth=%6i chans=%i -> %6.2f us/sample" % (depth, max_chans, res[depth]*1e6))
+    return res
     
 if __name__ == '__main__':
     print("running: measdata.py")
     test_usage_regular()
+    test_ring_ordered_views()
+    test_update_block()
+    test_decimate()
+    test_snapshot_concurrent()
+    test_update_chans()
+    test_stats()
+    test_zeroed_views()
+    test_save_hold()
+    test_quantized()
+    test_timestamps()
     print(testdata_oscilloscope_block_update(7))
+    bench_update_depth()
+    bench_update_block()
     print("done")
\ No newline at end of file
@@ -147,6 +147,11 @@ class MeasurementSystemXKM(DataFieldsSystem):
         self.chans_out = [] #all output sensor channels
         self.chans_in = []  #all input sensor channels
         
+        #measurement data arrays shared by all sensors (see md_layout_plan())
+        self.md_in = None
+        self.md_out = None
+        self.md_ring = None #shared ring (head) of the arrays
+        
         #process information based on the 
         for i,sen in enumerate(self.sensors):
             try:
@@ -233,6 +238,44 @@ class MeasurementSystemXKM(DataFieldsSystem):
             sen.process()
         self.sensors_lock.release()
     
+    def md_layout_plan(self, rows, initval=None, dtype=numpy.float64, mirror=True):
+        '''
+        plans the measurement data layout of all sensors (consecutive columns in the order of the sensors), allocates
+        the input and output array once and registers them for all sensors -> every sensor operates on the same buffer
+        
+        rows .. number of rows (data history) of the arrays
+        initval .. initialization value, None -> sensor specific (see SensorXKM.md_initval())
+        mirror .. mirrored ring (arrays with 2*rows rows) -> all newest first ranges are views (see sensor.SensorRing)
+        returns: input array, output array
+        
+        THREAD SAFE: yes
+        '''
+        with self.sensors_lock:
+            col_in, col_out = 0, 0
+            for sen in self.sensors:
+                col_in, col_out = sen.md_layout(col_in, col_out)
+            self.md_ring = sensor.SensorRing(rows, mirror=mirror)
+            self.md_in = numpy.empty(shape=[rows*(2 if mirror else 1), col_in], dtype=dtype)
+            self.md_out = numpy.empty(shape=[rows*(2 if mirror else 1), col_out], dtype=dtype)
+            for sen in self.sensors:
+                val = sen.md_initval() if initval is None else initval
+                if sen.chans_in_index: self.md_in[:, sen.chans_in_index[0]:sen.chans_in_index[-1]+1] = val
+                if sen.chans_out_index: self.md_out[:, sen.chans_out_index[0]:sen.chans_out_index[-1]+1] = val
+                sen.md_register(ary_in=self.md_in, ary_out=self.md_out, ring=self.md_ring)
+            if DBG_OUT: print("meassys: layout rows=%i IN=%i OUT=%i" % (rows, col_in, col_out))
+            return (self.md_in, self.md_out)
+    
+    def md_current(self, num=None):
+        '''
+        returns the newest rows of all channels (output array, input array) -> newest first, row 0 holds the newest
+        sample of every sensor (each sensor is read at its own position, sensors may run at different rates)
+        num .. number of rows (None -> all)
+        '''
+        with self.sensors_lock:
+            out = [sen.md_current_out(self.md_ring.rows if num is None else num) for sen in self.sensors]
+            inp = [sen.md_current_in(self.md_ring.rows if num is None else num) for sen in self.sensors]
+        return (numpy.concatenate(out, axis=1), numpy.concatenate(inp, axis=1))
+    
     def sensor_by_packetaddr(self, packet):
         '''
         returns sensor index from raw addr in a packet
@@ -500,14 +543,107 @@ def test_zeroing():
         s.md_update([val1]*20)
         s.md_update([val1]*20)
         for k in range(0,10): s.zero_set() #means we zero again, and first line shows zeros, we can do this inefinitly
-        assert md_out[0,i] == 0.0
+        assert s.md_current_out()[0] == 0.0 #newest row of the ring
         s.md_update([val1*5]*20)
-        assert md_out[0,i] == 800.0
+        assert s.md_current_out()[0] == 800.0 and md_out[s.md_info()["ring"].pos(s.md_count), i] == 800.0
     print(md_out)
     print(md_in)
 
 
 
+def test_layout():
+    '''
+    layout planner: same columns as the incremental md_init(), one shared buffer for all sensors
+    '''
+    sensors = [sensor.SensorXKM(appdef.DEF_SENSORTYPES.PRO_RKM_W_2CH, addr_node=i, addr_group=1,
+                                calib=appdef.DEF_CALIBRATION.TEST_1_FAKT) for i in range(1, 17)]
+    msys = MeasurementSystemXKM(sensors=sensors)
+    md_in, md_out = msys.md_layout_plan(rows=50)
+    assert md_in.shape == (100, len(msys.chans_in)) and md_out.shape == (100, len(msys.chans_out)) #mirrored
+    col_in, col_out = 0, 0
+    for sen in sensors:
+        assert sen.md_info()["ary-obj-in"] is md_in and sen.md_info()["ary-obj-out"] is md_out
+        assert sen.chans_in_index == list(range(col_in, col_in + len(sen.chans_in)))
+        assert sen.chans_out_index == list(range(col_out, col_out + len(sen.chans_out)))
+        assert numpy.all(md_in[:, sen.chans_in_index] == sen.md_initval())
+        col_in, col_out = col_in + len(sen.chans_in), col_out + len(sen.chans_out)
+    
+    #identical layout as the incremental initialization
+    ref_in, ref_out = numpy.zeros(shape=[50, 0]), numpy.zeros(shape=[50, 0])
+    for i in range(1, 17):
+        sen = sensor.SensorXKM(appdef.DEF_SENSORTYPES.PRO_RKM_W_2CH, addr_node=i, addr_group=1)
+        [ref_in, ref_out] = sen.md_init(ref_in, ref_out)
+        assert sen.chans_in_index == sensors[i-1].chans_in_index
+    assert numpy.array_equal(ref_in, md_in[:50]) and numpy.array_equal(ref_out, md_out[:50])
+    
+    #updates of a sensor are seen by all other sensors (and the system)
+    sensors[3].md_update([1.0]*len(sensors[3].chans_in))
+    assert numpy.all(msys.md_current()[1][0, sensors[3].chans_in_index] == 1.0) and msys.md_ring.count == 1
+    assert numpy.all(sensors[0].md_info()["ary-obj-in"][49, sensors[3].chans_in_index] == 1.0) #shared buffer
+    assert msys.md_current(1)[0][0, sensors[3].chans_out_index[0]] == 10.0*len(sensors[3].chans_in)
+    
+    #in place ring: ordered views (newest first), identical to the rolled reference
+    ref = numpy.full(shape=(50, 2), fill_value=sensors[5].md_initval())
+    for k in range(0, 130):
+        vals = [float(k), -float(k)]
+        sensors[5].md_update(vals)
+        ref = numpy.roll(ref, shift=1, axis=0)
+        ref[0] = vals
+    view = sensors[5].md_in()
+    assert numpy.array_equal(view, ref) and numpy.shares_memory(view, md_in)
+    assert numpy.array_equal(sensors[5].md_current_in(3), ref[:3]) and sensors[5].md_current_in()[0] == 129.0
+    assert numpy.array_equal(sensors[5].md_out()[:, 0], ref.sum(axis=1)*10.0) and msys.md_ring.count == 130
+    
+def test_current_rates():
+    '''
+    sensors updated at different rates -> row 0 of md_current() holds the newest sample of every sensor
+    '''
+    sensors = [sensor.SensorXKM(appdef.DEF_SENSORTYPES.PRO_RKM_W_2CH, addr_node=i, addr_group=1) for i in (1, 2)]
+    msys = MeasurementSystemXKM(sensors=sensors)
+    msys.md_layout_plan(rows=10, initval=0.0)
+    for k in range(1, 6): sensors[0].md_update([float(k), float(k)])
+    for k in range(1, 3): sensors[1].md_update([10.0*k, 10.0*k])
+    md_out, md_in = msys.md_current(3)
+    assert msys.md_ring.count == 5 and md_in.shape == (3, 4) and md_out.shape == (3, 2)
+    assert list(md_in[:, 0]) == [5.0, 4.0, 3.0] and list(md_in[:, 2]) == [20.0, 10.0, 0.0]
+    assert list(md_out[0]) == [10.0, 40.0]
+    md_out, md_in = msys.md_current()
+    assert md_in.shape == (10, 4) and list(md_in[0]) == [5.0, 5.0, 20.0, 20.0]
+
+def test_update_block():
+    '''
+    block update (multi sample packets) -> identical to the sample by sample update, blocks wrapping the ring
+    '''
+    rng = numpy.random.default_rng(3)
+    for mirror in (True, False):
+        systems = []
+        for _ in range(0, 2):
+            sensors = [sensor.SensorXKM(appdef.DEF_SENSORTYPES.PRO_PINT_W_CH4, addr_node=1, addr_group=4),
+                       sensor.SensorXKM(appdef.DEF_SENSORTYPES.PRO_RKM_W_2CH, addr_node=2, addr_group=1,
+                                        calib=appdef.DEF_CALIBRATION.TEST_1_FAKT)]
+            systems.append(MeasurementSystemXKM(sensors=sensors))
+            systems[-1].md_layout_plan(rows=40, mirror=mirror)
+        for num in (1, 7, 33, 40, 95, 3):
+            vals = rng.normal(size=(num, 6))
+            for k, sen in enumerate(systems[0].sensors):
+                cols = slice(0, 4) if k == 0 else slice(4, 6)
+                for row in vals[:, cols]: sen.md_update(row)
+                systems[1].sensors[k].md_update_block(vals[:, cols])
+            for sen, sen_block in zip(systems[0].sensors, systems[1].sensors):
+                assert sen.md_count == sen_block.md_count
+                assert numpy.allclose(sen.md_in(), sen_block.md_in()) and numpy.allclose(sen.md_out(), sen_block.md_out())
+            sen_block.zero_set()
+            systems[0].sensors[1].zero_set()
+        assert numpy.allclose(systems[0].md_current()[0], systems[1].md_current()[0])
+    
+    #without calibration the new output rows hold the newest output value (readers never see stale ring rows)
+    for msys in systems:
+        sen = msys.sensors[1]
+        held = sen.md_current_out(2).copy()
+        sen.md_update([7.0, 8.0], do_calib=False)
+        sen.md_update_block([[9.0, 1.0], [2.0, 3.0]], do_calib=False)
+        assert list(sen.md_current_in()) == [2.0, 3.0] and sen.md_count == msys.md_ring.count
+        assert numpy.array_equal(sen.md_current_out(5), held[[0, 0, 0, 0, 1]])
     
 if __name__ == '__main__':
     import os
@@ -516,6 +652,9 @@ if __name__ == '__main__':
     if not os.path.exists(TESTCFG_DIR): os.makedirs(TESTCFG_DIR)
     DBG_OUT = True
     test_zeroing()  
+    test_layout()
+    test_current_rates()
+    test_update_block()
     #following tests are using a plotter
     #test_matplotlib_liveview()
     #test_tool_dataview()